@@ -0,0 +1,161 @@
+import copy
+import itertools
+import multiprocessing
+import threading
+import time
+
+import psutil
+
+
+def model_class(model_type):
+    """
+    :param model_type: type of model, 'Chatbot', 'IntentNER' or 'SpeakerVerification'
+    :return: the model class, see Autotune and Sweep
+    """
+    import animius as am
+
+    if model_type == 'Chatbot':
+        return am.Chatbot.ChatbotModel
+    elif model_type == 'IntentNER':
+        return am.IntentNER.IntentNERModel
+    elif model_type == 'SpeakerVerification':
+        return am.SpeakerVerification.SpeakerVerificationModel
+    else:
+        raise KeyError("Model type \"{0}\" not found.".format(model_type))
+
+
+def _trial(model_type, model_config, data, warm_up_steps, steps, connection):
+    # runs in a separate process, so that every trial starts from a fresh memory footprint
+    process = psutil.Process()
+    peak = [process.memory_info().rss]
+    running = [True]
+
+    def sample():
+        while running[0]:
+            peak[0] = max(peak[0], process.memory_info().rss)
+            time.sleep(0.01)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+
+    try:
+        data.set_model_config(model_config)
+        if hasattr(data, 'steps_per_epoch_cache'):
+            data.steps_per_epoch_cache = None  # depends on the batch size
+
+        model = model_class(model_type)()
+        model.build_graph(model_config, data)
+        model.init_tensorflow()
+        model.training_metrics = None  # no traced calls during the timed steps
+        model.init_train_iterator()
+
+        model.run_train_steps(warm_up_steps)
+
+        start = time.perf_counter()
+        model.run_train_steps(steps)
+        elapsed = time.perf_counter() - start
+
+        model.close()
+
+        running[0] = False
+        sampler.join()
+        connection.send({'examples_per_second': steps * model.examples_per_step() / elapsed,
+                         'peak_memory': max(peak[0], process.memory_info().rss)})
+    except Exception as exc:
+        running[0] = False
+        connection.send({'error': repr(exc), 'peak_memory': peak[0]})
+    finally:
+        connection.close()
+
+
+def run_trial(model_type, model_config, data, batch_size, num_parallel_calls=None, prefetch=None,
+              warm_up_steps=5, steps=20):
+    """
+    Train a new model for a few steps in a separate process and measure its throughput
+
+    :param model_type: type of model, 'Chatbot', 'IntentNER' or 'SpeakerVerification'
+    :param model_config: model config of the model
+    :param data: training data
+    :param batch_size: batch size of the trial
+    :param num_parallel_calls: number of examples parsed in parallel (None to let tf.data tune it)
+    :param prefetch: number of batches prefetched (None to let tf.data tune it)
+    :param warm_up_steps: number of untimed steps
+    :param steps: number of timed steps
+    :return: a dict of the examples per second and the peak resident memory of the process in bytes,
+             or of the error if the trial failed
+    """
+    model_config = copy.deepcopy(model_config)
+    model_config.hyperparameters['batch_size'] = batch_size
+    model_config.hyperparameters['num_parallel_calls'] = num_parallel_calls
+    model_config.hyperparameters['prefetch'] = prefetch
+
+    # tensorflow is not fork safe
+    context = multiprocessing.get_context('spawn')
+    parent, child = context.Pipe()
+    process = context.Process(target=_trial, args=(model_type, model_config, data, warm_up_steps, steps, child))
+    process.start()
+    child.close()
+
+    try:
+        result = parent.recv()
+    except EOFError:
+        # the process died without reporting, e.g. killed for running out of memory
+        result = {'error': 'trial process exited with code {0}'.format(process.exitcode)}
+    process.join()
+
+    return result
+
+
+def autotune_pipeline(model_type, model_config, data, batch_sizes=None, parallel_calls=(None, 1, 2, 4),
+                      prefetches=(None, 1, 4), memory_limit=None, warm_up_steps=5, steps=20):
+    """
+    Search the batch size and input pipeline settings with the highest training throughput on this machine.
+    Every combination is trained for a few steps in a new process (see run_trial), batch sizes in increasing order.
+    Combinations whose peak memory exceeds memory_limit are rejected, and larger batch sizes are not tried once
+    every combination of a batch size is rejected. The best settings are written to the hyperparameters of
+    model_config.
+
+    :param model_type: type of model, 'Chatbot', 'IntentNER' or 'SpeakerVerification'
+    :param model_config: model config to tune
+    :param data: training data
+    :param batch_sizes: batch sizes to try (Optional, defaults to powers of two from 8 to 512)
+    :param parallel_calls: numbers of examples parsed in parallel to try, None lets tf.data tune it
+    :param prefetches: numbers of prefetched batches to try, None lets tf.data tune it
+    :param memory_limit: peak resident memory ceiling of a trial, in bytes (Optional)
+    :param warm_up_steps: number of untimed steps of every trial
+    :param steps: number of timed steps of every trial
+    :return: a dict of the results of every trial and the best settings
+    """
+    if batch_sizes is None:
+        batch_sizes = [2 ** i for i in range(3, 10)]
+
+    trials = []
+    best = None
+
+    for batch_size in sorted(batch_sizes):
+        accepted = False
+
+        for num_parallel_calls, prefetch in itertools.product(parallel_calls, prefetches):
+            result = run_trial(model_type, model_config, data, batch_size, num_parallel_calls, prefetch,
+                               warm_up_steps=warm_up_steps, steps=steps)
+            result.update({'batch_size': batch_size, 'num_parallel_calls': num_parallel_calls, 'prefetch': prefetch})
+            trials.append(result)
+
+            if 'error' in result or (memory_limit is not None and result['peak_memory'] > memory_limit):
+                continue
+
+            accepted = True
+            if best is None or result['examples_per_second'] > best['examples_per_second']:
+                best = result
+
+        if not accepted:
+            break  # larger batches need more memory
+
+    if best is None:
+        raise ValueError('No pipeline settings fit within the memory limit')
+
+    model_config.hyperparameters['batch_size'] = best['batch_size']
+    model_config.hyperparameters['num_parallel_calls'] = best['num_parallel_calls']
+    model_config.hyperparameters['prefetch'] = best['prefetch']
+
+    return {'trials': trials, 'best': best}
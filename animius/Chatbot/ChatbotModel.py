@@ -1,3 +1,6 @@
+import time
+
+import numpy as np
 import tensorflow as tf
 
 import animius as am
@@ -14,7 +17,11 @@ class ChatbotModel(am.Model):
         return {
             'learning_rate': 0.0001,
             'batch_size': 8,
-            'optimizer': 'adam'
+            'optimizer': 'adam',
+            'steps_per_run': 1,  # training steps per session call, see Model.build_train_loop
+            'accumulate_steps': 1,  # batches whose gradients are summed per optimizer step, see Model.minimize
+            'num_parallel_calls': None,  # parallel parsing of the training pipeline (None to let tf.data tune it)
+            'prefetch': None  # batches prefetched by the training pipeline (None to let tf.data tune it)
         }
 
     @staticmethod
@@ -25,7 +32,13 @@ class ChatbotModel(am.Model):
             'gradient_clip': 5.0,
             'node': 'gru',
             'layer': 2,
-            'beam_width': 3
+            'beam_width': 3,
+            'softmax': 'full',  # 'full', 'sampled' (sampled softmax loss when training) or 'adaptive'
+            'num_sampled': 512,  # number of words sampled by the sampled softmax
+            'adaptive_cutoffs': [2000, 10000],  # word indexes at which the adaptive softmax clusters end
+            'adaptive_factor': 4,  # reduction of the projection size of every following adaptive cluster
+            'shortlist': 0,  # number of frequent words decoded at inference (0 for the full vocabulary)
+            'projection_rank': 0  # rank of the factorized projection layer (0 for a full matrix)
         }
 
     def __init__(self):
@@ -40,16 +53,42 @@ class ChatbotModel(am.Model):
         self.infer = None
         self.train_op = None
         self.cost = None
+        self.train_cost = None  # mean cost of the batches of train_op, see Model.minimize
         self.accuracy = None
         self.tb_merged = None
 
         self.word_embedding = None
         self.init_word_embedding = False
 
+        # weights of the projection layer, see Utils.factorize
+        self.projection_kernel = None
+        self.projection_factors = None
+
         self.data_count = None
         self.iterator = None
         self.predict_dataset = None
         self.predict_iterator = None
+        self.predict_order = None
+        self.predict_x = None
+        self.predict_x_length = None
+
+        # step-by-step greedy decoding, see predict_stream
+        self.stream_x = None
+        self.stream_x_length = None
+        self.stream_encoder_state = None
+        self.stream_encoder_outputs = None
+        self.stream_encoder_final_state = None
+        self.stream_history = None
+        self.stream_history_length = None
+        self.stream_memory = None
+        self.stream_memory_length = None
+        self.stream_token = None
+        self.stream_state = None
+        self.stream_next_token = None
+        self.stream_next_state = None
+
+        # conversations by session id, see predict_conversation
+        self.conversations = am.Chatbot.ConversationStore(max_size=256)
 
     def init_dataset(self, data=None):
 
@@ -59,7 +98,8 @@ class ChatbotModel(am.Model):
 
         index_ds = tf.data.Dataset.from_tensor_slices(tf.expand_dims(tf.range(self.data_count), -1))
 
-        ds = index_ds.apply(tf.data.experimental.shuffle_and_repeat(buffer_size=self.data.steps_per_epoch))
+        ds = self.shuffle_train_indexes(index_ds, self.data.steps_per_epoch)
+        ds = ds.skip(self.train_skip)  # resume position, skipped before parsing
 
         def _py_func(x):
             # result_x, result_y, lengths_x, lengths_y, result_y_target
@@ -67,25 +107,34 @@ class ChatbotModel(am.Model):
 
         ds = ds.apply(tf.data.experimental.map_and_batch(_py_func,
                                                          self.hyperparameters['batch_size'],
-                                                         num_parallel_calls=tf.data.experimental.AUTOTUNE))
+                                                         num_parallel_calls=self.pipeline_setting('num_parallel_calls')))
 
         ds = ds.apply(tf.data.experimental.prefetch_to_device(self.config['device'],  # preload to training device
-                                                              buffer_size=tf.data.experimental.AUTOTUNE))
+                                                              buffer_size=self.pipeline_setting('prefetch')))
 
         self.dataset = ds
 
         return ds
 
     def init_predict_dataset(self):
-        index_ds = tf.data.Dataset.from_tensor_slices(tf.expand_dims(tf.range(self.data_count), -1))
+        # inputs are predicted in this order (see get_predict_order)
+        self.predict_order = tf.placeholder_with_default(tf.range(self.data_count), [None], name='ds_predict_order')
+
+        index_ds = tf.data.Dataset.from_tensor_slices(tf.expand_dims(self.predict_order, -1))
 
         def _py_func(x):
             return tf.py_func(self.data.parse, [x, True], [tf.int32, tf.int32])
 
+        def _trim(x, x_length):
+            # drop the padding shared by the whole batch
+            return x[:, :tf.reduce_max(x_length)], x_length
+
         ds = index_ds.apply(tf.data.experimental.map_and_batch(_py_func,
                                                                self.hyperparameters['batch_size'],
                                                                num_parallel_calls=tf.data.experimental.AUTOTUNE))
 
+        ds = ds.map(_trim)
+
         ds = ds.apply(tf.data.experimental.prefetch_to_device(self.config['device'],
                                                               buffer_size=tf.data.experimental.AUTOTUNE))
 
@@ -133,6 +182,12 @@ class ChatbotModel(am.Model):
                         self.init_predict_dataset()
                     self.predict_iterator = self.predict_dataset.make_initializable_iterator()
 
+                    # x, y, x_length, y_length, y_target
+                    eval_batch = self.init_eval_dataset(
+                        [tf.int32] * 5,
+                        [[None, self.model_structure['max_sequence']], [None, self.model_structure['max_sequence']],
+                         [None], [None], [None, self.model_structure['max_sequence']]])
+
             with graph.device(self.config['device']):
 
                 with tf.variable_scope('chatbot'):
@@ -151,6 +206,16 @@ class ChatbotModel(am.Model):
 
                     # just to make it easier to refer to
                     max_sequence = self.model_structure['max_sequence']
+                    # models saved before these options existed use the full softmax
+                    softmax = self.model_structure.get('softmax', 'full')
+                    shortlist_size = self.model_structure.get('shortlist', 0)
+                    if softmax not in ('full', 'sampled', 'adaptive'):
+                        raise ValueError("Unknown softmax \"{0}\"".format(softmax))
+                    if softmax == 'adaptive' and shortlist_size > 0:
+                        raise ValueError("The shortlist can only be used with the full projection layer")
+                    projection_rank = self.model_structure.get('projection_rank', 0)
+                    if softmax == 'adaptive' and projection_rank > 0:
+                        raise ValueError("The adaptive softmax cannot be factorized")
 
                     # Tensorflow placeholders
                     self.x, self.y, self.x_length, self.y_length, self.y_target = self.iterator.get_next()
@@ -167,16 +232,26 @@ class ChatbotModel(am.Model):
                         [get_gru_cell() for _ in range(self.model_structure['layer'])])
                     cell_decode = tf.contrib.rnn.MultiRNNCell(
                         [get_gru_cell() for _ in range(self.model_structure['layer'])])
-                    projection_layer = tf.layers.Dense(word_count)
+                    if softmax == 'adaptive':
+                        # the vocabulary must be sorted by frequency, see WordEmbedding.sort_by_frequency
+                        projection_layer = am.Chatbot.Softmax.AdaptiveSoftmax(
+                            int(word_count),
+                            self.model_structure.get('adaptive_cutoffs', [2000, 10000]),
+                            self.model_structure.get('adaptive_factor', 4))
+                    elif projection_rank > 0:
+                        projection_layer = am.Chatbot.Softmax.FactorizedDense(int(word_count), projection_rank)
+                    else:
+                        projection_layer = tf.layers.Dense(word_count)
 
                     # Setup model network
 
-                    def network(x, x_length, mode="train"):
+                    def network(x, x_length, mode="train", y=None, y_length=None):
 
                         x_length.set_shape((None,))
 
                         embedded_x = tf.nn.embedding_lookup(self.word_embedding, x)
-                        embedded_x.set_shape([None, self.model_structure['max_sequence'], n_vector])
+                        # predict batches are trimmed to their longest input
+                        embedded_x.set_shape([None, max_sequence if mode == "train" else None, n_vector])
 
                         encoder_outputs, encoder_state = tf.nn.dynamic_rnn(
                             cell_encode,
@@ -186,7 +261,11 @@ class ChatbotModel(am.Model):
 
                         if mode == "train":
 
-                            with tf.variable_scope('decode'):
+                            if y is None:
+                                y, y_length = self.y, self.y_length
+
+                            # reused by the training loop, see build_train_loop
+                            with tf.variable_scope('decode', reuse=tf.AUTO_REUSE):
                                 # attention
                                 attention_mechanism = tf.contrib.seq2seq.BahdanauAttention(
                                     num_units=self.model_structure['n_hidden'], memory=encoder_outputs,
@@ -199,20 +278,27 @@ class ChatbotModel(am.Model):
                                                                                      batch_size=tf.shape(x)[0]
                                                                                      ).clone(cell_state=encoder_state)
 
-                                embedded_y = tf.nn.embedding_lookup(self.word_embedding, self.y)
+                                embedded_y = tf.nn.embedding_lookup(self.word_embedding, y)
                                 embedded_y.set_shape([None, self.model_structure['max_sequence'], n_vector])
 
                                 train_helper = tf.contrib.seq2seq.TrainingHelper(
                                     inputs=embedded_y,
-                                    sequence_length=self.y_length
+                                    sequence_length=y_length
                                 )
 
+                                if softmax != 'full':
+                                    # the sampled and adaptive losses project the decoder outputs themselves,
+                                    # only create the weights here
+                                    # (in the same scope as the full softmax, so checkpoints stay compatible)
+                                    with tf.variable_scope('decoder'):
+                                        projection_layer(tf.zeros([1, self.model_structure['n_hidden']]))
+
                                 # attention
                                 decoder = tf.contrib.seq2seq.BasicDecoder(
                                     attn_decoder_cell,
                                     train_helper,
                                     decoder_initial_state,
-                                    output_layer=projection_layer
+                                    output_layer=projection_layer if softmax == 'full' else None
                                 )
                                 outputs, _, _ = tf.contrib.seq2seq.dynamic_decode(decoder, maximum_iterations=max_sequence)
 
@@ -241,45 +327,127 @@ class ChatbotModel(am.Model):
                                     batch_size=tf.shape(x)[0] * beam_width
                                 ).clone(cell_state=encoder_state_beam)
 
+                                if shortlist_size > 0:
+                                    # only score the frequent words and the words of the inputs
+                                    shortlist = am.Chatbot.Softmax.get_shortlist(x, shortlist_size, int(word_count))
+                                    output_layer = am.Chatbot.Softmax.ShortlistProjection(projection_layer, shortlist)
+
+                                    def embedding(ids):
+                                        return tf.nn.embedding_lookup(self.word_embedding, tf.gather(shortlist, ids))
+                                else:
+                                    output_layer = projection_layer
+                                    embedding = self.word_embedding
+
+                                # <GO> and <EOS> keep their index in the shortlist
                                 decoder = tf.contrib.seq2seq.BeamSearchDecoder(
                                     cell=attn_decoder_cell,
-                                    embedding=self.word_embedding,
+                                    embedding=embedding,
                                     start_tokens=tf.tile(tf.constant([am.WordEmbedding.GO], dtype=tf.int32),
                                                          [tf.shape(x)[0]]),
                                     end_token=am.WordEmbedding.EOS,
                                     initial_state=decoder_initial_state,
                                     beam_width=beam_width,
-                                    output_layer=projection_layer,
+                                    output_layer=output_layer,
                                     length_penalty_weight=0.0
                                 )
 
                                 outputs, _, _ = tf.contrib.seq2seq.dynamic_decode(decoder, maximum_iterations=max_sequence)
 
-                                return tf.transpose(outputs.predicted_ids, perm=[0, 2, 1],
+                                predicted_ids = outputs.predicted_ids
+                                if shortlist_size > 0:
+                                    predicted_ids = tf.gather(shortlist, predicted_ids)
+
+                                return tf.transpose(predicted_ids, perm=[0, 2, 1],
                                                     name='output_infer')  # [batch size, beam width, sequence length]
 
                     # Optimization
-                    dynamic_max_sequence = tf.reduce_max(self.y_length)
-                    mask = tf.sequence_mask(self.y_length, maxlen=dynamic_max_sequence, dtype=tf.float32)
+                    def get_cost(x, x_length, y, y_length, y_target, name=None):
+                        dynamic_max_sequence = tf.reduce_max(y_length)
+                        mask = tf.sequence_mask(y_length, maxlen=dynamic_max_sequence, dtype=tf.float32)
+
+                        # Manual cost
+                        # crossent = tf.nn.sparse_softmax_cross_entropy_with_logits(
+                        #     labels=self.y_target[:, :dynamic_max_sequence], logits=self.network())
+                        # self.cost = tf.reduce_sum(crossent * mask) / tf.cast(tf.shape(self.y)[0], tf.float32)
+
+                        if softmax == 'sampled':
+                            # softmax over the target and a sample of words, drawn from a log-uniform distribution
+                            # (the vocabulary is sorted by frequency)
+                            decoder_outputs = network(x, x_length, y=y, y_length=y_length)
+                            crossent = tf.nn.sampled_softmax_loss(
+                                weights=tf.transpose(projection_layer.kernel),
+                                biases=projection_layer.bias,
+                                labels=tf.reshape(y_target[:, :dynamic_max_sequence], [-1, 1]),
+                                inputs=tf.reshape(decoder_outputs, [-1, self.model_structure['n_hidden']]),
+                                num_sampled=self.model_structure.get('num_sampled', 512),
+                                num_classes=int(word_count))
+                            mask_flat = tf.reshape(mask, [-1])
+                            return tf.divide(tf.reduce_sum(crossent * mask_flat), tf.reduce_sum(mask_flat),
+                                             name=name)
+                        elif softmax == 'adaptive':
+                            # only the tail clusters of the targets are evaluated
+                            decoder_outputs = network(x, x_length, y=y, y_length=y_length)
+                            crossent = projection_layer.loss(
+                                tf.reshape(decoder_outputs, [-1, self.model_structure['n_hidden']]),
+                                tf.reshape(y_target[:, :dynamic_max_sequence], [-1]))
+                            mask_flat = tf.reshape(mask, [-1])
+                            return tf.divide(tf.reduce_sum(crossent * mask_flat), tf.reduce_sum(mask_flat),
+                                             name=name)
+                        else:
+                            # Built-in cost
+                            return tf.contrib.seq2seq.sequence_loss(network(x, x_length, y=y, y_length=y_length),
+                                                                    y_target[:, :dynamic_max_sequence],
+                                                                    weights=mask,
+                                                                    name=name)
 
-                    # Manual cost
-                    # crossent = tf.nn.sparse_softmax_cross_entropy_with_logits(
-                    #     labels=self.y_target[:, :dynamic_max_sequence], logits=self.network())
-                    # self.cost = tf.reduce_sum(crossent * mask) / tf.cast(tf.shape(self.y)[0], tf.float32)
+                    self.cost = get_cost(self.x, self.x_length, self.y, self.y_length, self.y_target,
+                                         name='train_cost')
 
-                    # Built-in cost
-                    self.cost = tf.contrib.seq2seq.sequence_loss(network(self.x, self.x_length),
-                                                                 self.y_target[:, :dynamic_max_sequence],
-                                                                 weights=mask,
-                                                                 name='train_cost')
+                    if projection_rank > 0:
+                        self.projection_factors = (projection_layer.kernel_u, projection_layer.kernel_v)
+                    elif softmax != 'adaptive':
+                        self.projection_kernel = projection_layer.kernel
 
                     optimizer = tf.train.AdamOptimizer(self.hyperparameters['learning_rate'])
-                    gradients, variables = zip(*optimizer.compute_gradients(self.cost))
-                    gradients, _ = tf.clip_by_global_norm(gradients, self.model_structure['gradient_clip'])
-                    self.train_op = optimizer.apply_gradients(zip(gradients, variables), name='train_op')
+
+                    def next_cost():
+                        x, y, x_length, y_length, y_target = self.iterator.get_next()
+                        y_target.set_shape([None, max_sequence])
+                        y_length.set_shape((None,))
+                        return get_cost(x, x_length, y, y_length, y_target)
+
+                    self.train_cost, self.train_op = self.minimize(optimizer, self.cost, next_cost,
+                                                                   clip_norm=self.model_structure['gradient_clip'],
+                                                                   name='train_op')
+
+                    def train_step():
+                        return self.minimize(optimizer, next_cost(), next_cost,
+                                             clip_norm=self.model_structure['gradient_clip'])
+
+                    self.build_train_loop(train_step)
+
+                    # Evaluation on the validation examples, decoding the targets as in training
+                    eval_x, eval_y, eval_x_length, eval_y_length, eval_y_target = eval_batch
+                    eval_outputs = network(eval_x, eval_x_length, y=eval_y, y_length=eval_y_length)
+                    if softmax != 'full':
+                        # the adaptive softmax gives log probabilities, which are fine as logits
+                        eval_outputs = tf.reshape(
+                            projection_layer(tf.reshape(eval_outputs, [-1, self.model_structure['n_hidden']])),
+                            [tf.shape(eval_outputs)[0], tf.shape(eval_outputs)[1], -1])
+                    eval_max_sequence = tf.reduce_max(eval_y_length)
+                    eval_mask = tf.sequence_mask(eval_y_length, maxlen=eval_max_sequence, dtype=tf.float32)
+                    eval_y_target = eval_y_target[:, :eval_max_sequence]
+
+                    self.eval_cost = tf.contrib.seq2seq.sequence_loss(eval_outputs, eval_y_target, weights=eval_mask)
+                    eval_correct = tf.equal(tf.argmax(eval_outputs, -1, output_type=tf.int32), eval_y_target)
+                    self.eval_accuracy = tf.divide(tf.reduce_sum(tf.cast(eval_correct, tf.float32) * eval_mask),
+                                                   tf.reduce_sum(eval_mask))
 
                     pred_x, pred_x_length = self.predict_iterator.get_next()
-                    self.infer = network(pred_x, pred_x_length, mode="infer")
+                    # named inputs that can be fed directly when serving a frozen graph (see Predictor)
+                    self.predict_x = tf.placeholder_with_default(pred_x, [None, None], name='input_x')
+                    self.predict_x_length = tf.placeholder_with_default(pred_x_length, [None], name='input_x_length')
+                    self.infer = network(self.predict_x, self.predict_x_length, mode="infer")
 
                     # Beam
                     pred_infer = tf.cond(tf.less(tf.shape(self.infer)[2], max_sequence),
@@ -296,6 +464,76 @@ class ChatbotModel(am.Model):
                         self.y_target)
                     self.accuracy = tf.reduce_mean(tf.cast(correct_pred, tf.float32))
 
+                    # Streaming (one greedy decoder step per session call)
+                    # The encoder only runs when stream_memory and stream_state are not fed, so the first step
+                    # encodes the input and later steps feed back the memory and state returned by the previous one
+                    self.stream_x = tf.placeholder(tf.int32, [None, max_sequence], name='stream_x')
+                    self.stream_x_length = tf.placeholder(tf.int32, [None], name='stream_x_length')
+                    stream_batch_size = tf.shape(self.stream_x)[0]
+
+                    embedded_stream_x = tf.nn.embedding_lookup(self.word_embedding, self.stream_x)
+                    embedded_stream_x.set_shape([None, max_sequence, n_vector])
+
+                    # conversations continue encoding from the final encoder state of the previous turn
+                    encoder_zero_state = cell_encode.zero_state(stream_batch_size, tf.float32)
+                    self.stream_encoder_state = [tf.placeholder_with_default(tensor, tensor.shape)
+                                                 for tensor in tf.contrib.framework.nest.flatten(encoder_zero_state)]
+
+                    self.stream_encoder_outputs, stream_encoder_state = tf.nn.dynamic_rnn(
+                        cell_encode,
+                        inputs=embedded_stream_x,
+                        initial_state=tf.contrib.framework.nest.pack_sequence_as(encoder_zero_state,
+                                                                                 self.stream_encoder_state),
+                        sequence_length=self.stream_x_length)
+                    self.stream_encoder_final_state = tf.contrib.framework.nest.flatten(stream_encoder_state)
+
+                    # encoder outputs of previous turns (trimmed to their lengths) are attended along the input
+                    self.stream_history = tf.placeholder_with_default(
+                        tf.zeros([stream_batch_size, 0, self.model_structure['n_hidden']]),
+                        [None, None, self.model_structure['n_hidden']], name='stream_history')
+                    self.stream_history_length = tf.placeholder_with_default(
+                        tf.zeros([stream_batch_size], tf.int32), [None], name='stream_history_length')
+
+                    with tf.variable_scope('decode', reuse=tf.AUTO_REUSE):
+                        self.stream_memory = tf.placeholder_with_default(
+                            tf.concat([self.stream_history, self.stream_encoder_outputs], 1),
+                            [None, None, self.model_structure['n_hidden']],
+                            name='stream_memory')
+                        self.stream_memory_length = tf.placeholder_with_default(
+                            self.stream_history_length + self.stream_x_length, [None], name='stream_memory_length')
+                        stream_batch_size = tf.shape(self.stream_memory)[0]
+
+                        attention_mechanism = tf.contrib.seq2seq.BahdanauAttention(
+                            num_units=self.model_structure['n_hidden'], memory=self.stream_memory,
+                            memory_sequence_length=self.stream_memory_length)
+
+                        attn_decoder_cell = tf.contrib.seq2seq.AttentionWrapper(
+                            cell_decode, attention_mechanism,
+                            attention_layer_size=self.model_structure['n_hidden'])
+
+                        initial_state = attn_decoder_cell.zero_state(dtype=tf.float32,
+                                                                     batch_size=stream_batch_size
+                                                                     ).clone(cell_state=stream_encoder_state)
+
+                        # placeholders for every tensor of the (nested) attention wrapper state
+                        self.stream_state = [tf.placeholder_with_default(tensor, tensor.shape)
+                                             for tensor in tf.contrib.framework.nest.flatten(initial_state)]
+                        stream_state = tf.contrib.framework.nest.pack_sequence_as(initial_state, self.stream_state)
+
+                        self.stream_token = tf.placeholder_with_default(
+                            tf.fill([stream_batch_size], am.WordEmbedding.GO), [None], name='stream_token')
+
+                        # same scope as dynamic_decode so that the attention variables are shared
+                        with tf.variable_scope('decoder'):
+                            cell_output, next_state = attn_decoder_cell(
+                                tf.nn.embedding_lookup(self.word_embedding, self.stream_token), stream_state)
+
+                        self.stream_next_token = tf.argmax(projection_layer(cell_output), axis=-1,
+                                                           output_type=tf.int32, name='stream_next_token')
+                        self.stream_next_state = tf.contrib.framework.nest.flatten(next_state)
+
+                    self.build_inference_extensions(lambda x, x_length: network(x, x_length, mode="infer"))
+
                     # Tensorboard
                     if self.config['tensorboard'] is not None:
                         tf.summary.scalar('cost', self.cost)
@@ -306,15 +544,61 @@ class ChatbotModel(am.Model):
 
         return graph
 
+    def build_inference_extensions(self, infer_network):
+        """
+        Called at the end of build_graph within the chatbot scope, so that subclasses can decode their own inputs
+        with the same weights
+
+        :param infer_network: function building the beam search decoder, given the input and length tensors
+        """
+        pass
+
     def init_tensorflow(self, graph=None, init_param=True, init_sess=True):
         super().init_tensorflow(graph=graph, init_param=init_param, init_sess=init_sess)
 
         if self.init_word_embedding:
             super().init_embedding(self.word_embedding)
 
+    def warm_up_batches(self, batch_size):
+        # the longest inputs, so that the largest buffers are allocated
+        max_sequence = self.model_structure['max_sequence']
+        x = np.full([batch_size, max_sequence], am.WordEmbedding.EOS, np.int32)
+        x[:, 0] = am.WordEmbedding.GO
+        x_length = np.full([batch_size], max_sequence, np.int32)
+
+        return [(self.infer, {self.predict_x: x, self.predict_x_length: x_length})]
+
+    def enable_response_cache(self, max_size=1024, ttl=None, path=None):
+        """
+        Cache prediction results of this model, keyed by the token indexes of the input
+
+        :param max_size: maximum number of cached responses
+        :param ttl: number of seconds a response stays valid (None for no expiry)
+        :param path: file to persist the cache in (Optional)
+        :return: the response cache
+        """
+        self.response_cache = am.ResponseCache(max_size=max_size, ttl=ttl, path=path)
+        self.response_cache.set_identity(self.weights_identity())
+        return self.response_cache
+
+    def disable_response_cache(self):
+        self.response_cache = None
+
+    def set_checkpoint(self, checkpoint, weights_changed=True):
+        super().set_checkpoint(checkpoint, weights_changed=weights_changed)
+
+        if weights_changed:
+            # encoder states of other weights are meaningless, the sessions start over
+            self.conversations.reset()
+
+    def train_data_count(self):
+        return len(self.data['train_y'])
+
     def train(self, epochs=10, cancellation_token=None):
 
-        self.sess.run(self.iterator.initializer, feed_dict={self.data_count: len(self.data['train_y'])})
+        self.init_train_iterator()
+
+        self.start_training()
 
         epoch = 0
 
@@ -323,17 +607,22 @@ class ChatbotModel(am.Model):
             if cancellation_token is not None and cancellation_token.is_cancalled:
                 return  # early stopping
 
-            batch_num = 0
+            batch_num = self.config.get('epoch_step', 0)  # resume a cancelled epoch
 
             try:
-                while batch_num < self.data.steps_per_epoch:
+                while batch_num < self.train_steps_per_epoch():
+
+                    # the cost is displayed every 100 batches
+                    steps = min(100 - batch_num % 100, self.train_steps_per_epoch() - batch_num)
 
                     if (self.config['display_step'] == 0 or
                         self.config['epoch'] % self.config['display_step'] == 0 or
-                        epoch == epochs) and \
-                            (batch_num % 100 == 0 or batch_num == 0):
+                        epoch == epochs):
 
-                        _, cost_value = self.sess.run([self.train_op, self.cost])
+                        done, cost_value = self.run_train_steps(steps, fetch_cost=True,
+                                                                cancellation_token=cancellation_token)
+                        if done == 0:
+                            return  # cancelled, training resumes from the position kept in config
 
                         print("epoch:", self.config['epoch'], "- (", batch_num, ") -", cost_value)
 
@@ -343,9 +632,12 @@ class ChatbotModel(am.Model):
                             self.hyperdash.metric("cost", cost_value)
 
                     else:
-                        self.sess.run([self.train_op])
+                        done, _ = self.run_train_steps(steps, cancellation_token=cancellation_token)
+
+                    batch_num += done
 
-                    batch_num += 1
+                    if done < steps:
+                        return  # cancelled, training resumes from the position kept in config
 
             except tf.errors.OutOfRangeError:
                 print(batch_num)
@@ -355,6 +647,7 @@ class ChatbotModel(am.Model):
                 self.tensorboard_writer.add_summary(summary, self.config['epoch'])
 
             self.config['epoch'] += 1
+            self.config['epoch_step'] = 0
             epoch += 1
 
     @classmethod
@@ -367,22 +660,29 @@ class ChatbotModel(am.Model):
         else:
             model.data = am.ChatData()
 
+        start = time.perf_counter()
         model.build_graph(model.model_config(), model.data)
+        model.load_profile['build_graph'] = time.perf_counter() - start
         model.init_word_embedding = False  # prevent initializing the word embedding again
+        start = time.perf_counter()
         model.init_tensorflow(init_param=False, init_sess=True)
+        model.load_profile['init_session'] = time.perf_counter() - start
 
         checkpoint = tf.train.get_checkpoint_state(directory)
         input_checkpoint = checkpoint.model_checkpoint_path
 
+        start = time.perf_counter()
         with model.graph.as_default():
             model.saver.restore(model.sess, input_checkpoint)
+        model.load_profile['restore'] = time.perf_counter() - start
 
+        model.set_checkpoint(input_checkpoint)
         model.saved_directory = directory
         model.saved_name = name
 
         return model
 
-    def predict(self, input_data=None, save_path=None, raw=False):
+    def predict(self, input_data=None, save_path=None, raw=False, lazy=False):
 
         if input_data is None:
             input_data = self.data
@@ -392,38 +692,170 @@ class ChatbotModel(am.Model):
             self.data.set_input(input_data)  # try to match type
             input_data = self.data
 
+        if self.response_cache is not None and not raw:
+            sentences = self._predict_cached(input_data)
+        else:
+            sentences, outputs = self._predict_sentences(input_data)
+            if not lazy:
+                sentences = sentences.tolist()
+
+        if save_path is not None:
+            with open(save_path, "w") as file:
+                for sentence in sentences:
+                    file.write(sentence + '\n')
+
+        if raw:
+            return sentences, outputs
+        else:
+            return sentences
+
+    def _predict_sentences(self, input_data):
+
+        order = self.get_predict_order()
+
         with self.graph.device('/cpu:0'):
-            self.sess.run(self.predict_iterator.initializer, feed_dict={self.data_count: len(self.data['input'])})
+            self.sess.run(self.predict_iterator.initializer, feed_dict={self.data_count: len(self.data['input']),
+                                                                        self.predict_order: order})
 
         outputs = []
         batch_num = 0
         try:
             while batch_num < self.data.predict_steps:
-                outputs.append(self.sess.run(self.infer))
+                infer = self.sess.run(self.infer)
+                # decoding stops early once every beam has finished, pad to a common length
+                padding = self.model_structure['max_sequence'] - infer.shape[-1]
+                outputs.append(np.pad(infer, [(0, 0), (0, 0), (0, padding)],
+                                      'constant', constant_values=input_data['embedding'].EOS))
                 batch_num += 1
         except tf.errors.OutOfRangeError:
             print(batch_num)
 
-        import numpy as np
-        outputs = np.concatenate(outputs)
+        # restore the input order
+        outputs = np.concatenate(outputs)[np.argsort(order)]
         # [batch, beam (default 3), sequence]
 
         # Beam
-        sentences = [
-            ' '.join(
-                [input_data['embedding'].words[index] for index in instance[0]  # only read the first beam
-                 if index != input_data['embedding'].EOS and index != input_data['embedding'].GO]  # skip EOS & GO
-            )
-            for instance in outputs]
-        # grab the corresponding words based on indexes from output
-        # sentences var is list with shape [batch], each item is a string
+        # grab the corresponding words based on indexes from output (only read the first beam, skip EOS & GO)
+        embedding = input_data['embedding']
+        sentences = am.Utils.LazySentences(outputs[:, 0], embedding.words_array, [embedding.EOS, embedding.GO])
 
-        if save_path is not None:
-            with open(save_path, "w") as file:
-                for sentence in sentences:
-                    file.write(sentence + '\n')
+        return sentences, outputs
 
-        if raw:
-            return sentences, outputs
-        else:
-            return sentences
+    def predict_stream(self, sentence, partial=False, conversation=None):
+        """
+        Generate a response one word at a time, yielding each word as soon as its decoder step completes.
+        Streaming uses greedy decoding, so the result may differ from the beam search of predict.
+
+        :param sentence: input sentence
+        :param partial: yield the response generated so far instead of individual words
+        :param conversation: a Conversation whose recent turns are used as context (Optional)
+        :return: a generator of words (or partial responses)
+        """
+
+        embedding = self.data['embedding']
+
+        x, x_length, _ = am.Utils.sentence_to_index(am.Chatbot.Parse.split_sentence(sentence.lower()),
+                                                    embedding.words_to_index,
+                                                    max_seq=self.model_structure['max_sequence'],
+                                                    go=True,
+                                                    eos=True)
+
+        # the first step runs the encoder as well
+        feed_dict = {self.stream_x: [x], self.stream_x_length: [x_length]}
+
+        if conversation is not None:
+            history = conversation.history()
+            if history is not None:
+                feed_dict[self.stream_history] = history
+                feed_dict[self.stream_history_length] = [history.shape[1]]
+            if conversation.encoder_state is not None:
+                feed_dict.update(zip(self.stream_encoder_state, conversation.encoder_state))
+
+        memory, memory_length, token, state, encoder_outputs, encoder_state = self.sess.run(
+            [self.stream_memory, self.stream_memory_length, self.stream_next_token, self.stream_next_state,
+             self.stream_encoder_outputs, self.stream_encoder_final_state],
+            feed_dict=feed_dict)
+
+        if conversation is not None:
+            conversation.add_turn(encoder_outputs, x_length, encoder_state)
+
+        words = []
+        step = 1
+
+        while token[0] != embedding.EOS:
+
+            words.append(embedding.words[token[0]])
+            yield ' '.join(words) if partial else words[-1]
+
+            if step >= self.model_structure['max_sequence']:
+                break
+
+            # reuse the encoder outputs and decoder state of the previous step
+            feed_dict = {self.stream_memory: memory, self.stream_memory_length: memory_length,
+                         self.stream_token: token}
+            feed_dict.update(zip(self.stream_state, state))
+
+            token, state = self.sess.run([self.stream_next_token, self.stream_next_state], feed_dict=feed_dict)
+            step += 1
+
+    def get_conversation(self, session_id, max_turns=3):
+        """
+        Get the conversation of a session, creating it if it does not exist (or has been evicted)
+
+        :param session_id: identifier of the conversation
+        :param max_turns: number of previous turns to attend to when creating a conversation
+        :return: a Conversation object
+        """
+        conversation = self.conversations.get(session_id)
+
+        if conversation is None:
+            conversation = am.Chatbot.Conversation(session_id, max_turns=max_turns)
+            self.conversations.put(session_id, conversation)
+
+        return conversation
+
+    def end_conversation(self, session_id):
+        self.conversations.pop(session_id)
+
+    def predict_conversation(self, sentence, session_id, max_turns=3):
+        """
+        Respond to a sentence in the context of a conversation. Only the new sentence is encoded, so the
+        cost of a turn does not grow with the length of the conversation.
+
+        :param sentence: input sentence
+        :param session_id: identifier of the conversation
+        :param max_turns: number of previous turns to attend to when creating a conversation
+        :return: the response
+        """
+        conversation = self.get_conversation(session_id, max_turns=max_turns)
+        return ' '.join(self.predict_stream(sentence, conversation=conversation))
+
+    def _predict_cached(self, input_data):
+        # only run the network on inputs whose token indexes are not cached
+
+        inputs = input_data.values['input']
+
+        keys = [self.response_cache.make_key(input_data.parse(i, from_input=True)[0]) for i in range(len(inputs))]
+
+        sentences = []
+        missed = []
+        for i in range(len(keys)):
+            sentences.append(self.response_cache.get(keys[i]))
+            if sentences[i] is None:
+                missed.append(i)
+
+        if len(missed) > 0:
+            input_data.set_input([inputs[i] for i in missed])
+
+            start_time = time.time()
+            try:
+                missed_sentences, _ = self._predict_sentences(input_data)
+            finally:
+                input_data.set_input(inputs)
+            self.response_cache.record_predict_time(time.time() - start_time)
+
+            for i, sentence in zip(missed, missed_sentences):
+                sentences[i] = sentence
+                self.response_cache.put(keys[i], sentence)
+
+        return sentences
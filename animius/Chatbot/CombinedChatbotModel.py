@@ -1,5 +1,6 @@
-import copy
+import time
 
+import numpy as np
 import tensorflow as tf
 
 import animius as am
@@ -23,6 +24,10 @@ class CombinedChatbotModel(ChatbotModel):
 
         self.init_vars = None
 
+        # single pass inference, see predict_combined
+        self.fused_chat_indexes = None
+        self.fused_infer = None
+
     def build_graph(self, model_config, data, graph=None, embedding_tensor=None, intent_ner=None):
         # graph and embedding_tensor arguments doesn't really do anything
 
@@ -111,6 +116,30 @@ class CombinedChatbotModel(ChatbotModel):
         self.hyperparameters = dict(model_config.hyperparameters)
         self.data = data
 
+    def build_inference_extensions(self, infer_network):
+        # Decode the inputs classified as chat by the intent NER model in the same session call.
+        # The inputs are fed into the named inputs of the intent NER model, so they are tokenized once
+        intent, _ = self.intent_ner_model.prediction
+        max_sequence = self.model_structure['max_sequence']
+
+        with tf.name_scope('fused'):
+            is_chat = tf.equal(tf.argmax(intent, axis=-1, output_type=tf.int32), 0)
+            self.fused_chat_indexes = tf.cast(tf.where(is_chat)[:, 0], tf.int32)
+
+            # the intent NER tokens have no <EOS>, write it after the input as ChatData.parse does
+            # (at most max_sequence - 1 tokens, the length does not count the <EOS>, see Utils.sentence_to_index)
+            chat_x_length = tf.minimum(tf.boolean_mask(self.intent_ner_model.predict_x_length, is_chat),
+                                       max_sequence - 1)
+            chat_x = tf.boolean_mask(self.intent_ner_model.predict_x, is_chat)
+            chat_x = tf.pad(chat_x, [[0, 0], [0, 1]])[:, :max_sequence]
+            after_input = tf.greater_equal(tf.expand_dims(tf.range(tf.shape(chat_x)[1]), 0),
+                                           tf.expand_dims(chat_x_length, 1))
+            chat_x = tf.where(after_input, tf.fill(tf.shape(chat_x), am.WordEmbedding.EOS), chat_x)
+
+            self.fused_infer = tf.cond(tf.reduce_any(is_chat),
+                                       lambda: infer_network(chat_x, chat_x_length),
+                                       lambda: tf.zeros([0, self.model_structure['beam_width'], 0], tf.int32))
+
     def init_tensorflow(self, graph=None, init_param=True, init_sess=True):
         if init_param and self.intent_ner_initialized:
             # we can only initialize the chatbot vars
@@ -141,16 +170,23 @@ class CombinedChatbotModel(ChatbotModel):
         else:
             model.data = am.ChatData()
 
+        start = time.perf_counter()
         model.build_graph(model.model_config(), model.data)  # automatically builds intent ner in model config
+        model.load_profile['build_graph'] = time.perf_counter() - start
         model.init_word_embedding = False  # prevent initializing the word embedding again
+        start = time.perf_counter()
         model.init_tensorflow(init_param=False, init_sess=True)
+        model.load_profile['init_session'] = time.perf_counter() - start
 
         checkpoint = tf.train.get_checkpoint_state(directory)
         input_checkpoint = checkpoint.model_checkpoint_path
 
+        start = time.perf_counter()
         with model.graph.as_default():
             model.saver.restore(model.sess, input_checkpoint)
+        model.load_profile['restore'] = time.perf_counter() - start
 
+        model.set_checkpoint(input_checkpoint)
         model.saved_directory = directory
         model.saved_name = name
 
@@ -168,6 +204,9 @@ class CombinedChatbotModel(ChatbotModel):
 
         super().save(directory, name, meta, graph)
 
+    def warm_up_batches(self, batch_size):
+        return super().warm_up_batches(batch_size) + self.intent_ner_model.warm_up_batches(batch_size)
+
     def add_embedding(self, embedding):
         # shortcut for adding embedding
         self.data.add_embedding_class(embedding)
@@ -185,26 +224,40 @@ class CombinedChatbotModel(ChatbotModel):
         if isinstance(input_sentences, str):
             input_sentences = [input_sentences]
 
-        sentences_cache = copy.copy(input_sentences)
+        embedding = self.data['embedding']
+        intent, ner = self.intent_ner_model.prediction
+
+        # tokenize once as the intent NER data does (<GO> but no <EOS>), the chatbot reads the same indexes
+        x, x_length = am.Chatbot.Parse.sentences_to_index(input_sentences, embedding.words_to_index,
+                                                          max_seq=self.intent_ner_model.model_structure['max_sequence'],
+                                                          go=True, eos=False)
 
-        intent_ner_results = self.predict_intent_ner(input_sentences, raw=False)
+        # sort by length so that every batch is only padded up to its own longest input
+        order = np.argsort(x_length, kind='stable')
+        batch_size = self.hyperparameters['batch_size']
 
-        results = []
-        chat_indexes = []
+        results = [None] * len(input_sentences)
 
-        for i in range(len(intent_ner_results)):
-            intent = intent_ner_results[i][0]
-            if intent > 0:  # not chat
-                results.append(intent_ner_results[i])
-            else:  # chat
-                chat_indexes.append(i)
-                results.append(None)  # add tmp placeholder
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            batch_length = x_length[batch]
 
-        if len(chat_indexes) > 0:  # there are chat responses, proceed with chatbot prediction
-            chat_results = super().predict([sentences_cache[i] for i in chat_indexes], raw=False)
+            intents, entities, chat_indexes, infer = self.sess.run(
+                [intent, ner, self.fused_chat_indexes, self.fused_infer],
+                feed_dict={self.intent_ner_model.predict_x: x[batch, :batch_length.max()],
+                           self.intent_ner_model.predict_x_length: batch_length})
 
-            for i in range(len(chat_results)):
-                results[chat_indexes[i]] = (0, chat_results[i])
+            max_intent = np.argmax(intents, axis=-1).tolist()
+            max_ner = np.argmax(entities, axis=-1)[:, 1:]  # [0] is <GO>
+
+            for i, index in enumerate(batch):
+                if max_intent[i] > 0:  # not chat
+                    results[index] = (max_intent[i], max_ner[i, :batch_length[i] - 1].tolist())
+
+            # only read the first beam, skip EOS & GO
+            responses = am.Utils.LazySentences(infer[:, 0], embedding.words_array, [embedding.EOS, embedding.GO])
+            for i, response in zip(chat_indexes, responses):
+                results[batch[i]] = (0, response)
 
         # saving
         if save_path is not None:
@@ -214,6 +267,33 @@ class CombinedChatbotModel(ChatbotModel):
 
         return results
 
+    def check_fused(self, input_sentences):
+        """
+        Compare the chat responses of predict_combined with those of the chatbot alone (predict_chatbot)
+
+        :param input_sentences: list of sentences
+        :return: list of (sentence, combined response, chatbot response) of the chat sentences whose responses differ
+        """
+        results = self.predict_combined(input_sentences)
+        chat = [(sentence, result[1]) for sentence, result in zip(input_sentences, results) if result[0] == 0]
+        if not chat:
+            return []
+
+        responses = self.predict_chatbot([sentence for sentence, _ in chat])
+
+        return [(sentence, combined, response)
+                for (sentence, combined), response in zip(chat, responses)
+                if combined != response]
+
+    def predict_conversation(self, sentence, session_id, max_turns=3):
+        # intent ner turns do not take part in the conversation context
+        intent, ner = self.predict_intent_ner([sentence], raw=False)[0]
+
+        if intent > 0:  # not chat
+            return [(intent, ner)]
+
+        return [(0, super().predict_conversation(sentence, session_id, max_turns=max_turns))]
+
     def predict(self, input_data=None, save_path=None, raw=False, combined=True):
         # automatically selects a prediction function
         if combined:
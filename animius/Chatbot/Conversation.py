@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+
+
+class Conversation:
+    """
+    Encoder outputs and state of the recent turns of a conversation, so that new turns can attend to the
+    conversation history without encoding it again.
+    """
+
+    def __init__(self, session_id, max_turns=3):
+        """
+        :param session_id: identifier of the conversation
+        :param max_turns: number of previous turns to attend to
+        """
+        self.session_id = session_id
+
+        # encoder outputs of recent turns, each trimmed to its length [length, n_hidden]
+        self.turns = deque(maxlen=max_turns)
+        # flattened final encoder state of the last turn
+        self.encoder_state = None
+
+        self.turn_count = 0
+
+    def history(self):
+        # [1, total length, n_hidden], bounded by max_turns * max_sequence
+        if len(self.turns) == 0:
+            return None
+        return np.concatenate(self.turns)[np.newaxis]
+
+    def add_turn(self, encoder_outputs, length, encoder_state):
+        self.turns.append(encoder_outputs[0, :length])
+        self.encoder_state = encoder_state
+        self.turn_count += 1
+
+    def reset(self):
+        self.turns.clear()
+        self.encoder_state = None
+        self.turn_count = 0
+
+
+class ConversationStore:
+    """
+    Conversations by session id, the least recently used one is evicted once max_size sessions are open.
+    """
+
+    def __init__(self, max_size=256):
+        """
+        :param max_size: maximum number of conversations to keep
+        """
+        self.max_size = max_size
+
+        self.conversations = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.conversations)
+
+    def get(self, session_id):
+        with self.lock:
+            conversation = self.conversations.get(session_id)
+            if conversation is not None:
+                self.conversations.move_to_end(session_id)
+            return conversation
+
+    def put(self, session_id, conversation):
+        with self.lock:
+            self.conversations[session_id] = conversation
+            self.conversations.move_to_end(session_id)
+            while len(self.conversations) > self.max_size:
+                self.conversations.popitem(last=False)
+
+    def pop(self, session_id):
+        with self.lock:
+            return self.conversations.pop(session_id, None)
+
+    def reset(self):
+        # keep the sessions, but forget their history
+        with self.lock:
+            for conversation in self.conversations.values():
+                conversation.reset()
+
+    def clear(self):
+        with self.lock:
+            self.conversations.clear()
@@ -0,0 +1,122 @@
+import errno
+import hashlib
+import json
+import time
+from os import mkdir, replace, truncate
+from os.path import getsize, join, isfile
+
+import animius as am
+
+
+def _predict_chatbot(model, sentences):
+    # a combined chatbot answers intents too, only the chat responses are distilled
+    if isinstance(model, am.Chatbot.CombinedChatbotModel):
+        return model.predict_chatbot(sentences)
+    return model.predict(sentences)
+
+
+def label_corpus(teacher, sentences, directory, chunk_size=1024):
+    """
+    Label a corpus with the beam search responses of a teacher chatbot (sequence-level distillation).
+    Inputs and responses are written to inputs.txt and responses.txt, one sentence per line, after every chunk so
+    that an interrupted run resumes where it stopped. The cache is discarded if the teacher weights or the corpus
+    changed.
+
+    :param teacher: trained ChatbotModel or CombinedChatbotModel
+    :param sentences: list of input sentences
+    :param directory: directory of the cache
+    :param chunk_size: number of sentences predicted before writing to disk
+    :return: paths to the inputs and responses files, to be used with ChatData.add_files
+    """
+    try:
+        # create directory if it does not already exist
+        mkdir(directory)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise exc
+
+    inputs_path = join(directory, 'inputs.txt')
+    responses_path = join(directory, 'responses.txt')
+    meta_path = join(directory, 'teacher.json')
+
+    corpus_hash = hashlib.sha1('\n'.join(sentences).encode('utf8')).hexdigest()
+
+    count = 0
+    if isfile(meta_path):
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta['checkpoint'] == teacher.weights_identity() and meta.get('corpus') == corpus_hash:
+            count = meta['count']
+            # drop lines written after the last recorded chunk, e.g. by a run killed before updating the meta
+            truncate(inputs_path, meta['inputs_size'])
+            truncate(responses_path, meta['responses_size'])
+
+    mode = 'a' if count > 0 else 'w'
+    with open(inputs_path, mode, encoding='utf8') as inputs_file, \
+            open(responses_path, mode, encoding='utf8') as responses_file:
+
+        for start in range(count, len(sentences), chunk_size):
+            chunk = [sentence.strip() for sentence in sentences[start:start + chunk_size]]
+            responses = _predict_chatbot(teacher, chunk)
+
+            inputs_file.writelines(sentence + '\n' for sentence in chunk)
+            responses_file.writelines(response + '\n' for response in responses)
+            inputs_file.flush()
+            responses_file.flush()
+
+            count = start + len(chunk)
+            with open(meta_path + '.tmp', 'w') as f:
+                json.dump({'checkpoint': teacher.weights_identity(),
+                           'corpus': corpus_hash,
+                           'count': count,
+                           'inputs_size': getsize(inputs_path),
+                           'responses_size': getsize(responses_path)}, f, indent=4)
+            replace(meta_path + '.tmp', meta_path)
+
+    return inputs_path, responses_path
+
+
+def _overlap(response, reference):
+    # unigram F1 between two responses
+    response, reference = response.split(), reference.split()
+    common = sum(min(response.count(word), reference.count(word)) for word in set(response))
+    if common == 0:
+        return 0.0
+    precision = common / len(response)
+    recall = common / len(reference)
+    return 2 * precision * recall / (precision + recall)
+
+
+def compare(teacher, student, sentences, repeat=3):
+    """
+    Side-by-side latency and quality report of a teacher and its student
+
+    :param teacher: teacher chatbot
+    :param student: student chatbot
+    :param sentences: list of input sentences
+    :param repeat: number of timed runs, after one warm-up run
+    :return: a dict of the report
+    """
+    report = {}
+    responses = {}
+
+    for role, model in (('teacher', teacher), ('student', student)):
+        responses[role] = _predict_chatbot(model, sentences)  # warm-up
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            _predict_chatbot(model, sentences)
+        latency = (time.perf_counter() - start) / repeat
+
+        report[role] = {'parameters': am.Utils.count_parameters(model),
+                        'n_hidden': model.model_structure['n_hidden'],
+                        'layer': model.model_structure['layer'],
+                        'latency': latency,
+                        'latency_per_sentence': latency / len(sentences)}
+
+    pairs = list(zip(responses['student'], responses['teacher']))
+    report['exact_match'] = sum(student == teacher for student, teacher in pairs) / len(pairs)
+    report['overlap'] = sum(_overlap(student, teacher) for student, teacher in pairs) / len(pairs)
+    report['speedup'] = report['teacher']['latency'] / report['student']['latency']
+
+    return report
@@ -1,5 +1,7 @@
 import re  # regex
 
+import numpy as np
+
 from animius.Utils import sentence_to_index
 
 
@@ -109,6 +111,21 @@ class Parse:
             result.append(Parse.split_sentence(line))
         return result
 
+    @staticmethod
+    def sentences_to_index(sentences, word_to_index, max_seq=20, go=False, eos=False):
+        # token indexes and lengths of raw input sentences, as int32 arrays
+        if isinstance(sentences, str):
+            sentences = [sentences]
+
+        x, x_length = [], []
+        for sentence in sentences:
+            indexes, length, _ = sentence_to_index(Parse.split_sentence(sentence.lower()), word_to_index,
+                                                   max_seq=max_seq, go=go, eos=eos)
+            x.append(indexes)
+            x_length.append(length)
+
+        return np.array(x, np.int32), np.array(x_length, np.int32)
+
     @staticmethod
     def data_to_index(data_x, data_y, word_to_index, max_seq=20):
 
@@ -0,0 +1,259 @@
+import copy
+import shutil
+import tempfile
+import time
+from os.path import join
+
+import tensorflow as tf
+
+import animius as am
+
+
+def get_shortlist(x, size, vocab_size):
+    """
+    Candidate words for decoding: the most frequent words (the vocabulary is sorted by frequency) followed by the
+    words of the inputs in the batch. The first `size` candidates keep their word index, so <GO> and <EOS> map to
+    themselves.
+
+    :param x: input word indexes [batch size, sequence length]
+    :param size: number of frequent words, at most the whole vocabulary
+    :param vocab_size: number of words
+    :return: word indexes of the candidates
+    """
+    return tf.unique(tf.concat([tf.range(min(size, vocab_size), dtype=x.dtype), tf.reshape(x, [-1])], 0))[0]
+
+
+class FactorizedDense(tf.layers.Layer):
+    """
+    Dense layer whose kernel is the product of two low rank matrices, see Utils.factorize
+    """
+
+    def __init__(self, units, rank, **kwargs):
+        super().__init__(**kwargs)
+        self.units = units
+        self.rank = rank
+
+        self.kernel_u = None
+        self.kernel_v = None
+        self.bias = None
+
+    def build(self, input_shape):
+        self.kernel_u = self.add_weight('kernel_u', [int(input_shape[-1]), self.rank])
+        self.kernel_v = self.add_weight('kernel_v', [self.rank, self.units])
+        self.bias = self.add_weight('bias', [self.units], initializer=tf.zeros_initializer())
+        super().build(input_shape)
+
+    @property
+    def kernel(self):
+        # full kernel, only for losses that need it (e.g. sampled softmax)
+        return tf.matmul(self.kernel_u, self.kernel_v)
+
+    def call(self, inputs):
+        return tf.nn.bias_add(tf.matmul(tf.matmul(inputs, self.kernel_u), self.kernel_v), self.bias)
+
+    def compute_output_shape(self, input_shape):
+        return tf.TensorShape(input_shape)[:-1].concatenate([self.units])
+
+
+class ShortlistProjection(tf.layers.Layer):
+    """
+    Output layer scoring only the candidate words of a shortlist, sharing the weights of the full projection layer.
+    Logits are given in shortlist space, map them back with tf.gather(shortlist, ids).
+    """
+
+    def __init__(self, projection_layer, shortlist, **kwargs):
+        super().__init__(**kwargs)
+        self.projection_layer = projection_layer
+        self.shortlist = shortlist
+
+    def call(self, inputs):
+        bias = tf.gather(self.projection_layer.bias, self.shortlist)
+        # inputs are [batch size, n_hidden] during decoding
+        if isinstance(self.projection_layer, FactorizedDense):
+            kernel_v = tf.gather(self.projection_layer.kernel_v, self.shortlist, axis=1)
+            return tf.nn.bias_add(tf.matmul(tf.matmul(inputs, self.projection_layer.kernel_u), kernel_v), bias)
+
+        kernel = tf.gather(self.projection_layer.kernel, self.shortlist, axis=1)
+        return tf.nn.bias_add(tf.matmul(inputs, kernel), bias)
+
+    def compute_output_shape(self, input_shape):
+        return tf.TensorShape(input_shape)[:-1].concatenate([None])
+
+
+class AdaptiveSoftmax(tf.layers.Layer):
+    """
+    Adaptive softmax (Grave et al., 2017). The head scores the frequent words and one entry per tail cluster, every
+    tail cluster of rarer words is scored through a smaller projection. Requires a vocabulary sorted by frequency.
+
+    Called on decoder outputs, the layer returns the log probabilities of every word so that it can be used as the
+    output layer of the decoders. Training uses loss, which only evaluates the tail of the targets.
+    """
+
+    def __init__(self, vocab_size, cutoffs, factor=4, **kwargs):
+        """
+        :param vocab_size: number of words
+        :param cutoffs: word indexes at which the head and every cluster end, e.g. [2000, 10000]
+        :param factor: the projection of every following cluster is smaller by this factor
+        """
+        super().__init__(**kwargs)
+        self.vocab_size = vocab_size
+        self.cutoffs = [cutoff for cutoff in cutoffs if cutoff < vocab_size] + [vocab_size]
+        self.factor = factor
+
+        self.head_size = self.cutoffs[0]
+        self.n_clusters = len(self.cutoffs) - 1
+
+        self.head_kernel = None
+        self.head_bias = None
+        self.tails = []
+
+    def build(self, input_shape):
+        n_hidden = int(input_shape[-1])
+
+        self.head_kernel = self.add_weight('head_kernel', [n_hidden, self.head_size + self.n_clusters])
+        self.head_bias = self.add_weight('head_bias', [self.head_size + self.n_clusters],
+                                         initializer=tf.zeros_initializer())
+
+        self.tails = []
+        for i in range(self.n_clusters):
+            size = self.cutoffs[i + 1] - self.cutoffs[i]
+            n_projection = max(1, n_hidden // (self.factor ** (i + 1)))
+            self.tails.append((
+                self.add_weight('tail_{0}_projection'.format(i), [n_hidden, n_projection]),
+                self.add_weight('tail_{0}_kernel'.format(i), [n_projection, size]),
+                self.add_weight('tail_{0}_bias'.format(i), [size], initializer=tf.zeros_initializer())
+            ))
+
+        super().build(input_shape)
+
+    def _tail_logits(self, inputs, i):
+        projection, kernel, bias = self.tails[i]
+        return tf.nn.bias_add(tf.matmul(tf.matmul(inputs, projection), kernel), bias)
+
+    def call(self, inputs):
+        # inputs are [batch size, n_hidden] during decoding
+        head = tf.nn.log_softmax(tf.nn.bias_add(tf.matmul(inputs, self.head_kernel), self.head_bias))
+
+        log_probs = [head[:, :self.head_size]]
+        for i in range(self.n_clusters):
+            cluster = head[:, self.head_size + i:self.head_size + i + 1]
+            log_probs.append(cluster + tf.nn.log_softmax(self._tail_logits(inputs, i)))
+
+        return tf.concat(log_probs, -1)
+
+    def loss(self, inputs, labels):
+        """
+        Cross entropy of every row
+
+        :param inputs: decoder outputs [batch size, n_hidden]
+        :param labels: target word indexes [batch size]
+        :return: losses [batch size]
+        """
+        head_labels = labels
+        clusters = []
+        for i in range(self.n_clusters):
+            in_cluster = tf.logical_and(labels >= self.cutoffs[i], labels < self.cutoffs[i + 1])
+            head_labels = tf.where(in_cluster, tf.fill(tf.shape(labels), self.head_size + i), head_labels)
+            clusters.append(in_cluster)
+
+        loss = tf.nn.sparse_softmax_cross_entropy_with_logits(
+            labels=head_labels,
+            logits=tf.nn.bias_add(tf.matmul(inputs, self.head_kernel), self.head_bias))
+
+        # only the rows whose target is in a cluster are projected by its tail
+        for i, in_cluster in enumerate(clusters):
+            indexes = tf.where(in_cluster)
+            tail_loss = tf.nn.sparse_softmax_cross_entropy_with_logits(
+                labels=tf.gather_nd(labels, indexes) - self.cutoffs[i],
+                logits=self._tail_logits(tf.gather_nd(inputs, indexes), i))
+            loss += tf.scatter_nd(indexes, tail_loss, tf.shape(loss, out_type=tf.int64))
+
+        return loss
+
+    def compute_output_shape(self, input_shape):
+        return tf.TensorShape(input_shape)[:-1].concatenate([self.vocab_size])
+
+
+def _build(model_config, data, softmax, shortlist=0, checkpoint=None):
+    model_config = copy.deepcopy(model_config)
+    model_config.model_structure['softmax'] = softmax
+    model_config.model_structure['shortlist'] = shortlist
+
+    model = am.Chatbot.ChatbotModel()
+    model.build_graph(model_config, data)
+    model.init_tensorflow()
+    model.training_metrics = None  # no traced calls during the timed steps
+    if checkpoint is not None:
+        # the projection keeps its variable names with either setting
+        model.saver.restore(model.sess, checkpoint)
+
+    return model
+
+
+def benchmark(model_config, data, steps=100, warm_up_steps=5, shortlist=None, input_sentences=None, repeat=3):
+    """
+    Compare the full and the sampled softmax, both trained from the same initial weights: the time of a training
+    step and, if the data has validation examples (see Data.split_validation), the validation cost and accuracy
+    afterwards, which always use the full softmax. With a shortlist and input sentences, the beam search of the
+    full softmax model is also compared with the same weights decoding from the shortlist.
+
+    :param model_config: model config of the chatbot
+    :param data: chatbot data
+    :param steps: number of timed training steps of every softmax
+    :param warm_up_steps: number of untimed training steps
+    :param shortlist: number of frequent words of the shortlist (Optional)
+    :param input_sentences: list of sentences to decode with and without the shortlist (Optional)
+    :param repeat: number of timed decoding runs, after one warm-up run
+    :return: a dict of the report
+    """
+    directory = tempfile.mkdtemp()
+    models = {}
+    report = {}
+
+    try:
+        initial = None
+        for softmax in ('full', 'sampled'):
+            model = models[softmax] = _build(model_config, data, softmax, checkpoint=initial)
+            if initial is None:
+                initial = model.saver.save(model.sess, join(directory, 'initial'),
+                                           write_meta_graph=False, write_state=False)
+
+            model.init_train_iterator()
+            model.run_train_steps(warm_up_steps)
+
+            start = time.perf_counter()
+            model.run_train_steps(steps)
+            report[softmax] = {'step_time': (time.perf_counter() - start) / steps}
+
+            if data.values.get('validation_x'):
+                result = model.evaluate()
+                report[softmax]['validation_cost'] = result['cost']
+                report[softmax]['validation_accuracy'] = result['accuracy']
+
+        report['speedup'] = report['full']['step_time'] / report['sampled']['step_time']
+
+        if shortlist is not None and input_sentences:
+            trained = models['full'].saver.save(models['full'].sess, join(directory, 'trained'),
+                                                write_meta_graph=False, write_state=False)
+            models['shortlist'] = _build(model_config, data, 'full', shortlist=shortlist, checkpoint=trained)
+
+            responses = {}
+            latency = {}
+            for role in ('full', 'shortlist'):
+                responses[role] = models[role].predict(input_sentences)  # warm-up
+
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    models[role].predict(input_sentences)
+                latency[role] = (time.perf_counter() - start) / repeat
+
+            pairs = list(zip(responses['shortlist'], responses['full']))
+            report['full']['decoding_latency'] = latency['full']
+            report['shortlist'] = {'decoding_latency': latency['shortlist'],
+                                   'exact_match': sum(short == full for short, full in pairs) / len(pairs)}
+    finally:
+        for model in models.values():
+            model.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return report
@@ -1,3 +1,6 @@
 from .ChatbotModel import ChatbotModel
 from .CombinedChatbotModel import CombinedChatbotModel
+from .Conversation import Conversation, ConversationStore
 from .ParseData import Parse
+from . import Softmax
+from . import Distillation
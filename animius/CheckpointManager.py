@@ -0,0 +1,217 @@
+import errno
+import glob
+import json
+import shutil
+import threading
+import time
+from os import mkdir, remove, replace
+from os.path import abspath, basename, join
+
+import tensorflow as tf
+
+
+class CheckpointManager:
+    """
+    Save checkpoints of a model without stalling training. Variables are copied to host memory on the calling
+    thread and written to disk by a background thread, through a separate session. Files are written to a
+    temporary directory and renamed into place, and the checkpoint state is only updated once the files are
+    complete, so a crash never leaves a half-written checkpoint. Model.load restores the latest one.
+
+    Checkpoints are named name-step-<global step>, only these are counted and deleted by max_to_keep,
+    checkpoints saved by Model.save are left alone and stay listed in the checkpoint state.
+    """
+
+    def __init__(self, model, directory, name='model', max_to_keep=5, every_steps=None, every_seconds=None):
+        """
+        :param model: model to save, its graph and session must be initialized
+        :param directory: directory of the checkpoints
+        :param name: name of the model files
+        :param max_to_keep: number of checkpoints to keep, older ones are deleted (None to keep all)
+        :param every_steps: save every this many training steps (Optional)
+        :param every_seconds: save every this many seconds of training (Optional)
+        """
+        self.model = model
+        self.directory = directory
+        self.name = name
+        self.max_to_keep = max_to_keep
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+
+        try:
+            # create directory if it does not already exist
+            mkdir(directory)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise exc
+
+        with model.graph.as_default():
+            self.variables = tf.global_variables()
+
+        self.last_step = model.config.get('global_step', 0)
+        self.last_time = time.time()
+
+        # checkpoints of this manager left by a previous run, oldest first
+        prefixes = [file[:-len('.index')] for file in glob.glob(self.prefix('*') + '.index')]
+        self.checkpoints = sorted([prefix for prefix in prefixes if prefix.rsplit('-', 1)[1].isdigit()],
+                                  key=lambda prefix: int(prefix.rsplit('-', 1)[1]))
+
+        # the latest snapshot waiting to be written, older ones are superseded
+        self.pending = None
+        self.writing = False
+        self.lock = threading.Lock()
+        self.written = threading.Condition(self.lock)
+        self.error = None
+
+        # writer graph, built by the background thread on its first write
+        self.writer_sess = None
+        self.writer_saver = None
+        self.writer_assigns = None
+
+    def prefix(self, global_step):
+        return join(self.directory, '{0}-step-{1}'.format(self.name, global_step))
+
+    def step(self):
+        """
+        Save a checkpoint if one is due, called after every training session call
+
+        :return: True if a checkpoint was started
+        """
+        global_step = self.model.config.get('global_step', 0)
+
+        if (self.every_steps is not None and global_step - self.last_step >= self.every_steps) or \
+                (self.every_seconds is not None and time.time() - self.last_time >= self.every_seconds):
+            self.save()
+            return True
+
+        return False
+
+    def save(self, block=False):
+        """
+        Snapshot the variables and write them on the background thread
+
+        :param block: wait until the checkpoint is written
+        :return: path prefix of the checkpoint
+        """
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+        self.last_step = self.model.config.get('global_step', 0)
+        self.last_time = time.time()
+
+        snapshot = {
+            'prefix': self.prefix(self.last_step),
+            'values': self.model.sess.run(self.variables),
+            # copies, training keeps updating the model config
+            'stored': json.loads(json.dumps({
+                'config': self.model.config,
+                'model_structure': self.model.model_structure,
+                'hyperparameters': self.model.hyperparameters
+            }))
+        }
+
+        with self.lock:
+            self.pending = snapshot
+            if not self.writing:
+                self.writing = True
+                threading.Thread(target=self._write_pending).start()
+
+        if block:
+            self.wait()
+
+        return snapshot['prefix']
+
+    def wait(self):
+        """
+        Block until every snapshot is written
+        """
+        with self.lock:
+            while self.writing:
+                self.written.wait()
+
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        self.wait()
+        if self.writer_sess is not None:
+            self.writer_sess.close()
+            self.writer_sess = None
+
+    def _write_pending(self):
+        while True:
+            with self.lock:
+                snapshot, self.pending = self.pending, None
+                if snapshot is None:
+                    self.writing = False
+                    self.written.notify_all()
+                    return
+
+            try:
+                self._write(snapshot)
+            except Exception as exc:
+                # raised on the training thread by the next save or wait
+                self.error = exc
+
+    def _build_writer(self, values):
+        graph = tf.Graph()
+        with graph.as_default():
+            placeholders = []
+            var_list = {}
+            for variable, value in zip(self.variables, values):
+                placeholder = tf.placeholder(variable.dtype.base_dtype, value.shape)
+                var_list[variable.op.name] = tf.Variable(placeholder, trainable=False)
+                placeholders.append(placeholder)
+
+            # same names as the saver of the model, see Model.init_tensorflow
+            self.writer_saver = tf.train.Saver(var_list=var_list, max_to_keep=None)
+            self.writer_assigns = (tf.global_variables_initializer(), placeholders)
+
+        self.writer_sess = tf.Session(graph=graph, config=tf.ConfigProto(device_count={'GPU': 0}))
+
+    def _write(self, snapshot):
+        if self.writer_sess is None:
+            self._build_writer(snapshot['values'])
+
+        initializer, placeholders = self.writer_assigns
+        self.writer_sess.run(initializer, feed_dict=dict(zip(placeholders, snapshot['values'])))
+
+        prefix = snapshot['prefix']
+        tmp_directory = join(self.directory, '.tmp-' + basename(prefix))
+        try:
+            self.writer_saver.save(self.writer_sess, join(tmp_directory, basename(prefix)),
+                                   write_meta_graph=False, write_state=False)
+
+            # the index is moved last, a checkpoint without its index cannot be restored
+            files = sorted(glob.glob(join(tmp_directory, basename(prefix) + '.*')), key=lambda f: f.endswith('.index'))
+            for file in files:
+                replace(file, join(self.directory, basename(file)))
+        finally:
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+
+        with open(join(self.directory, self.name + '.json.tmp'), 'w') as f:
+            json.dump(snapshot['stored'], f, indent=4)
+        replace(join(self.directory, self.name + '.json.tmp'), join(self.directory, self.name + '.json'))
+
+        if prefix in self.checkpoints:
+            self.checkpoints.remove(prefix)
+        self.checkpoints.append(prefix)
+
+        removed = []
+        if self.max_to_keep is not None:
+            while len(self.checkpoints) > self.max_to_keep:
+                removed.append(self.checkpoints.pop(0))
+
+        # checkpoints saved by Model.save in the same directory stay listed in the state
+        state = tf.train.get_checkpoint_state(self.directory)
+        own = {abspath(checkpoint) for checkpoint in self.checkpoints + removed}
+        others = [checkpoint for checkpoint in state.all_model_checkpoint_paths
+                  if abspath(checkpoint) not in own] if state is not None else []
+
+        # atomic, a crash keeps the previous state
+        tf.train.update_checkpoint_state(self.directory, prefix, others + self.checkpoints)
+
+        for old_prefix in removed:
+            for file in glob.glob(old_prefix + '.*'):
+                remove(file)
@@ -145,10 +145,11 @@ class Commands:
 
             'loadWaifu': [console.load_waifu,
                           {
-                              '-n': ['name', 'str', 'Name of waifu to load']
+                              '-n': ['name', 'str', 'Name of waifu to load'],
+                              '-w': ['warm_up', 'bool', 'Warm up the model after loading (Optional)']
                           },
                           'Load a waifu.',
-                          'loadWaifu -n \'waifu name\''
+                          'loadWaifu -n \'waifu name\' -w True'
                           ],
 
             'getWaifuDetail': [console.get_waifu_detail,
@@ -173,7 +174,8 @@ class Commands:
             'waifuPredict': [console.waifu_predict,
                              {
                                  '-n': ['name', 'str', 'Name of waifu'],
-                                 '-s': ['sentence', 'str', 'Sentence input']
+                                 '-s': ['sentence', 'str', 'Sentence input'],
+                                 '-sid': ['session_id', 'str', 'Identifier of the conversation (Optional)']
                              },
                              'Make prediction using waifu',
                              'waifuPredict -n \'waifu name\' -s \'Hello!\''
@@ -214,10 +216,11 @@ class Commands:
             'loadModel': [console.load_model,
                           {
                               '-n': ['name', 'str', 'Name of model to load'],
-                              '-d': ['data', 'str', 'Name of data to set to model']
+                              '-d': ['data', 'str', 'Name of data to set to model'],
+                              '-w': ['warm_up', 'bool', 'Warm up the model after loading (Optional)']
                           },
                           'Load a model',
-                          "loadModel -n 'model name' -d 'data name'"
+                          "loadModel -n 'model name' -d 'data name' -w True"
                           ],
 
             'getModelDetails': [console.get_model_details,
@@ -240,20 +243,145 @@ class Commands:
             'train': [console.train,
                       {
                           '-n': ['name', 'str', 'Name of model to train'],
-                          '-e': ['epoch', 'int', 'Number of epochs to train for']
+                          '-e': ['epoch', 'int', 'Number of epochs to train for'],
+                          '-cs': ['checkpoint_steps', 'int',
+                                  'Save a checkpoint in the background every this many steps (Optional)'],
+                          '-ct': ['checkpoint_seconds', 'int',
+                                  'Save a checkpoint in the background every this many seconds (Optional)'],
+                          '-k': ['max_to_keep', 'int', 'Number of background checkpoints to keep (Optional)'],
+                          '-w': ['workers', 'int', 'Number of data parallel training processes (Optional)'],
+                          '-ss': ['sync_steps', 'int', 'Number of steps between parameter averages (Optional)'],
+                          '-mp': ['metrics_path', 'str', 'JSON lines file to append training metrics to (Optional)'],
+                          '-es': ['eval_steps', 'int',
+                                  'Evaluate on the validation examples every this many steps (Optional)'],
+                          '-pa': ['patience', 'int', 'Stop after this many evaluations without improvement (Optional)']
                       },
                       'Train a model',
-                      "train -n 'model name' -e 10"
+                      "train -n 'model name' -e 10 -cs 1000 -es 500 -pa 5"
                       ],
 
+            'autotuneThreads': [console.autotune_threads,
+                                {
+                                    '-n': ['name', 'str', 'Name of model to tune'],
+                                    '-b': ['batch_size', 'int', 'Batch size to tune for (Optional)'],
+                                    '-r': ['repeat', 'int', 'Number of timed runs of every setting (Optional)']
+                                },
+                                'Benchmark thread pool sizes for a model on this machine and keep the fastest.',
+                                "autotuneThreads -n 'model name' -b 1"
+                                ],
+
+            'autotunePipeline': [console.autotune_pipeline,
+                                 {
+                                     '-c': ['model_config', 'str', 'Name of model config to tune'],
+                                     '-t': ['type', 'str', 'Type of model'],
+                                     '-d': ['data', 'str', 'Name of data'],
+                                     '-b': ['batch_sizes', 'list', 'Batch sizes to try (Optional)'],
+                                     '-m': ['memory_limit', 'int', 'Peak memory ceiling of a trial in MB (Optional)'],
+                                     '-s': ['steps', 'int', 'Number of timed steps of every trial (Optional)']
+                                 },
+                                 'Search the batch size and input pipeline settings with the highest training '
+                                 'throughput within a memory ceiling, and write them to a model config.',
+                                 "autotunePipeline -c 'model config name' -t 'Chatbot' -d 'data name' -m 4096"
+                                 ],
+
+            'benchmarkWorkers': [console.benchmark_workers,
+                                 {
+                                     '-n': ['name', 'str', 'Name of model to benchmark'],
+                                     '-w': ['workers', 'list', 'Numbers of worker processes to compare (Optional)'],
+                                     '-s': ['steps', 'int', 'Number of steps of every worker (Optional)'],
+                                     '-ss': ['sync_steps', 'int',
+                                             'Number of steps between parameter averages (Optional)']
+                                 },
+                                 'Measure the data parallel training throughput of a model '
+                                 'for different numbers of worker processes.',
+                                 "benchmarkWorkers -n 'model name' -w [1, 2, 4, 8, 16] -s 100"
+                                 ],
+
+            'benchmarkPredictOrder': [console.benchmark_predict_order,
+                                      {
+                                          '-n': ['name', 'str', 'Name of model to benchmark'],
+                                          '-i': ['input', 'list', 'Input sentences'],
+                                          '-r': ['repeat', 'int', 'Number of timed runs of every order (Optional)']
+                                      },
+                                      'Compare the prediction time of a chatbot or intent NER model with its inputs '
+                                      'sorted by length and in their original order.',
+                                      "benchmarkPredictOrder -n 'model name' -i ['hi', 'how are you doing today?']"
+                                      ],
+
+            'benchmarkSoftmax': [console.benchmark_softmax,
+                                 {
+                                     '-c': ['model_config', 'str', 'Name of model config of the chatbot'],
+                                     '-d': ['data', 'str', 'Name of chatbot data'],
+                                     '-s': ['steps', 'int', 'Number of timed training steps (Optional)'],
+                                     '-sl': ['shortlist', 'int', 'Size of the shortlist (Optional)'],
+                                     '-i': ['input', 'list', 'Sentences to decode with the shortlist (Optional)']
+                                 },
+                                 'Compare the training step time and validation quality of the full and sampled '
+                                 'softmax of a chatbot, and the decoding speed and responses of a shortlist.',
+                                 "benchmarkSoftmax -c 'model config name' -d 'data name' -sl 2000 -i ['hello']"
+                                 ],
+
+            'evaluate': [console.evaluate,
+                         {
+                             '-n': ['name', 'str', 'Name of model']
+                         },
+                         'Return the cost and accuracy of a model on the validation examples of its data',
+                         "evaluate -n 'model name'"
+                         ],
+
+            'getTrainingMetrics': [console.get_training_metrics,
+                                   {
+                                       '-n': ['name', 'str', 'Name of model']
+                                   },
+                                   'Get the throughput, step time, input stall and memory statistics '
+                                   'of the recent training steps of a model',
+                                   "getTrainingMetrics -n 'model name'"
+                                   ],
+
             'stopTraining': [console.stop_training,
                              {
                                  '-n': ['name', 'str', 'Name of model to stop']
                              },
-                             'Cancel training a model. (The model will stop once it finishes the current epoch)',
+                             'Cancel training a model. (The model will stop once it finishes the current training step)',
                              "stopTraining -n 'model name'"
                              ],
 
+            'sweep': [console.sweep,
+                      {
+                          '-c': ['model_config', 'str', 'Name of base model config'],
+                          '-t': ['type', 'str', 'Type of model'],
+                          '-d': ['data', 'str', 'Name of data'],
+                          '-s': ['search_space', 'dict', 'Values to try, by hyperparameters and model_structure'],
+                          '-p': ['directory', 'str', 'Directory of the results and of the trained models'],
+                          '-e': ['epoch', 'int', 'Maximum number of epochs of every trial'],
+                          '-n': ['trials', 'int', 'Number of configurations sampled from the search space (Optional)'],
+                          '-th': ['threads_per_trial', 'int', 'Number of threads of every trial (Optional)'],
+                          '-mp': ['max_parallel', 'int', 'Maximum number of trials at a time (Optional)'],
+                          '-m': ['memory_limit', 'int', 'Memory all running trials may use together in MB (Optional)'],
+                          '-pt': ['patience', 'int',
+                                  'Stop a trial whose cost has not improved for this many epochs (Optional)']
+                      },
+                      'Train variants of a model config in parallel processes, stopping poor trials early.',
+                      "sweep -c 'model config name' -t 'IntentNER' -d 'data name' -p 'sweep directory' -e 20 "
+                      "-s {'hyperparameters': {'learning_rate': [0.001, 0.0001]}}"
+                      ],
+
+            'stopSweep': [console.stop_sweep,
+                          {
+                              '-p': ['directory', 'str', 'Directory of the sweep to stop']
+                          },
+                          'Cancel a sweep, its running trials are terminated.',
+                          "stopSweep -p 'sweep directory'"
+                          ],
+
+            'getSweepResults': [console.get_sweep_results,
+                                {
+                                    '-p': ['directory', 'str', 'Directory of the sweep']
+                                },
+                                'Get the results table of a sweep.',
+                                "getSweepResults -p 'sweep directory'"
+                                ],
+
             'predict': [console.predict,
                         {
                             '-n': ['name', 'str', 'Name of model'],
@@ -265,6 +393,56 @@ class Commands:
                         "predict -n 'model name' -id 'name of input data' -s '\\some\\path.txt'"
                         ],
 
+            'predictStream': [console.predict_stream,
+                              {
+                                  '-n': ['name', 'str', 'Name of chatbot model'],
+                                  '-i': ['input', 'str', 'String to input'],
+                                  '-p': ['partial', 'bool', 'Return the response so far instead of words (Optional)'],
+                                  '-sid': ['session_id', 'str', 'Identifier of the conversation (Optional)']
+                              },
+                              'Generate a chatbot response word by word.',
+                              "predictStream -n 'model name' -i 'Hello!'"
+                              ],
+
+            'endConversation': [console.end_conversation,
+                                {
+                                    '-n': ['name', 'str', 'Name of chatbot model or waifu'],
+                                    '-sid': ['session_id', 'str', 'Identifier of the conversation']
+                                },
+                                'Discard the history of a conversation.',
+                                "endConversation -n 'waifu name' -sid 'session id'"
+                                ],
+
+            'enableResponseCache': [console.enable_response_cache,
+                                    {
+                                        '-n': ['name', 'str', 'Name of chatbot model (Optional)'],
+                                        '-w': ['waifu', 'str', 'Name of waifu (Optional)'],
+                                        '-s': ['max_size', 'int', 'Maximum number of cached responses (Optional)'],
+                                        '-t': ['ttl', 'float', 'Seconds a response stays valid (Optional)'],
+                                        '-p': ['path', 'str', 'Path to persist the cache in (Optional)']
+                                    },
+                                    'Cache the responses of a chatbot model or a waifu',
+                                    "enableResponseCache -w 'waifu name' [-s 1024] [-t 3600] [-p 'cache.pkl']"
+                                    ],
+
+            'disableResponseCache': [console.disable_response_cache,
+                                     {
+                                         '-n': ['name', 'str', 'Name of chatbot model (Optional)'],
+                                         '-w': ['waifu', 'str', 'Name of waifu (Optional)']
+                                     },
+                                     'Stop caching the responses of a chatbot model or a waifu',
+                                     "disableResponseCache -w 'waifu name'"
+                                     ],
+
+            'getResponseCacheStats': [console.get_response_cache_stats,
+                                      {
+                                          '-n': ['name', 'str', 'Name of chatbot model (Optional)'],
+                                          '-w': ['waifu', 'str', 'Name of waifu (Optional)']
+                                      },
+                                      'Return the hit rate and latency saved by a response cache',
+                                      "getResponseCacheStats -w 'waifu name'"
+                                      ],
+
             # endregion
             'getModelConfigDetails': [console.get_model_config_details,
                                       {
@@ -304,10 +482,16 @@ class Commands:
                                     '-ds': ['display_step', '', 'config.display_step'],
                                     '-tb': ['tensorboard', '', 'config.tensorboard'],
                                     '-hd': ['hyperdash', '', 'config.hyperdash'],
+                                    '-ep': ['execution_profile', 'str', 'config.execution_profile'],
+                                    '-it': ['intra_op_threads', 'int', 'config.intra_op_threads'],
+                                    '-et': ['inter_op_threads', 'int', 'config.inter_op_threads'],
 
                                     '-lr': ['learning_rate', 'float', 'Learning rate'],
                                     '-bs': ['batch_size', 'int', 'Batch size'],
                                     '-op': ['optimizer', 'str', 'Name of optimizer'],
+                                    '-npc': ['num_parallel_calls', 'int', 'hyperparameters.num_parallel_calls'],
+                                    '-pf': ['prefetch', 'int', 'hyperparameters.prefetch'],
+                                    '-as': ['accumulate_steps', 'int', 'hyperparameters.accumulate_steps'],
 
                                     '-ms': ['max_sequence', 'int', 'model_structure.max_sequence'],
                                     '-nh': ['n_hidden', 'int', 'model_structure.n_hidden'],
@@ -318,6 +502,11 @@ class Commands:
 
                                     '-l': ['layer', 'int', 'Number of layers'],
                                     '-bw': ['beam_width', 'int', 'Beam width'],
+                                    '-sm': ['softmax', 'str', 'model_structure.softmax'],
+                                    '-nsm': ['num_sampled', 'int', 'model_structure.num_sampled'],
+                                    '-sl': ['shortlist', 'int', 'model_structure.shortlist'],
+                                    '-ac': ['adaptive_cutoffs', 'list', 'model_structure.adaptive_cutoffs'],
+                                    '-af': ['adaptive_factor', 'int', 'model_structure.adaptive_factor'],
 
                                     '-fs1': ['filter_size_1', 'int', 'model_structure.filter_size_1'],
                                     '-fs2': ['filter_size_2', 'int', 'model_structure.filter_size_2'],
@@ -415,6 +604,15 @@ class Commands:
                                'Return the details of a data',
                                "getDataDetails -n 'data name'"],
 
+            'splitValidationData': [console.split_validation_data,
+                                    {
+                                        '-n': ['name', 'str', 'Name of data'],
+                                        '-f': ['fraction', 'float', 'Fraction of the examples to hold out'],
+                                        '-s': ['seed', 'int', 'Seed of the random choice of the examples (Optional)']
+                                    },
+                                    'Hold out a random fraction of the training examples of a data for evaluation',
+                                    "splitValidationData -n 'data name' -f 0.1"],
+
             'chatbotDataAddTwitter': [console.chatbot_data_add_twitter,
                                       {
                                           '-n': ['name', 'str', 'Name of data to add on'],
@@ -634,12 +832,76 @@ class Commands:
 
             'optimize': [console.optimize,
                          {
-                             '-n': ['name', 'str', 'Name of waifu to load']
+                             '-n': ['name', 'str', 'Name of model to optimize'],
+                             '-i': ['input', 'list',
+                                    'Inputs used to compare the optimized graph with the model (Optional)'],
+                             '-r': ['repeat', 'int', 'Number of timed runs when comparing (Optional)']
+                         },
+                         'Optimize a frozen model (see FreezeGraph) for inference, '
+                         'optionally checking its predictions and latency against the model.',
+                         "optimize -n 'model name' -i ['hello', 'how are you']"
+                         ],
+
+            'quantize': [console.quantize,
+                         {
+                             '-n': ['name', 'str', 'Name of model to quantize'],
+                             '-d': ['data', 'str', 'Name of data to calibrate on (Optional)'],
+                             '-s': ['sample_size', 'int', 'Number of examples used for calibration (Optional)'],
+                             '-m': ['mode', 'str', '\'weights\' or \'eightbit\' (Optional)']
                          },
-                         'Optimize a frozen model (see FreezeGraph) for inference.',
-                         "optimize -n 'model name'"
+                         'Quantize the inference graph of a model to 8 bits and compare it with the float graph.',
+                         "quantize -n 'model name' -d 'data name' -s 100 -m 'eightbit'"
                          ],
 
+            'distillLabel': [console.distill_label,
+                             {
+                                 '-n': ['name', 'str', 'Name of the teacher model'],
+                                 '-d': ['data', 'str', 'Name of the chatbot data whose inputs are labeled'],
+                                 '-p': ['path', 'str', 'Directory of the cache'],
+                                 '-c': ['chunk_size', 'int', 'Number of inputs labeled before writing (Optional)'],
+                                 '-sd': ['student_data', 'str', 'Name of a chatbot data to add the corpus to (Optional)']
+                             },
+                             'Label a chatbot corpus with the responses of a teacher model for distillation.',
+                             "distillLabel -n 'teacher name' -d 'data name' -p 'cache directory' -sd 'student data'"
+                             ],
+
+            'distillReport': [console.distill_report,
+                              {
+                                  '-n': ['name', 'str', 'Name of the teacher model'],
+                                  '-s': ['student', 'str', 'Name of the student model'],
+                                  '-i': ['input', 'list', 'Input sentences to compare on'],
+                                  '-r': ['repeat', 'int', 'Number of timed runs (Optional)']
+                              },
+                              'Compare the latency and responses of a teacher model and its student.',
+                              "distillReport -n 'teacher name' -s 'student name' -i ['hello', 'how are you']"
+                              ],
+
+            'factorize': [console.factorize,
+                          {
+                              '-n': ['name', 'str', 'Name of model to factorize'],
+                              '-nn': ['new_name', 'str', 'Name of the factorized model'],
+                              '-r': ['rank', 'int', 'Rank of the factorized layer'],
+                              '-d': ['data', 'str', 'Name of data to fine-tune on (Optional)'],
+                              '-e': ['epochs', 'int', 'Number of epochs to fine-tune (Optional)'],
+                              '-i': ['input', 'list', 'Inputs to compare both models on (Optional)'],
+                              '-rp': ['repeat', 'int', 'Number of timed runs (Optional)']
+                          },
+                          'Factorize the largest dense layer of a chatbot or speaker verification model '
+                          'into two low rank matrices and save it as a new model.',
+                          "factorize -n 'model name' -nn 'new model name' -r 64 -e 2 -i ['hello']"
+                          ],
+
+            'exportTFLite': [console.export_tflite,
+                             {
+                                 '-n': ['name', 'str', 'Name of model to export'],
+                                 '-b': ['batch_size', 'int', 'Batch size of the TFLite model (Optional)'],
+                                 '-i': ['input', 'list', 'Inputs used to benchmark the TFLite model (Optional)']
+                             },
+                             'Export a speaker verification model to TFLite, '
+                             'optionally benchmarking it against the frozen graph.',
+                             "exportTFLite -n 'model name' -b 1 -i ['audio.wav']"
+                             ],
+
             'sliceAudio': [console.slice_audio,
                            {
                                '-sp': ['subtitle_path', 'str', 'Path to subtitle file'],
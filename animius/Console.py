@@ -1,6 +1,7 @@
 import base64
 import json
 import os
+import types
 import zipfile
 from ast import literal_eval
 from concurrent.futures import ThreadPoolExecutor
@@ -111,6 +112,7 @@ class Console:
 
         self.training_pool = ThreadPoolExecutor(max_workers=3)  # thread pool for training threads
         self.training_models = dict()
+        self.sweeps = dict()  # cancellation tokens of the running sweeps, by directory
 
     @staticmethod
     def ParseArgs(user_input):
@@ -611,6 +613,9 @@ i
         tmp['saved_directory'] = self.waifu[kwargs['name']].saved_directory
         tmp['saved_name'] = self.waifu[kwargs['name']].saved_name
 
+        if self.waifu[kwargs['name']].item.combined_chatbot is not None:
+            tmp['load_profile'] = self.waifu[kwargs['name']].item.combined_chatbot.load_profile
+
         return tmp
 
     def get_model_details(self, **kwargs):
@@ -635,8 +640,56 @@ i
                'saved_directory': self.models[kwargs['name']].item.saved_directory,
                'saved_name': self.models[kwargs['name']].item.saved_name}
 
+        if self.models[kwargs['name']].item.response_cache is not None:
+            tmp['response_cache'] = self.models[kwargs['name']].item.response_cache.stats()
+
+        tmp['load_profile'] = self.models[kwargs['name']].item.load_profile
+
+        if self.models[kwargs['name']].item.training_metrics is not None:
+            tmp['training_metrics'] = self.models[kwargs['name']].item.training_metrics.latest
+
         return tmp
 
+    def get_training_metrics(self, **kwargs):
+        """
+        Return the throughput, step time percentiles, input stall and memory statistics of the recent training steps
+        of a model
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *name* (``str``) -- Name of model
+        """
+
+        Console.check_arguments(kwargs,
+                                hard_requirements=['name'])
+
+        if kwargs['name'] not in self.models:
+            raise NameNotFoundError("Model {0} not found".format(kwargs['name']))
+
+        if self.models[kwargs['name']].item.training_metrics is None:
+            return {}
+
+        return self.models[kwargs['name']].item.training_metrics.summary()
+
+    def evaluate(self, **kwargs):
+        """
+        Return the cost and accuracy of a model on the validation examples of its data
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *name* (``str``) -- Name of model
+        """
+
+        Console.check_arguments(kwargs,
+                                hard_requirements=['name'])
+
+        if kwargs['name'] not in self.models:
+            raise NameNotFoundError("Model {0} not found".format(kwargs['name']))
+
+        return self.models[kwargs['name']].item.evaluate()
+
     def get_data_details(self, **kwargs):
         """
         Return the details of a data
@@ -941,17 +994,20 @@ i
 
         :Keyword Arguments:
         * *name* (``str``) -- Name of waifu to load
+        * *warm_up* (``bool``) -- Run synthetic inputs through the model after loading (Optional)
         """
 
         Console.check_arguments(kwargs,
-                                hard_requirements=['name'])
+                                hard_requirements=['name'],
+                                soft_requirements=['warm_up'])
 
         if kwargs['name'] not in self.waifu:
             raise NameNotFoundError("Waifu \"{0}\" not found".format(kwargs['name']))
 
         waifu = am.Waifu.load(
             self.waifu[kwargs['name']].saved_directory,
-            self.waifu[kwargs['name']].saved_name)
+            self.waifu[kwargs['name']].saved_name,
+            warm_up=bool(kwargs['warm_up']))
 
         self.waifu[kwargs['name']].item = waifu
         self.waifu[kwargs['name']].loaded = True
@@ -965,14 +1021,16 @@ i
         :Keyword Arguments:
         * *name* (``str``) -- Name of waifu to use
         * *sentence* (``str``) -- Sentence input
+        * *session_id* (``str``) -- Identifier of the conversation, used as context (Optional)
         """
 
-        Console.check_arguments(kwargs, hard_requirements=['name', 'sentence'])
+        Console.check_arguments(kwargs, hard_requirements=['name', 'sentence'],
+                                soft_requirements=['session_id'])
 
         if kwargs['name'] not in self.waifu:
             raise NameNotFoundError("Waifu \"{0}\" not found".format(kwargs['waifu']))
 
-        return self.waifu[kwargs['name']].item.predict(kwargs['sentence'])
+        return self.waifu[kwargs['name']].item.predict(kwargs['sentence'], session_id=kwargs['session_id'])
 
     def create_model(self, **kwargs):
         """
@@ -1077,10 +1135,12 @@ i
 
         :Keyword Arguments:
         * *name* (``str``) -- Name of model to load
+        * *warm_up* (``bool``) -- Run synthetic inputs through the model after loading (Optional)
         """
 
         Console.check_arguments(kwargs,
-                                hard_requirements=['name'])
+                                hard_requirements=['name'],
+                                soft_requirements=['warm_up'])
 
         if kwargs['name'] not in self.models:
             raise NameNotFoundError("Model \"{0}\" not found".format(kwargs['name']))
@@ -1089,6 +1149,15 @@ i
             self.models[kwargs['name']].saved_directory,
             self.models[kwargs['name']].saved_name)
 
+        # keep the response cache of the previously loaded model, it is invalidated if the weights differ
+        previous = self.models[kwargs['name']].item
+        if previous is not None and previous.response_cache is not None:
+            model.response_cache = previous.response_cache
+            model.response_cache.set_identity(model.weights_identity())
+
+        if kwargs['warm_up']:
+            model.warm_up()
+
         self.models[kwargs['name']].item = model
         self.models[kwargs['name']].loaded = True
 
@@ -1131,22 +1200,55 @@ i
         :Keyword Arguments:
         * *name* (``str``) -- Name of model to set
         * *epoch* (``int``) -- Number of epoch
+        * *checkpoint_steps* (``int``) -- Save a checkpoint in the background every this many steps (Optional)
+        * *checkpoint_seconds* (``int``) -- Save a checkpoint in the background every this many seconds (Optional)
+        * *max_to_keep* (``int``) -- Number of background checkpoints to keep (Optional)
+        * *workers* (``int``) -- Number of data parallel training processes (Optional)
+        * *sync_steps* (``int``) -- Number of steps between parameter averages of the workers (Optional)
+        * *metrics_path* (``str``) -- JSON lines file to append training metrics to (Optional)
+        * *eval_steps* (``int``) -- Evaluate on the validation examples every this many steps (Optional)
+        * *patience* (``int``) -- Stop after this many evaluations without improvement (Optional)
         """
 
         Console.check_arguments(kwargs,
                                 hard_requirements=['name'],
-                                soft_requirements=['epoch'])
+                                soft_requirements=['epoch', 'checkpoint_steps', 'checkpoint_seconds', 'max_to_keep',
+                                                   'workers', 'sync_steps', 'metrics_path', 'eval_steps', 'patience'])
 
         if kwargs['name'] not in self.models:
             raise NameNotFoundError("Model \"{0}\" not found".format(kwargs['name']))
 
+        if kwargs['metrics_path'] is not None and self.models[kwargs['name']].item.training_metrics is not None:
+            self.models[kwargs['name']].item.training_metrics.replace_sink(am.JSONLinesSink(kwargs['metrics_path']))
+
+        if kwargs['checkpoint_steps'] is not None or kwargs['checkpoint_seconds'] is not None:
+            self.models[kwargs['name']].item.enable_checkpointing(
+                self.models[kwargs['name']].saved_directory,
+                self.models[kwargs['name']].saved_name,
+                max_to_keep=kwargs['max_to_keep'] if kwargs['max_to_keep'] is not None else 5,
+                every_steps=kwargs['checkpoint_steps'],
+                every_seconds=kwargs['checkpoint_seconds'])
+
+        if kwargs['eval_steps'] is not None:
+            self.models[kwargs['name']].item.enable_evaluation(kwargs['eval_steps'], patience=kwargs['patience'])
+        else:
+            self.models[kwargs['name']].item.disable_evaluation()
+
         cancelToken = CancellationToken()
 
         self.training_models[kwargs['name']] = cancelToken
 
-        future = self.training_pool.submit(self.models[kwargs['name']].item.train,
-                                           epochs=kwargs['epoch'],
-                                           cancellation_token=cancelToken)
+        if kwargs['workers'] is not None and kwargs['workers'] > 1:
+            trainer = am.DataParallelTrainer(self.models[kwargs['name']].item,
+                                             kwargs['workers'],
+                                             sync_steps=kwargs['sync_steps'] if kwargs['sync_steps'] is not None else 50)
+            future = self.training_pool.submit(trainer.train,
+                                               epochs=kwargs['epoch'],
+                                               cancellation_token=cancelToken)
+        else:
+            future = self.training_pool.submit(self.models[kwargs['name']].item.train,
+                                               epochs=kwargs['epoch'],
+                                               cancellation_token=cancelToken)
 
         callback_string = "Model {0} has finished training for {1} epochs!".format(kwargs['name'], kwargs['epoch'])
 
@@ -1157,9 +1259,249 @@ i
 
         print('Started training model {0}'.format(kwargs['name']))
 
+    def autotune_threads(self, **kwargs):
+        """
+        Benchmark thread pool sizes for a model on this machine and keep the fastest
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *name* (``str``) -- Name of model to tune
+        * *batch_size* (``int``) -- Batch size to tune for, 1 for serving latency (Optional)
+        * *repeat* (``int``) -- Number of timed runs of every setting (Optional)
+        """
+        Console.check_arguments(kwargs,
+                                hard_requirements=['name'],
+                                soft_requirements=['batch_size', 'repeat'])
+
+        if kwargs['name'] not in self.models:
+            raise NameNotFoundError("Model \"{0}\" not found".format(kwargs['name']))
+
+        report = am.Utils.autotune_threads(self.models[kwargs['name']].item,
+                                           batch_size=kwargs['batch_size'] if kwargs['batch_size'] is not None else 1,
+                                           repeat=kwargs['repeat'] if kwargs['repeat'] is not None else 10)
+
+        # keep the best setting
+        self.models[kwargs['name']].save()
+
+        return report
+
+    def autotune_pipeline(self, **kwargs):
+        """
+        Search the batch size and input pipeline settings with the highest training throughput on this machine,
+        within a memory ceiling, and write them to a model config
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *model_config* (``str``) -- Name of model config to tune
+        * *type* (``str``) -- Type of model
+        * *data* (``str``) -- Name of data
+        * *batch_sizes* (``list``) -- Batch sizes to try (Optional)
+        * *memory_limit* (``int``) -- Peak memory ceiling of a trial, in megabytes (Optional)
+        * *steps* (``int``) -- Number of timed steps of every trial (Optional)
+        """
+        Console.check_arguments(kwargs,
+                                hard_requirements=['model_config', 'type', 'data'],
+                                soft_requirements=['batch_sizes', 'memory_limit', 'steps'])
+
+        if kwargs['model_config'] not in self.model_configs:
+            raise NameNotFoundError("Model Config {0} not found".format(kwargs['model_config']))
+        if kwargs['data'] not in self.data:
+            raise NameNotFoundError("Data {0} not found".format(kwargs['data']))
+
+        report = am.Autotune.autotune_pipeline(
+            kwargs['type'],
+            self.model_configs[kwargs['model_config']].item,
+            self.data[kwargs['data']].item,
+            batch_sizes=kwargs['batch_sizes'],
+            memory_limit=kwargs['memory_limit'] * 1024 * 1024 if kwargs['memory_limit'] is not None else None,
+            steps=kwargs['steps'] if kwargs['steps'] is not None else 20)
+
+        # keep the best settings
+        self.model_configs[kwargs['model_config']].save()
+
+        return report
+
+    def benchmark_workers(self, **kwargs):
+        """
+        Measure the data parallel training throughput of a model for different numbers of worker processes.
+        The model is trained while measuring.
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *name* (``str``) -- Name of model to benchmark
+        * *workers* (``list``) -- Numbers of worker processes to compare (Optional)
+        * *steps* (``int``) -- Number of steps of every worker (Optional)
+        * *sync_steps* (``int``) -- Number of steps between parameter averages of the workers (Optional)
+        """
+        Console.check_arguments(kwargs,
+                                hard_requirements=['name'],
+                                soft_requirements=['workers', 'steps', 'sync_steps'])
+
+        if kwargs['name'] not in self.models:
+            raise NameNotFoundError("Model \"{0}\" not found".format(kwargs['name']))
+
+        if kwargs['name'] in self.training_models:
+            raise ValueError("Model \"{0}\" is training".format(kwargs['name']))
+
+        return am.DataParallelTrainer.benchmark(
+            self.models[kwargs['name']].item,
+            worker_counts=kwargs['workers'] if kwargs['workers'] is not None else [1, 2, 4, 8, 16],
+            steps=kwargs['steps'] if kwargs['steps'] is not None else 100,
+            sync_steps=kwargs['sync_steps'] if kwargs['sync_steps'] is not None else 50)
+
+    def benchmark_predict_order(self, **kwargs):
+        """
+        Compare the prediction time of a chatbot or intent NER model with its inputs sorted by length
+        and in their original order
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *name* (``str``) -- Name of model to benchmark
+        * *input* (``list``) -- Input sentences, more than one batch for sorting to matter
+        * *repeat* (``int``) -- Number of timed runs of every order (Optional)
+        """
+        Console.check_arguments(kwargs,
+                                hard_requirements=['name', 'input'],
+                                soft_requirements=['repeat'])
+
+        if kwargs['name'] not in self.models:
+            raise NameNotFoundError("Model \"{0}\" not found".format(kwargs['name']))
+
+        model = self.models[kwargs['name']].item
+
+        if model.config['class'] not in ('Chatbot', 'IntentNER'):
+            raise ValueError("Prediction order is only benchmarked for Chatbot and IntentNER models")
+
+        return am.Utils.benchmark_predict_order(model, kwargs['input'],
+                                                repeat=kwargs['repeat'] if kwargs['repeat'] is not None else 10)
+
+    def benchmark_softmax(self, **kwargs):
+        """
+        Compare the training step time and validation quality of the full and the sampled softmax of a chatbot,
+        and optionally the decoding latency and responses of a shortlist
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *model_config* (``str``) -- Name of model config of the chatbot
+        * *data* (``str``) -- Name of chatbot data
+        * *steps* (``int``) -- Number of timed training steps of every softmax (Optional)
+        * *shortlist* (``int``) -- Number of frequent words of the shortlist (Optional)
+        * *input* (``list``) -- Sentences to decode with and without the shortlist (Optional)
+        """
+        Console.check_arguments(kwargs,
+                                hard_requirements=['model_config', 'data'],
+                                soft_requirements=['steps', 'shortlist', 'input'])
+
+        if kwargs['model_config'] not in self.model_configs:
+            raise NameNotFoundError("Model Config {0} not found".format(kwargs['model_config']))
+        if kwargs['data'] not in self.data:
+            raise NameNotFoundError("Data {0} not found".format(kwargs['data']))
+
+        return am.Chatbot.Softmax.benchmark(self.model_configs[kwargs['model_config']].item,
+                                            self.data[kwargs['data']].item,
+                                            steps=kwargs['steps'] if kwargs['steps'] is not None else 100,
+                                            shortlist=kwargs['shortlist'],
+                                            input_sentences=kwargs['input'])
+
+    def sweep(self, **kwargs):
+        """
+        Train variants of a model config in parallel processes, stopping poor trials early.
+        The results are written to results.csv in the sweep directory.
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *model_config* (``str``) -- Name of base model config
+        * *type* (``str``) -- Type of model
+        * *data* (``str``) -- Name of data
+        * *search_space* (``dict``) -- Values to try, by hyperparameters and model_structure
+        * *directory* (``str``) -- Directory of the results and of the trained models
+        * *epoch* (``int``) -- Maximum number of epochs of every trial
+        * *trials* (``int``) -- Number of configurations sampled from the search space (Optional)
+        * *threads_per_trial* (``int``) -- Number of threads of every trial (Optional)
+        * *max_parallel* (``int``) -- Maximum number of trials at a time (Optional)
+        * *memory_limit* (``int``) -- Memory all running trials may use together, in megabytes (Optional)
+        * *patience* (``int``) -- Stop a trial whose cost has not improved for this many epochs (Optional)
+        """
+        Console.check_arguments(kwargs,
+                                hard_requirements=['model_config', 'type', 'data', 'search_space', 'directory',
+                                                   'epoch'],
+                                soft_requirements=['trials', 'threads_per_trial', 'max_parallel', 'memory_limit',
+                                                   'patience'])
+
+        if kwargs['model_config'] not in self.model_configs:
+            raise NameNotFoundError("Model Config {0} not found".format(kwargs['model_config']))
+        if kwargs['data'] not in self.data:
+            raise NameNotFoundError("Data {0} not found".format(kwargs['data']))
+        if kwargs['directory'] in self.sweeps:
+            raise NameAlreadyExistError("A sweep is already running in {0}".format(kwargs['directory']))
+
+        sweep = am.Sweep(kwargs['type'],
+                         self.model_configs[kwargs['model_config']].item,
+                         self.data[kwargs['data']].item,
+                         kwargs['search_space'],
+                         kwargs['directory'],
+                         kwargs['epoch'],
+                         trials=kwargs['trials'],
+                         threads_per_trial=kwargs['threads_per_trial'] if kwargs['threads_per_trial'] is not None
+                         else 1,
+                         max_parallel=kwargs['max_parallel'],
+                         memory_limit=kwargs['memory_limit'] * 1024 * 1024 if kwargs['memory_limit'] is not None
+                         else None,
+                         patience=kwargs['patience'])
+
+        cancelToken = CancellationToken()
+
+        self.sweeps[kwargs['directory']] = cancelToken
+
+        future = self.training_pool.submit(sweep.run, cancellation_token=cancelToken)
+
+        func = partial(Console.train_complete_callback,
+                       "Sweep in {0} has finished!".format(kwargs['directory']), kwargs['directory'], self.sweeps)
+
+        future.add_done_callback(func)
+
+        print('Started sweep in {0}'.format(kwargs['directory']))
+
+    def stop_sweep(self, **kwargs):
+        """
+        Cancel a sweep, its running trials are terminated
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *directory* (``str``) -- Directory of the sweep to stop
+        """
+        Console.check_arguments(kwargs, hard_requirements=['directory'])
+
+        if kwargs['directory'] not in self.sweeps:
+            raise NameNotFoundError("No sweep is running in {0}".format(kwargs['directory']))
+
+        self.sweeps[kwargs['directory']].cancel()
+
+    def get_sweep_results(self, **kwargs):
+        """
+        Get the results table of a sweep
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *directory* (``str``) -- Directory of the sweep
+
+        :return: list of the results of every trial
+        """
+        Console.check_arguments(kwargs, hard_requirements=['directory'])
+
+        return am.Sweep.load_results(kwargs['directory'])
+
     def stop_training(self, **kwargs):
         """
-        Cancel training a model. (The model will stop once it finishes the current epoch)
+        Cancel training a model. (The model will stop once it finishes the current training step)
 
         :param kwargs:
 
@@ -1218,6 +1560,134 @@ i
 
         return result
 
+    def predict_stream(self, **kwargs):
+        """
+        Generate a chatbot response word by word
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *name* (``str``) -- Name of chatbot model
+        * *input* (``str``) -- Sentence to respond to
+        * *partial* (``bool``) -- Yield the response generated so far instead of individual words (Optional)
+        * *session_id* (``str``) -- Identifier of the conversation, used as context (Optional)
+        """
+
+        Console.check_arguments(kwargs,
+                                hard_requirements=['name', 'input'],
+                                soft_requirements=['partial', 'session_id'])
+
+        if kwargs['name'] not in self.models:
+            raise NameNotFoundError("Model \"{0}\" not found".format(kwargs['name']))
+
+        model = self.models[kwargs['name']].item
+
+        if not isinstance(model, am.Chatbot.ChatbotModel):
+            raise ValueError("Model \"{0}\" is not a chatbot model".format(kwargs['name']))
+
+        conversation = None
+        if kwargs['session_id'] is not None:
+            conversation = model.get_conversation(kwargs['session_id'])
+
+        return model.predict_stream(kwargs['input'], partial=kwargs['partial'] is True, conversation=conversation)
+
+    def end_conversation(self, **kwargs):
+        """
+        Discard the history of a conversation
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *name* (``str``) -- Name of chatbot model or waifu
+        * *session_id* (``str``) -- Identifier of the conversation
+        """
+
+        Console.check_arguments(kwargs,
+                                hard_requirements=['name', 'session_id'])
+
+        if kwargs['name'] in self.models:
+            model = self.models[kwargs['name']].item
+        elif kwargs['name'] in self.waifu:
+            model = self.waifu[kwargs['name']].item.combined_chatbot
+        else:
+            raise NameNotFoundError("Model or waifu \"{0}\" not found".format(kwargs['name']))
+
+        model.end_conversation(kwargs['session_id'])
+
+    def _get_cache_owner(self, kwargs):
+        # response caches belong to either a model or a waifu
+        if kwargs['name'] is not None:
+            if kwargs['name'] not in self.models:
+                raise NameNotFoundError("Model \"{0}\" not found".format(kwargs['name']))
+            return self.models[kwargs['name']].item
+        elif kwargs['waifu'] is not None:
+            if kwargs['waifu'] not in self.waifu:
+                raise NameNotFoundError("Waifu \"{0}\" not found".format(kwargs['waifu']))
+            return self.waifu[kwargs['waifu']].item
+        else:
+            raise ArgumentError("name or waifu is required")
+
+    def enable_response_cache(self, **kwargs):
+        """
+        Cache the responses of a chatbot model or a waifu
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *name* (``str``) -- Name of chatbot model (Optional)
+        * *waifu* (``str``) -- Name of waifu (Optional)
+        * *max_size* (``int``) -- Maximum number of cached responses (Optional)
+        * *ttl* (``float``) -- Number of seconds a response stays valid (Optional)
+        * *path* (``str``) -- Path to persist the cache in (Optional)
+        """
+
+        Console.check_arguments(kwargs,
+                                soft_requirements=['name', 'waifu', 'max_size', 'ttl', 'path'])
+
+        owner = self._get_cache_owner(kwargs)
+
+        if kwargs['max_size'] is None:
+            kwargs['max_size'] = 1024
+
+        owner.enable_response_cache(max_size=kwargs['max_size'], ttl=kwargs['ttl'], path=kwargs['path'])
+
+    def disable_response_cache(self, **kwargs):
+        """
+        Stop caching the responses of a chatbot model or a waifu
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *name* (``str``) -- Name of chatbot model (Optional)
+        * *waifu* (``str``) -- Name of waifu (Optional)
+        """
+
+        Console.check_arguments(kwargs,
+                                soft_requirements=['name', 'waifu'])
+
+        self._get_cache_owner(kwargs).disable_response_cache()
+
+    def get_response_cache_stats(self, **kwargs):
+        """
+        Return the hit rate and latency saved by the response cache of a chatbot model or a waifu
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *name* (``str``) -- Name of chatbot model (Optional)
+        * *waifu* (``str``) -- Name of waifu (Optional)
+        """
+
+        Console.check_arguments(kwargs,
+                                soft_requirements=['name', 'waifu'])
+
+        owner = self._get_cache_owner(kwargs)
+
+        if owner.response_cache is None:
+            raise ValueError("Response cache is not enabled")
+
+        return owner.response_cache.stats()
+
     def freeze_graph(self, **kwargs):
         """
         Freeze model and save a frozen graph to file
@@ -1240,14 +1710,13 @@ i
             stored = json.load(f)
             class_name = stored['config']['class']
 
-        if class_name == 'Chatbot':
-            output_node_names = 'decode_1/output_infer'
-        elif class_name == 'CombinedChatbot':
-            output_node_names = 'decode_1/output_infer, intent/output_intent, intent/output_ner'
+        # the intent NER model of a combined chatbot is saved (and frozen) separately
+        if class_name == 'Chatbot' or class_name == 'CombinedChatbot':
+            output_node_names = ', '.join(am.Predictor.ChatbotPredictor.OUTPUTS)
         elif class_name == 'IntentNER':
-            output_node_names = 'output_intent, output_ner'
+            output_node_names = ', '.join(am.Predictor.IntentNERPredictor.OUTPUTS)
         elif class_name == 'SpeakerVerification':
-            output_node_names = 'output_predict'
+            output_node_names = ', '.join(am.Predictor.SpeakerVerificationPredictor.OUTPUTS)
         else:
             raise ValueError("Class name not found")
 
@@ -1255,15 +1724,19 @@ i
 
     def optimize(self, **kwargs):
         """
-        Optimize a frozen model for inference
+        Optimize a frozen model for inference. If inputs are given, the optimized graph is checked against the
+        predictions of the loaded checkpoint and the latencies of both are returned.
 
         :param kwargs:
 
         :Keyword Arguments:
         * *name* (``str``) -- Name of model to optimize
+        * *input* (``list``) -- Inputs used to compare the optimized graph with the model (Optional)
+        * *repeat* (``int``) -- Number of timed runs when comparing (Optional)
         """
         Console.check_arguments(kwargs,
-                                hard_requirements=['name'])
+                                hard_requirements=['name'],
+                                soft_requirements=['input', 'repeat'])
 
         if kwargs['name'] not in self.models:
             raise NameNotFoundError("Model \"{0}\" not found".format(kwargs['name']))
@@ -1274,22 +1747,263 @@ i
             stored = json.load(f)
             class_name = stored['config']['class']
 
-        if class_name == 'Chatbot':
-            input_node_names = ['input_x', 'input_x_length']
-            output_node_names = ['decode_1/output_infer']
-        elif class_name == 'CombinedChatbot':
-            input_node_names = ['input_x', 'input_x_length']
-            output_node_names = ['decode_1/output_infer', 'intent/output_intent', 'intent/output_ner']
+        if class_name == 'Chatbot' or class_name == 'CombinedChatbot':
+            predictor = am.Predictor.ChatbotPredictor
+        elif class_name == 'IntentNER':
+            predictor = am.Predictor.IntentNERPredictor
+        elif class_name == 'SpeakerVerification':
+            predictor = am.Predictor.SpeakerVerificationPredictor
+        else:
+            raise ValueError("Class name not found")
+
+        model = self.models[kwargs['name']].item
+
+        optimized_graph = am.Utils.optimize(model, predictor.INPUTS, predictor.OUTPUTS)
+
+        if kwargs['input'] is None:
+            return
+
+        if predictor is am.Predictor.SpeakerVerificationPredictor:
+            optimized = predictor(optimized_graph, model.model_structure, model.hyperparameters)
+        else:
+            optimized = predictor(optimized_graph, model.model_structure, model.hyperparameters,
+                                  embedding=model.data['embedding'])
+
+        try:
+            return optimized.compare(model, kwargs['input'],
+                                     repeat=kwargs['repeat'] if kwargs['repeat'] is not None else 5)
+        finally:
+            optimized.close()
+
+    def quantize(self, **kwargs):
+        """
+        Quantize the inference graph of a model to 8 bits and compare its outputs with the float graph
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *name* (``str``) -- Name of model to quantize
+        * *data* (``str``) -- Name of data to calibrate on (Optional, defaults to the data of the model)
+        * *sample_size* (``int``) -- Number of training examples used for calibration (Optional)
+        * *mode* (``str``) -- 'weights' or 'eightbit' (Optional)
+        """
+        Console.check_arguments(kwargs,
+                                hard_requirements=['name'],
+                                soft_requirements=['data', 'sample_size', 'mode'])
+
+        if kwargs['name'] not in self.models:
+            raise NameNotFoundError("Model \"{0}\" not found".format(kwargs['name']))
+
+        model = self.models[kwargs['name']].item
+
+        if kwargs['data'] is None:
+            data = model.data
+        elif kwargs['data'] in self.data:
+            data = self.data[kwargs['data']].item
+        else:
+            raise NameNotFoundError("Data \"{0}\" not found".format(kwargs['data']))
+
+        class_name = model.config['class']
+        if class_name == 'Chatbot' or class_name == 'CombinedChatbot':
+            predictor = am.Predictor.ChatbotPredictor
         elif class_name == 'IntentNER':
-            input_node_names = ['input_x', 'input_x_length']
-            output_node_names = ['output_intent', 'output_entities']
+            predictor = am.Predictor.IntentNERPredictor
         elif class_name == 'SpeakerVerification':
-            input_node_names = ['input_x']
-            output_node_names = ['output_predict']
+            predictor = am.Predictor.SpeakerVerificationPredictor
         else:
             raise ValueError("Class name not found")
 
-        am.Utils.optimize(self.models[kwargs['name']].saved_directory, input_node_names, output_node_names)
+        sample_size = kwargs['sample_size'] if kwargs['sample_size'] is not None else 100
+        mode = kwargs['mode'] if kwargs['mode'] is not None else 'weights'
+
+        feeds = predictor.sample_feeds(data, model.model_structure, sample_size)
+        quantized_graph = am.Utils.quantize(model, predictor.INPUTS, predictor.OUTPUTS,
+                                            calibration_feeds=feeds, mode=mode)
+
+        float_graph = model.config.get('optimized_graph', model.config['frozen_graph'])
+
+        if predictor is am.Predictor.SpeakerVerificationPredictor:
+            predictors = [predictor(path, model.model_structure, model.hyperparameters)
+                          for path in (float_graph, quantized_graph)]
+        else:
+            predictors = [predictor(path, model.model_structure, model.hyperparameters, embedding=data['embedding'])
+                          for path in (float_graph, quantized_graph)]
+
+        try:
+            return {'float_size': os.path.getsize(float_graph),
+                    'quantized_size': os.path.getsize(quantized_graph),
+                    'outputs': predictors[1].compare_outputs(predictors[0], feeds)}
+        finally:
+            for p in predictors:
+                p.close()
+
+    def export_tflite(self, **kwargs):
+        """
+        Export the inference graph of a speaker verification model to TFLite.
+        If inputs are given, the TFLite interpreter is benchmarked against the frozen graph in a tf.Session.
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *name* (``str``) -- Name of model to export
+        * *batch_size* (``int``) -- Batch size of the TFLite model (Optional, defaults to 1)
+        * *input* (``list``) -- Inputs used to benchmark the TFLite model (Optional)
+        """
+        Console.check_arguments(kwargs,
+                                hard_requirements=['name'],
+                                soft_requirements=['batch_size', 'input'])
+
+        if kwargs['name'] not in self.models:
+            raise NameNotFoundError("Model \"{0}\" not found".format(kwargs['name']))
+
+        model = self.models[kwargs['name']].item
+        batch_size = kwargs['batch_size'] if kwargs['batch_size'] is not None else 1
+
+        # the dynamic rnns of the chatbot and intent NER models build TF1 control flow (Enter, Exit, ...)
+        # that the TFLite converter rejects, and beam search decoding relies on ops (e.g. GatherTree)
+        # that have no TFLite kernel
+        if model.config['class'] != 'SpeakerVerification':
+            raise ValueError("TFLite export is only supported for SpeakerVerification models")
+
+        predictor = am.Predictor.SpeakerVerificationPredictor
+        lite_predictor = am.Predictor.SpeakerVerificationTFLitePredictor
+        input_shapes = [[batch_size,
+                         model.model_structure['input_window'],
+                         model.model_structure['input_cepstral']]]
+
+        tflite_model = am.Utils.export_tflite(model, predictor.INPUTS, predictor.OUTPUTS, input_shapes)
+
+        if kwargs['input'] is None:
+            return tflite_model
+
+        float_graph = model.config.get('optimized_graph', model.config['frozen_graph'])
+
+        return {
+            'session': am.Predictor.benchmark(
+                lambda: predictor(float_graph, model.model_structure, model.hyperparameters),
+                kwargs['input']),
+            'tflite': am.Predictor.benchmark(
+                lambda: lite_predictor(tflite_model, model.model_structure, model.hyperparameters),
+                kwargs['input'])
+        }
+
+    def distill_label(self, **kwargs):
+        """
+        Label the training inputs of a chatbot data with the responses of a teacher model, cached on disk.
+        The files can be added to the data of a smaller student model (see chatbotDataAddFiles).
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *name* (``str``) -- Name of the teacher model
+        * *data* (``str``) -- Name of the chatbot data whose inputs are labeled
+        * *path* (``str``) -- Directory of the cache
+        * *chunk_size* (``int``) -- Number of inputs labeled before writing to disk (Optional)
+        * *student_data* (``str``) -- Name of a chatbot data to add the labeled corpus to (Optional)
+        """
+        Console.check_arguments(kwargs,
+                                hard_requirements=['name', 'data', 'path'],
+                                soft_requirements=['chunk_size', 'student_data'])
+
+        if kwargs['name'] not in self.models:
+            raise NameNotFoundError("Model \"{0}\" not found".format(kwargs['name']))
+        if kwargs['data'] not in self.data:
+            raise NameNotFoundError("Data \"{0}\" not found".format(kwargs['data']))
+        if kwargs['student_data'] is not None and kwargs['student_data'] not in self.data:
+            raise NameNotFoundError("Data \"{0}\" not found".format(kwargs['student_data']))
+
+        inputs_path, responses_path = am.Chatbot.Distillation.label_corpus(
+            self.models[kwargs['name']].item,
+            self.data[kwargs['data']].item['train_x'],
+            kwargs['path'],
+            chunk_size=kwargs['chunk_size'] if kwargs['chunk_size'] is not None else 1024)
+
+        if kwargs['student_data'] is not None:
+            self.data[kwargs['student_data']].item.add_files(inputs_path, responses_path)
+
+        return {'x_path': inputs_path, 'y_path': responses_path}
+
+    def distill_report(self, **kwargs):
+        """
+        Compare the latency and responses of a teacher model and its distilled student
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *name* (``str``) -- Name of the teacher model
+        * *student* (``str``) -- Name of the student model
+        * *input* (``list``) -- Input sentences to compare on
+        * *repeat* (``int``) -- Number of timed runs (Optional)
+        """
+        Console.check_arguments(kwargs,
+                                hard_requirements=['name', 'student', 'input'],
+                                soft_requirements=['repeat'])
+
+        for name in (kwargs['name'], kwargs['student']):
+            if name not in self.models:
+                raise NameNotFoundError("Model \"{0}\" not found".format(name))
+
+        return am.Chatbot.Distillation.compare(self.models[kwargs['name']].item,
+                                               self.models[kwargs['student']].item,
+                                               kwargs['input'],
+                                               repeat=kwargs['repeat'] if kwargs['repeat'] is not None else 3)
+
+    def factorize(self, **kwargs):
+        """
+        Factorize the projection layer of a chatbot or the fully connected layer of a speaker verification model
+        into two low rank matrices, and save the result as a new model
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *name* (``str``) -- Name of model to factorize
+        * *new_name* (``str``) -- Name of the factorized model
+        * *rank* (``int``) -- Rank of the factorized layer
+        * *data* (``str``) -- Name of data to fine-tune on (Optional, defaults to the data of the model)
+        * *epochs* (``int``) -- Number of epochs to fine-tune (Optional)
+        * *input* (``list``) -- Inputs to compare the latency and predictions of both models on (Optional)
+        * *repeat* (``int``) -- Number of timed runs (Optional)
+        """
+        Console.check_arguments(kwargs,
+                                hard_requirements=['name', 'new_name', 'rank'],
+                                soft_requirements=['data', 'epochs', 'input', 'repeat'])
+
+        if kwargs['name'] not in self.models:
+            raise NameNotFoundError("Model \"{0}\" not found".format(kwargs['name']))
+
+        if kwargs['new_name'] in self.models:
+            raise NameAlreadyExistError("The name {0} is already used by another model".format(kwargs['new_name']))
+
+        if kwargs['data'] is None:
+            data = None
+        elif kwargs['data'] in self.data:
+            data = self.data[kwargs['data']].item
+        else:
+            raise NameNotFoundError("Data \"{0}\" not found".format(kwargs['data']))
+
+        model = self.models[kwargs['name']].item
+
+        factorized = am.Utils.factorize(model,
+                                        kwargs['rank'],
+                                        os.path.join(self.directories['models'], kwargs['new_name']),
+                                        kwargs['new_name'],
+                                        data=data,
+                                        fine_tune_epochs=kwargs['epochs'] if kwargs['epochs'] is not None else 0)
+
+        console_item = _ConsoleItem(factorized,
+                                    os.path.join(self.directories['models'], kwargs['new_name']),
+                                    kwargs['new_name'])
+
+        self.models[kwargs['new_name']] = console_item
+
+        report = {'parameters': am.Utils.count_parameters(model),
+                  'factorized_parameters': am.Utils.count_parameters(factorized)}
+
+        if kwargs['input'] is not None:
+            report.update(am.Utils.compare_predictions(model, factorized, kwargs['input'],
+                                                       repeat=kwargs['repeat'] if kwargs['repeat'] is not None else 3))
+
+        return report
 
     def create_model_config(self, **kwargs):
         """
@@ -1341,11 +2055,14 @@ i
 
         Console.check_arguments(kwargs, hard_requirements=['name'])
 
-        configs = ['device', 'class', 'epoch', 'cost', 'display_step', 'tensorboard', 'hyperdash']
-        hyperparameters = ['learning_rate', 'batch_size', 'optimizer']
+        configs = ['device', 'class', 'epoch', 'cost', 'display_step', 'tensorboard', 'hyperdash',
+                   'execution_profile', 'intra_op_threads', 'inter_op_threads']
+        hyperparameters = ['learning_rate', 'batch_size', 'optimizer', 'num_parallel_calls', 'prefetch',
+                           'accumulate_steps']
         intent_model_structures = ['n_ner_output', 'n_intent_output', 'node', 'gradient_clip', 'n_hidden',
                                    'max_sequence']
-        chatbot_model_structures = ['max_sequence', 'n_hidden', 'gradient_clip', 'node', 'layer', 'beam_width']
+        chatbot_model_structures = ['max_sequence', 'n_hidden', 'gradient_clip', 'node', 'layer', 'beam_width',
+                                    'softmax', 'num_sampled', 'shortlist', 'adaptive_cutoffs', 'adaptive_factor']
         speaker_model_structures = ['filter_size_1', 'num_filter_1', 'pool_size_1', 'pool_type', 'filter_size_2',
                                     'num_filter_2', 'fully_connected_1', 'input_window', 'input_cepstral']
 
@@ -1541,6 +2258,30 @@ i
         else:
             raise KeyError("Data \"{0}\" not found.".format(kwargs['name']))
 
+    def split_validation_data(self, **kwargs):
+        """
+        Hold out a random fraction of the training examples of a data for evaluation
+
+        :param kwargs:
+
+        :Keyword Arguments:
+        * *name* (``str``) -- Name of data
+        * *fraction* (``float``) -- Fraction of the examples to hold out
+        * *seed* (``int``) -- Seed of the random choice of the examples (Optional)
+
+        :return: the number of examples held out
+        """
+
+        Console.check_arguments(kwargs,
+                                hard_requirements=['name', 'fraction'],
+                                soft_requirements=['seed'])
+
+        if kwargs['name'] not in self.data:
+            raise NameNotFoundError("Data {0} not found".format(kwargs['name']))
+
+        return self.data[kwargs['name']].item.split_validation(kwargs['fraction'],
+                                                               seed=kwargs['seed'] if kwargs['seed'] is not None else 0)
+
     def chatbot_data_add_twitter(self, **kwargs):
         """
         Add twitter dataset to a chatbot data.
@@ -2120,7 +2861,10 @@ i
     @staticmethod
     def print_result(future):
         result = future.result()
-        if result is not None:
+        if isinstance(result, types.GeneratorType):  # streamed results
+            for item in result:
+                print(item)
+        elif result is not None:
             print(result)
 
     @staticmethod
@@ -0,0 +1,244 @@
+import json
+import math
+import multiprocessing
+import shutil
+import tempfile
+import time
+from os.path import join
+
+import numpy as np
+import psutil
+import tensorflow as tf
+
+
+def _worker(directory, name, data, shard, samples_seen, connection):
+    # runs in a separate process, see DataParallelTrainer
+    import animius as am
+
+    model = am.Model.load(directory, name, data=data)
+    model.train_shard = shard
+    model.config['samples_seen'] = samples_seen
+    model.init_train_iterator()
+
+    with model.graph.as_default():
+        variables = tf.trainable_variables()
+
+    connection.send('ready')
+
+    try:
+        while True:
+            command, value = connection.recv()
+
+            if command == 'train':
+                start = time.perf_counter()
+                _, cost_value = model.run_train_steps(value, fetch_cost=True)
+                connection.send((model.sess.run(variables), float(cost_value), time.perf_counter() - start))
+            elif command == 'set':
+                for variable, variable_value in zip(variables, value):
+                    variable.load(variable_value, model.sess)
+            else:  # stop
+                break
+    finally:
+        model.close()
+        connection.close()
+
+
+class DataParallelTrainer:
+    """
+    Train a model in several processes on one machine. Every worker process trains a copy of the model on its
+    own shard of the training data, and the trainable variables are averaged by this process, acting as the
+    parameter server, every sync_steps steps (the optimizer state stays local to the workers).
+    """
+
+    def __init__(self, model, workers, sync_steps=50):
+        """
+        :param model: model to train, its graph and session must be initialized
+        :param workers: number of worker processes
+        :param sync_steps: number of steps every worker trains between parameter averages
+        """
+        self.model = model
+        self.workers = workers
+        self.sync_steps = sync_steps
+
+        with model.graph.as_default():
+            self.variables = tf.trainable_variables()
+
+        self.directory = None
+        self.processes = []
+        self.connections = []
+
+    def start(self):
+        """
+        Start the worker processes from the current weights of the model
+        """
+        if self.processes:
+            return
+
+        # the workers load a copy of the model, without changing where the model is saved
+        self.directory = tempfile.mkdtemp()
+        self.model.saver.save(self.model.sess, join(self.directory, 'model'), write_meta_graph=False)
+
+        # the workers split the cores instead of all using every one of them
+        cores = psutil.cpu_count(logical=False) or psutil.cpu_count() or 1
+        config = dict(self.model.config,
+                      intra_op_threads=max(1, cores // self.workers),
+                      inter_op_threads=1)
+
+        with open(join(self.directory, 'model.json'), 'w') as f:
+            json.dump({
+                'config': config,
+                'model_structure': self.model.model_structure,
+                'hyperparameters': self.model.hyperparameters
+            }, f, indent=4)
+
+        # tensorflow is not fork safe
+        context = multiprocessing.get_context('spawn')
+
+        for index in range(self.workers):
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker,
+                                      args=(self.directory, 'model', self.model.data, (self.workers, index),
+                                            self.model.config.get('samples_seen', 0) // self.workers, child))
+            process.start()
+            child.close()
+            self.processes.append(process)
+            self.connections.append(parent)
+
+        for connection in self.connections:
+            self._receive(connection)  # ready
+
+    def _receive(self, connection):
+        try:
+            return connection.recv()
+        except EOFError:
+            # the worker died without reporting, e.g. killed for running out of memory
+            process = self.processes[self.connections.index(connection)]
+            self.stop()
+            raise RuntimeError('Training worker exited with code {0}'.format(process.exitcode))
+
+    def stop(self):
+        for connection in self.connections:
+            try:
+                connection.send(('stop', None))
+            except OSError:
+                pass  # the worker has already exited
+        for process in self.processes:
+            process.join()
+        for connection in self.connections:
+            connection.close()
+
+        self.processes = []
+        self.connections = []
+
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def run_steps(self, steps):
+        """
+        Train every worker for the given number of steps and average their variables
+
+        :param steps: number of steps of every worker
+        :return: mean cost and the slowest training time of the workers
+        """
+        for connection in self.connections:
+            connection.send(('train', steps))
+        results = [self._receive(connection) for connection in self.connections]
+
+        values = [np.mean([result[0][i] for result in results], axis=0) for i in range(len(self.variables))]
+        for connection in self.connections:
+            connection.send(('set', values))
+
+        for variable, value in zip(self.variables, values):
+            variable.load(value, self.model.sess)
+
+        self.model.config['global_step'] = self.model.config.get('global_step', 0) + steps
+        # counted in single process steps, so that either kind of training resumes the epoch
+        self.model.config['epoch_step'] = self.model.config.get('epoch_step', 0) + steps * self.workers
+        self.model.config['samples_seen'] = self.model.config.get('samples_seen', 0) + \
+            steps * self.workers * self.model.examples_per_step()
+
+        return float(np.mean([result[1] for result in results])), max(result[2] for result in results)
+
+    def train(self, epochs, cancellation_token=None):
+        """
+        Train the model for a number of epochs, with every worker going through its shard once per epoch.
+        The averaged weights are loaded into the model after every synchronization, which is also when the
+        evaluator and the checkpoint manager of the model, if enabled, are stepped.
+
+        :param epochs: number of epochs
+        :param cancellation_token: checked between synchronizations (Optional)
+        """
+        self.start()
+
+        self.model.start_training()
+
+        steps_per_epoch = math.ceil(self.model.train_steps_per_epoch() / self.workers)
+
+        try:
+            for _ in range(epochs):
+                # resume a cancelled epoch, the workers skip the samples already seen (see _worker)
+                batch_num = math.ceil(self.model.config.get('epoch_step', 0) / self.workers)
+
+                while batch_num < steps_per_epoch:
+
+                    if cancellation_token is not None and cancellation_token.is_cancalled:
+                        if self.model.checkpoint_manager is not None:
+                            self.model.checkpoint_manager.save()  # keep the position training stopped at
+                        return  # early stopping
+
+                    steps = min(self.sync_steps, steps_per_epoch - batch_num)
+                    cost_value, _ = self.run_steps(steps)
+                    batch_num += steps
+
+                    print("epoch:", self.model.config['epoch'], "- (", batch_num, ") -", cost_value)
+                    self.model.config['cost'] = cost_value
+
+                    if self.model.evaluator is not None:
+                        self.model.evaluator.step()
+                        if self.model.evaluator.stopped:
+                            return
+                    if self.model.checkpoint_manager is not None:
+                        self.model.checkpoint_manager.step()
+
+                self.model.config['epoch'] += 1
+                self.model.config['epoch_step'] = 0
+        finally:
+            self.stop()
+
+    @staticmethod
+    def benchmark(model, worker_counts=(1, 2, 4, 8, 16), steps=100, sync_steps=50):
+        """
+        Measure the training throughput of a model for every number of workers. The weights of the model change.
+
+        :param model: model to train
+        :param worker_counts: numbers of worker processes to compare
+        :param steps: number of steps of every worker, after one warm-up synchronization
+        :param sync_steps: number of steps between parameter averages
+        :return: a dict of the samples per second and the scaling efficiency (relative to one worker) of every count
+        """
+        report = {}
+
+        for workers in worker_counts:
+            trainer = DataParallelTrainer(model, workers, sync_steps=sync_steps)
+            trainer.start()
+            try:
+                trainer.run_steps(1)  # warm-up
+
+                start = time.perf_counter()
+                done = 0
+                while done < steps:
+                    trainer.run_steps(min(sync_steps, steps - done))
+                    done += min(sync_steps, steps - done)
+                elapsed = time.perf_counter() - start
+            finally:
+                trainer.stop()
+
+            report[workers] = {'samples_per_second': steps * workers * model.examples_per_step() / elapsed}
+
+        if worker_counts:
+            base = report[worker_counts[0]]['samples_per_second'] / worker_counts[0]
+            for workers in worker_counts:
+                report[workers]['efficiency'] = report[workers]['samples_per_second'] / (base * workers)
+
+        return report
@@ -0,0 +1,100 @@
+import time
+
+import tensorflow as tf
+
+
+class Evaluator:
+    """
+    Evaluate a model on its validation examples every few training steps (see Model.evaluate) and log the cost
+    and accuracy to the console and to the sinks of the training metrics. Training stops once the validation cost
+    has not improved for patience evaluations, the weights of the best evaluation are then restored.
+    """
+
+    def __init__(self, model, every_steps, patience=None, min_delta=0.0, restore_best=True):
+        """
+        :param model: model to evaluate, its graph and session must be initialized
+        :param every_steps: evaluate every this many training steps
+        :param patience: stop training after this many evaluations without improvement (None to never stop)
+        :param min_delta: minimum decrease of the validation cost counted as an improvement
+        :param restore_best: restore the weights of the best evaluation when stopping early
+        """
+        self.model = model
+        self.every_steps = every_steps
+        self.patience = patience
+        self.min_delta = min_delta
+        self.restore_best = restore_best
+
+        with model.graph.as_default():
+            self.variables = tf.trainable_variables()
+
+        self.last_step = model.config.get('global_step', 0)
+        self.history = []
+        self.best = None
+        self.best_weights = None
+        self.evaluations_without_improvement = 0
+        self.stopped = False
+
+    def step(self):
+        """
+        Evaluate if an evaluation is due, called after every training session call
+
+        :return: True if the model was evaluated
+        """
+        if self.model.config.get('global_step', 0) - self.last_step >= self.every_steps:
+            self.evaluate()
+            return True
+
+        return False
+
+    def evaluate(self):
+        """
+        Evaluate the model and check whether training should stop
+
+        :return: a dict of the validation metrics
+        """
+        self.last_step = self.model.config.get('global_step', 0)
+
+        result = self.model.evaluate()
+        metrics = {'validation_cost': result['cost'],
+                   'validation_accuracy': result['accuracy'],
+                   'time': time.time(),
+                   'global_step': self.last_step,
+                   'epoch': self.model.config['epoch']}
+        self.history.append(metrics)
+
+        print("epoch:", metrics['epoch'], "- step", metrics['global_step'],
+              "- validation cost:", metrics['validation_cost'], "- accuracy:", metrics['validation_accuracy'])
+
+        if self.model.training_metrics is not None:
+            self.model.training_metrics.write(metrics)
+
+        if self.best is None or metrics['validation_cost'] < self.best['validation_cost'] - self.min_delta:
+            self.best = metrics
+            self.evaluations_without_improvement = 0
+            if self.restore_best:
+                self.best_weights = self.model.sess.run(self.variables)
+        else:
+            self.evaluations_without_improvement += 1
+            if self.patience is not None and self.evaluations_without_improvement >= self.patience:
+                self.stop()
+
+        return metrics
+
+    def reset(self):
+        """
+        Let training continue after an early stop, patience counts from the next evaluation
+        """
+        self.stopped = False
+        self.evaluations_without_improvement = 0
+        self.last_step = self.model.config.get('global_step', 0)
+
+    def stop(self):
+        self.stopped = True
+
+        if self.best_weights is not None:
+            for variable, value in zip(self.variables, self.best_weights):
+                variable.load(value, self.model.sess)
+            self.model.set_checkpoint(None)
+
+        print("Stopped early, best validation cost:", self.best['validation_cost'],
+              "at step", self.best['global_step'])
@@ -1,3 +1,6 @@
+import time
+
+import numpy as np
 import tensorflow as tf
 
 import animius as am
@@ -11,7 +14,11 @@ class IntentNERModel(am.Model):
         return {
             'learning_rate': 0.003,
             'batch_size': 1024,
-            'optimizer': 'adam'
+            'optimizer': 'adam',
+            'steps_per_run': 8,  # training steps per session call, see Model.build_train_loop
+            'accumulate_steps': 1,  # batches whose gradients are summed per optimizer step, see Model.minimize
+            'num_parallel_calls': None,  # parallel parsing of the training pipeline (None to let tf.data tune it)
+            'prefetch': None  # batches prefetched by the training pipeline (None to let tf.data tune it)
         }
 
     @staticmethod
@@ -36,6 +43,7 @@ class IntentNERModel(am.Model):
         self.prediction = None
         self.train_op = None
         self.cost = None
+        self.train_cost = None  # mean cost of the batches of train_op, see Model.minimize
         self.tb_merged = None
         self.word_embedding = None
 
@@ -43,6 +51,9 @@ class IntentNERModel(am.Model):
         self.iterator = None
         self.predict_dataset = None
         self.predict_iterator = None
+        self.predict_order = None
+        self.predict_x = None
+        self.predict_x_length = None
 
     def init_dataset(self, data=None):
 
@@ -52,7 +63,8 @@ class IntentNERModel(am.Model):
 
         index_ds = tf.data.Dataset.from_tensor_slices(tf.expand_dims(tf.range(self.data_count), -1))
 
-        ds = index_ds.apply(tf.data.experimental.shuffle_and_repeat(buffer_size=self.data.steps_per_epoch))
+        ds = self.shuffle_train_indexes(index_ds, self.data.steps_per_epoch)
+        ds = ds.skip(self.train_skip)  # resume position, skipped before parsing
 
         def _py_func(x):
             x, x_length, y_intent, y_ner = tf.py_func(self.data.parse, [x, False], [tf.int32, tf.int32, tf.int32, tf.int32])
@@ -62,25 +74,34 @@ class IntentNERModel(am.Model):
 
         ds = ds.apply(tf.data.experimental.map_and_batch(_py_func,
                                                          self.hyperparameters['batch_size'],
-                                                         num_parallel_calls=tf.data.experimental.AUTOTUNE))
+                                                         num_parallel_calls=self.pipeline_setting('num_parallel_calls')))
 
         ds = ds.apply(tf.data.experimental.prefetch_to_device(self.config['device'],  # preload to training device
-                                                              buffer_size=tf.data.experimental.AUTOTUNE))
+                                                              buffer_size=self.pipeline_setting('prefetch')))
 
         self.dataset = ds
 
         return ds
 
     def init_predict_dataset(self):
-        index_ds = tf.data.Dataset.from_tensor_slices(tf.expand_dims(tf.range(self.data_count), -1))
+        # inputs are predicted in this order (see get_predict_order)
+        self.predict_order = tf.placeholder_with_default(tf.range(self.data_count), [None], name='ds_predict_order')
+
+        index_ds = tf.data.Dataset.from_tensor_slices(tf.expand_dims(self.predict_order, -1))
 
         def _py_func(x):
             return tf.py_func(self.data.parse, [x, True], [tf.int32, tf.int32])
 
+        def _trim(x, x_length):
+            # drop the padding shared by the whole batch
+            return x[:, :tf.reduce_max(x_length)], x_length
+
         ds = index_ds.apply(tf.data.experimental.map_and_batch(_py_func,
                                                                self.hyperparameters['batch_size'],
                                                                num_parallel_calls=tf.data.experimental.AUTOTUNE))
 
+        ds = ds.map(_trim)
+
         ds = ds.apply(tf.data.experimental.prefetch_to_device(self.config['device'],
                                                               buffer_size=tf.data.experimental.AUTOTUNE))
 
@@ -124,6 +145,12 @@ class IntentNERModel(am.Model):
                     self.init_predict_dataset()
                 self.predict_iterator = self.predict_dataset.make_initializable_iterator()
 
+                # x, x_length, y_intent, y_ner
+                eval_batch = self.init_eval_dataset(
+                    [tf.int32] * 4,
+                    [[None, self.model_structure['max_sequence']], [None], [None],
+                     [None, self.model_structure['max_sequence']]])
+
             with graph.device(self.config['device']):
 
                 if embedding_tensor is None:
@@ -161,9 +188,11 @@ class IntentNERModel(am.Model):
 
                     embedded_x = tf.nn.embedding_lookup(self.word_embedding, x)
                     # manually give shape since the py_func in tf.data pipeline pretty much fucked up the static shape
-                    embedded_x.set_shape([None, self.model_structure['max_sequence'], n_vector])
+                    # (predict batches are trimmed to their longest input)
+                    embedded_x.set_shape([None, None, n_vector])
 
                     batch_size = tf.shape(x)[0]
+                    sequence_length = tf.shape(x)[1]
 
                     outputs, _ = tf.nn.bidirectional_dynamic_rnn(cell_fw,
                                                                  cell_bw,
@@ -191,7 +220,7 @@ class IntentNERModel(am.Model):
 
                     entities = tf.concat(
                         [output_bw,
-                         tf.tile(tf.expand_dims(outputs_intent, 1), [1, self.model_structure['max_sequence'], 1])], -1
+                         tf.tile(tf.expand_dims(outputs_intent, 1), [1, sequence_length, 1])], -1
                     )
                     outputs_entities = tf.add(
                         tf.einsum('ijk,kl->ijl', entities, weights["out_ner"]),
@@ -201,22 +230,52 @@ class IntentNERModel(am.Model):
                     return outputs_intent, outputs_entities  # linear/no activation as there will be a softmax layer
 
                 # Optimization
-                logits_intent, logits_ner = network(self.x, self.x_length)
-                self.cost = tf.reduce_mean(
-                    tf.nn.softmax_cross_entropy_with_logits_v2(logits=logits_intent, labels=self.y_intent)
-                ) + tf.reduce_mean(
-                    tf.nn.softmax_cross_entropy_with_logits_v2(logits=logits_ner, labels=self.y_ner),
-                    name='train_cost'
-                )
+                def get_cost(x, x_length, y_intent, y_ner, name=None):
+                    logits_intent, logits_ner = network(x, x_length)
+                    return logits_cost(logits_intent, logits_ner, y_intent, y_ner, name=name)
+
+                def logits_cost(logits_intent, logits_ner, y_intent, y_ner, name=None):
+                    return tf.reduce_mean(
+                        tf.nn.softmax_cross_entropy_with_logits_v2(logits=logits_intent, labels=y_intent)
+                    ) + tf.reduce_mean(
+                        tf.nn.softmax_cross_entropy_with_logits_v2(logits=logits_ner, labels=y_ner),
+                        name=name
+                    )
+
+                self.cost = get_cost(self.x, self.x_length, self.y_intent, self.y_ner, name='train_cost')
 
                 # gradient clip rnn
                 optimizer = tf.train.AdamOptimizer(self.hyperparameters['learning_rate'])
-                gradients, variables = zip(*optimizer.compute_gradients(self.cost))
-                gradients, _ = tf.clip_by_global_norm(gradients, self.model_structure['gradient_clip'])
-                self.train_op = optimizer.apply_gradients(zip(gradients, variables), name='train_op')
+
+                def next_cost():
+                    x, x_length, y_intent, y_ner = self.iterator.get_next()
+                    x.set_shape([None, self.model_structure['max_sequence']])
+                    return get_cost(x, x_length, y_intent, y_ner)
+
+                self.train_cost, self.train_op = self.minimize(optimizer, self.cost, next_cost,
+                                                               clip_norm=self.model_structure['gradient_clip'],
+                                                               name='train_op')
+
+                def train_step():
+                    return self.minimize(optimizer, next_cost(), next_cost,
+                                         clip_norm=self.model_structure['gradient_clip'])
+
+                self.build_train_loop(train_step)
+
+                # Evaluation on the validation examples, the accuracy is the intent accuracy
+                eval_x, eval_x_length, eval_y_intent, eval_y_ner = eval_batch
+                eval_logits_intent, eval_logits_ner = network(eval_x, eval_x_length)
+                self.eval_cost = logits_cost(eval_logits_intent, eval_logits_ner,
+                                             tf.one_hot(eval_y_intent, self.model_structure['n_intent_output']),
+                                             tf.one_hot(eval_y_ner, self.model_structure['n_ner_output']))
+                self.eval_accuracy = tf.reduce_mean(tf.cast(
+                    tf.equal(tf.argmax(eval_logits_intent, -1, output_type=tf.int32), eval_y_intent), tf.float32))
 
                 pred_x, pred_x_length = self.predict_iterator.get_next()
-                pred_logits_intent, pred_logits_ner = network(pred_x, pred_x_length)
+                # named inputs that can be fed directly when serving a frozen graph (see Predictor)
+                self.predict_x = tf.placeholder_with_default(pred_x, [None, None], name='input_x')
+                self.predict_x_length = tf.placeholder_with_default(pred_x_length, [None], name='input_x_length')
+                pred_logits_intent, pred_logits_ner = network(self.predict_x, self.predict_x_length)
                 self.prediction = tf.nn.softmax(pred_logits_intent, name='output_intent'), \
                                   tf.nn.softmax(pred_logits_ner, name='output_ner')
 
@@ -235,9 +294,23 @@ class IntentNERModel(am.Model):
             # only init embedding when initializing other variables
             self.init_embedding(self.word_embedding)
 
+    def warm_up_batches(self, batch_size):
+        # the longest inputs, so that the largest buffers are allocated
+        max_sequence = self.model_structure['max_sequence']
+        x = np.full([batch_size, max_sequence], am.WordEmbedding.EOS, np.int32)
+        x[:, 0] = am.WordEmbedding.GO
+        x_length = np.full([batch_size], max_sequence, np.int32)
+
+        return [(self.prediction, {self.predict_x: x, self.predict_x_length: x_length})]
+
+    def train_data_count(self):
+        return len(self.data['train'])
+
     def train(self, epochs=400, cancellation_token=None):
 
-        self.sess.run(self.iterator.initializer, feed_dict={self.data_count: len(self.data['train'])})
+        self.init_train_iterator()
+
+        self.start_training()
 
         epoch = 0
 
@@ -246,19 +319,22 @@ class IntentNERModel(am.Model):
             if cancellation_token is not None and cancellation_token.is_cancalled:
                 return  # early stopping
 
-            batch_num = 0
+            batch_num = self.config.get('epoch_step', 0)  # resume a cancelled epoch
 
             try:
-                while batch_num < self.data.steps_per_epoch:
+                while batch_num < self.train_steps_per_epoch():
+
+                    # the cost is displayed every 100 batches
+                    steps = min(100 - batch_num % 100, self.train_steps_per_epoch() - batch_num)
 
                     if (self.config['display_step'] <= 1 or
                         self.config['epoch'] % self.config['display_step'] == 0 or
-                        epoch == epochs) and \
-                            (batch_num % 100 == 0 or batch_num == 0):
-
-                        # record cost too
+                        epoch == epochs):
 
-                        _, cost_value = self.sess.run([self.train_op, self.cost])
+                        done, cost_value = self.run_train_steps(steps, fetch_cost=True,
+                                                                cancellation_token=cancellation_token)
+                        if done == 0:
+                            return  # cancelled, training resumes from the position kept in config
 
                         print("epoch:", self.config['epoch'], "- (", batch_num, ") -", cost_value)
 
@@ -268,9 +344,12 @@ class IntentNERModel(am.Model):
                             self.hyperdash.metric("cost", cost_value)
 
                     else:
-                        self.sess.run([self.train_op])
+                        done, _ = self.run_train_steps(steps, cancellation_token=cancellation_token)
 
-                    batch_num += 1
+                    batch_num += done
+
+                    if done < steps:
+                        return  # cancelled, training resumes from the position kept in config
 
             except tf.errors.OutOfRangeError:
                 # this should never happen
@@ -283,6 +362,7 @@ class IntentNERModel(am.Model):
                 self.tensorboard_writer.add_summary(summary, self.config['epoch'])
 
             self.config['epoch'] += 1
+            self.config['epoch_step'] = 0
 
     @classmethod
     def load(cls, directory, name='model', data=None):
@@ -294,15 +374,22 @@ class IntentNERModel(am.Model):
         else:
             model.data = am.IntentNERData()
 
+        start = time.perf_counter()
         model.build_graph(model.model_config(), model.data)
+        model.load_profile['build_graph'] = time.perf_counter() - start
+        start = time.perf_counter()
         model.init_tensorflow(init_param=False, init_sess=True)
+        model.load_profile['init_session'] = time.perf_counter() - start
 
         checkpoint = tf.train.get_checkpoint_state(directory)
         input_checkpoint = checkpoint.model_checkpoint_path
 
+        start = time.perf_counter()
         with model.graph.as_default():
             model.saver.restore(model.sess, input_checkpoint)
+        model.load_profile['restore'] = time.perf_counter() - start
 
+        model.set_checkpoint(input_checkpoint)
         model.saved_directory = directory
         model.saved_name = name
 
@@ -317,8 +404,11 @@ class IntentNERModel(am.Model):
         else:
             self.data.set_input(input_data)  # try to match type
 
+        order = self.get_predict_order()
+
         with self.graph.device('/cpu:0'):
-            self.sess.run(self.predict_iterator.initializer, feed_dict={self.data_count: len(self.data['input'])})
+            self.sess.run(self.predict_iterator.initializer, feed_dict={self.data_count: len(self.data['input']),
+                                                                        self.predict_order: order})
 
         outputs_intent = []
         outputs_ner = []
@@ -328,25 +418,30 @@ class IntentNERModel(am.Model):
                 intents, ner = self.sess.run(self.prediction)
 
                 outputs_intent.append(intents)
-                outputs_ner.append(ner)
+                # pad trimmed batches back to max sequence
+                padding = self.model_structure['max_sequence'] - ner.shape[1]
+                outputs_ner.append(np.pad(ner, [(0, 0), (0, padding), (0, 0)], 'constant'))
 
                 batch_num += 1
         except tf.errors.OutOfRangeError:
             print(batch_num)
 
-        import numpy as np
-        outputs_intent = np.concatenate(outputs_intent)
-        outputs_ner = np.concatenate(outputs_ner)[:]
+        # restore the input order
+        restore_order = np.argsort(order)
+        outputs_intent = np.concatenate(outputs_intent)[restore_order]
+        outputs_ner = np.concatenate(outputs_ner)[restore_order]
 
         if raw:
             results = list(zip(outputs_intent.tolist(), outputs_ner.tolist()))
         else:
             # give only max
             max_intent = np.argmax(outputs_intent, axis=-1).tolist()
-            max_ner = np.argmax(outputs_ner, axis=-1).tolist()
+            max_ner = np.argmax(outputs_ner, axis=-1)[:, 1:]  # [0] is <GO>
 
-            for i in range(len(max_ner)):
-                max_ner[i] = max_ner[i][1:self.data.values['input'][i][1]]  # [0] is <GO>
+            # keep the entities of each input up to its length
+            ner_lengths = np.array([self.data.values['input'][i][1] for i in range(len(max_ner))]) - 1
+            max_ner = max_ner[np.arange(max_ner.shape[1]) < ner_lengths[:, np.newaxis]]
+            max_ner = [ner.tolist() for ner in np.split(max_ner, np.cumsum(ner_lengths)[:-1])]
 
             results = list(zip(max_intent, max_ner))
 
@@ -1,9 +1,14 @@
 import errno
 import json
+import math
+import time
+import uuid
 from abc import ABC, abstractmethod
 from os import mkdir
 from os.path import join
 
+import numpy as np
+import psutil
 import tensorflow as tf
 
 import animius as am
@@ -28,7 +33,14 @@ class Model(ABC):
             'cost': None,
             'display_step': 1,
             'tensorboard': None,
-            'hyperdash': None
+            'hyperdash': None,
+            'execution_profile': None,  # 'latency', 'throughput' or 'shared', see session_config
+            'intra_op_threads': None,  # overrides the thread counts of the profile, see Utils.autotune_threads
+            'inter_op_threads': None,
+            'seed': None,  # order of the training examples, see shuffle_train_indexes
+            'global_step': 0,
+            'epoch_step': 0,  # steps trained in the current epoch
+            'samples_seen': 0
         }
 
     @staticmethod
@@ -67,6 +79,43 @@ class Model(ABC):
         # save/load
         self.saved_directory = None
         self.saved_name = None
+        self.checkpoint = None  # path of the checkpoint holding the current weights
+        # bumped every time the weights change, identifies unsaved weights (see weights_identity)
+        self.weights_version = 0
+        self.weights_session = uuid.uuid4().hex
+
+        # cached prediction results, see ChatbotModel.enable_response_cache
+        self.response_cache = None
+
+        # predict inputs in length order, see get_predict_order
+        self.sort_predict_inputs = True
+
+        # seconds spent in every stage of loading (graph build, session, restore, embedding, warm-up)
+        self.load_profile = {}
+
+        # throughput and input stall statistics of training, see TrainingMetrics
+        self.training_metrics = am.TrainingMetrics()
+
+        # background checkpoints during training, see enable_checkpointing
+        self.checkpoint_manager = None
+
+        # skipped training samples when resuming, see shuffle_train_indexes
+        self.train_skip = None
+        self.train_shards = None
+        self.train_shard_index = None
+        self.train_shard = None  # (number of shards, index) of a data parallel worker
+
+        # several training steps per session call, see build_train_loop
+        self.train_loop = None
+        self.train_loop_steps = None
+
+        # evaluation on the validation examples, see init_eval_dataset and enable_evaluation
+        self.eval_inputs = None
+        self.eval_iterator = None
+        self.eval_cost = None
+        self.eval_accuracy = None
+        self.eval_batch_size = None
+        self.evaluator = None
 
     @abstractmethod
     def build_graph(self, model_config, data):
@@ -83,20 +132,60 @@ class Model(ABC):
                 self.saver = tf.train.Saver()
             if self.config['tensorboard'] is not None:
                 self.tensorboard_writer = tf.summary.FileWriter(self.config['tensorboard'])
+                self.training_metrics.add_sink(am.TensorBoardSink(self.tensorboard_writer))
 
             if init_sess:
-
-                # force cpu utilization
-                if self.config['device'] == '/cpu:0':
-                    config = tf.ConfigProto(device_count={'CPU': 1, 'GPU': 0}, allow_soft_placement=True)
-                else:  # gpu allow growth
-                    config = tf.ConfigProto(allow_soft_placement=True)
-                    config.gpu_options.allow_growth = True
-                self.sess = tf.Session(config=config, graph=graph)
+                self.sess = tf.Session(config=self.session_config(), graph=graph)
 
             if init_param:
                 self.sess.run(tf.global_variables_initializer())
 
+    def session_config(self):
+        """
+        Session options of the execution profile in config:
+
+        * 'latency' -- serving one request at a time: every core works on each op, ops run one at a time
+        * 'throughput' -- training or batch prediction: every core works on each op, independent ops (e.g. the
+          input pipeline) run alongside
+        * 'shared' -- several models on one host: a quarter of the cores, so that co-located models do not
+          oversubscribe them
+
+        Without a profile, tensorflow picks the thread counts. config['intra_op_threads'] and
+        config['inter_op_threads'] override the thread counts of any profile.
+        """
+        # force cpu utilization
+        if self.config['device'] == '/cpu:0':
+            config = tf.ConfigProto(device_count={'CPU': 1, 'GPU': 0}, allow_soft_placement=True)
+        else:  # gpu allow growth
+            config = tf.ConfigProto(allow_soft_placement=True)
+            config.gpu_options.allow_growth = True
+
+        profile = self.config.get('execution_profile')
+        cores = psutil.cpu_count(logical=False) or psutil.cpu_count() or 1
+
+        if profile == 'latency':
+            config.intra_op_parallelism_threads = cores
+            config.inter_op_parallelism_threads = 1
+            # fold constants and simplify the graph once, before the first run
+            config.graph_options.optimizer_options.opt_level = tf.OptimizerOptions.L1
+            config.graph_options.optimizer_options.do_function_inlining = True
+        elif profile == 'throughput':
+            config.intra_op_parallelism_threads = cores
+            config.inter_op_parallelism_threads = 2
+            config.graph_options.optimizer_options.opt_level = tf.OptimizerOptions.L1
+        elif profile == 'shared':
+            config.intra_op_parallelism_threads = max(1, cores // 4)
+            config.inter_op_parallelism_threads = 1
+        elif profile is not None:
+            raise ValueError("Unknown execution profile \"{0}\"".format(profile))
+
+        if self.config.get('intra_op_threads') is not None:
+            config.intra_op_parallelism_threads = self.config['intra_op_threads']
+        if self.config.get('inter_op_threads') is not None:
+            config.inter_op_parallelism_threads = self.config['inter_op_threads']
+
+        return config
+
     def init_hyperdash(self, name):
         if name is not None:
             from hyperdash import Experiment
@@ -105,10 +194,12 @@ class Model(ABC):
     def init_embedding(self, word_embedding_placeholder):
         # Do not include word embedding when restoring models
         if word_embedding_placeholder is not None and 'embedding' in self.data.values:
+            start = time.perf_counter()
             with self.sess.graph.as_default():
                 embedding_placeholder = tf.placeholder(tf.float32, shape=self.data['embedding'].embedding.shape)
                 self.sess.run(word_embedding_placeholder.assign(embedding_placeholder),
                               feed_dict={embedding_placeholder: self.data['embedding'].embedding})
+            self.load_profile['embedding'] = time.perf_counter() - start
         else:
             raise ValueError('Embedding not found.')
 
@@ -132,6 +223,331 @@ class Model(ABC):
     def predict(self, input_data, save_path=None):
         pass
 
+    def minimize(self, optimizer, cost, next_cost, clip_norm=None, name=None):
+        """
+        Build the training op of one optimizer step. With hyperparameters['accumulate_steps'] above 1, the
+        gradients of cost are summed with those of accumulate_steps - 1 more batches in an in-graph loop, then
+        averaged, clipped and applied once, so that large effective batches train in the memory of one batch.
+        The loop creates no variables, checkpoints stay compatible whatever the number of accumulated batches.
+
+        :param optimizer: optimizer applying the gradients
+        :param cost: cost of the first batch
+        :param next_cost: function that builds the cost of the next batch of the training iterator
+        :param clip_norm: global norm the gradients are clipped to (None to not clip)
+        :param name: name of the training op
+        :return: the mean cost of the batches and the training op
+        """
+        accumulate_steps = self.hyperparameters.get('accumulate_steps', 1)
+
+        gradients, variables = zip(*[(gradient, variable) for gradient, variable in optimizer.compute_gradients(cost)
+                                     if gradient is not None])
+
+        if accumulate_steps > 1:
+            def body(step, total_cost, *total_gradients):
+                batch_cost = next_cost()
+                batch_gradients = tf.gradients(batch_cost, variables)
+                return (step + 1, total_cost + batch_cost) + \
+                    tuple(total + tf.convert_to_tensor(gradient)
+                          for total, gradient in zip(total_gradients, batch_gradients))
+
+            # sparse gradients (e.g. of embeddings) are summed densely
+            _, total_cost, *gradients = tf.while_loop(lambda step, *_: step < accumulate_steps,
+                                                      body,
+                                                      [tf.constant(1), cost] +
+                                                      [tf.convert_to_tensor(gradient) for gradient in gradients],
+                                                      parallel_iterations=1,
+                                                      back_prop=False)
+            cost = total_cost / accumulate_steps
+            gradients = [gradient / accumulate_steps for gradient in gradients]
+
+        if clip_norm is not None:
+            gradients, _ = tf.clip_by_global_norm(gradients, clip_norm)
+
+        return cost, optimizer.apply_gradients(zip(gradients, variables), name=name)
+
+    def examples_per_step(self):
+        # every optimizer step trains on accumulate_steps batches, see minimize
+        return self.hyperparameters['batch_size'] * self.hyperparameters.get('accumulate_steps', 1)
+
+    def train_steps_per_epoch(self):
+        return math.ceil(self.data.steps_per_epoch / self.hyperparameters.get('accumulate_steps', 1))
+
+    def build_train_loop(self, train_step):
+        """
+        Build an in-graph loop running hyperparameters['steps_per_run'] optimizer steps per session call, so that
+        small models do not pay the session overhead at every batch. Nothing is built for a single step per run.
+
+        The loop is fetched through train_loop, which returns the mean cost of the steps. Feed train_loop_steps to
+        run fewer steps, e.g. at the end of an epoch.
+
+        :param train_step: function that builds the cost and the training op of one step on the next batch.
+                           It must reuse the variables and the optimizer of train_op
+        """
+        steps_per_run = self.hyperparameters.get('steps_per_run', 1)
+        if steps_per_run <= 1:
+            return
+
+        self.train_loop_steps = tf.placeholder_with_default(steps_per_run, [], name='train_loop_steps')
+
+        def body(step, total_cost):
+            cost, train_op = train_step()
+            with tf.control_dependencies([train_op]):
+                return step + 1, total_cost + cost
+
+        _, total_cost = tf.while_loop(lambda step, _: step < self.train_loop_steps,
+                                      body,
+                                      [tf.constant(0), tf.constant(0.0)],
+                                      parallel_iterations=1,
+                                      back_prop=False)
+        self.train_loop = tf.divide(total_cost, tf.cast(self.train_loop_steps, tf.float32), name='train_loop')
+
+    def run_train_steps(self, steps, fetch_cost=False, cancellation_token=None):
+        """
+        Run training steps, in as few session calls as the train loop allows. The training position
+        (global_step, epoch_step and samples_seen in config) is updated after every session call, so that a
+        cancelled or checkpointed run resumes where it stopped, see shuffle_train_indexes.
+
+        :param steps: number of steps
+        :param fetch_cost: whether to return the cost
+        :param cancellation_token: checked between session calls (Optional)
+        :return: the number of steps run (fewer than steps if cancelled) and, if fetch_cost, the mean cost of the
+                 steps when looping in-graph, otherwise the cost of the first step, averaged over its accumulated
+                 batches (None otherwise)
+        """
+        cost_value = None
+        total_cost = 0.0
+        done = 0
+
+        while done < steps:
+
+            if (cancellation_token is not None and cancellation_token.is_cancalled) or \
+                    (self.evaluator is not None and self.evaluator.stopped):
+                if self.checkpoint_manager is not None:
+                    self.checkpoint_manager.save()  # keep the position training stopped at
+                break
+
+            run_kwargs = self.training_metrics.run_kwargs() if self.training_metrics is not None else {}
+            start = time.perf_counter()
+
+            if self.train_loop is not None:
+                run_steps = min(steps - done, self.hyperparameters['steps_per_run'])
+                # the loop fetches the cost anyway
+                total_cost += self.sess.run(self.train_loop, feed_dict={self.train_loop_steps: run_steps},
+                                            **run_kwargs) * run_steps
+            else:
+                run_steps = 1
+                if fetch_cost and done == 0:
+                    _, cost_value = self.sess.run([self.train_op, self.train_cost], **run_kwargs)
+                else:
+                    self.sess.run([self.train_op], **run_kwargs)
+
+            if self.training_metrics is not None:
+                self.training_metrics.record(self, run_steps, time.perf_counter() - start, run_kwargs)
+
+            done += run_steps
+            self.config['global_step'] = self.config.get('global_step', 0) + run_steps
+            self.config['epoch_step'] = self.config.get('epoch_step', 0) + run_steps
+            self.config['samples_seen'] = self.config.get('samples_seen', 0) + run_steps * self.examples_per_step()
+
+            if self.evaluator is not None:
+                self.evaluator.step()
+
+            if self.checkpoint_manager is not None:
+                self.checkpoint_manager.step()
+
+        if self.train_loop is not None and done > 0:
+            cost_value = np.float32(total_cost / done)
+
+        return done, cost_value if fetch_cost else None
+
+    def shuffle_train_indexes(self, index_ds, buffer_size):
+        """
+        Shuffle and repeat the indexes of the training examples in an order fixed by config['seed'], so that
+        the pipeline can be restored to any position: skipping train_skip samples (config['samples_seen'] when
+        resuming, see init_train_iterator) replays the same shuffle, without parsing the examples skipped
+        if the skip is applied before the parsing.
+
+        :param index_ds: dataset of training example indexes
+        :param buffer_size: shuffle buffer size
+        :return: the shuffled dataset
+        """
+        if self.config.get('seed') is None:
+            self.config['seed'] = int(np.random.randint(2 ** 31 - 1))
+
+        self.train_skip = tf.placeholder_with_default(tf.constant(0, tf.int64), [], name='ds_train_skip')
+
+        # every data parallel worker trains on its own shard, see DataParallelTrainer
+        self.train_shards = tf.placeholder_with_default(tf.constant(1, tf.int64), [], name='ds_train_shards')
+        self.train_shard_index = tf.placeholder_with_default(tf.constant(0, tf.int64), [],
+                                                             name='ds_train_shard_index')
+        index_ds = index_ds.shard(self.train_shards, self.train_shard_index)
+
+        return index_ds.apply(tf.data.experimental.shuffle_and_repeat(buffer_size=buffer_size,
+                                                                      seed=self.config['seed']))
+
+    def init_eval_dataset(self, dtypes, shapes):
+        """
+        Batched iterator over the validation examples. The examples are parsed once (see Data.parse_validation)
+        and fed as arrays when the iterator is initialized, so evaluating does not go through the parsing pipeline.
+
+        :param dtypes: types of the outputs of the training pipeline
+        :param shapes: shapes of the outputs of the training pipeline, batch dimension included
+        :return: the next batch
+        """
+        self.eval_inputs = tuple(tf.placeholder(dtype, shape) for dtype, shape in zip(dtypes, shapes))
+
+        ds = tf.data.Dataset.from_tensor_slices(self.eval_inputs)
+        ds = ds.batch(self.hyperparameters['batch_size'])
+
+        self.eval_iterator = ds.make_initializable_iterator()
+        batch = self.eval_iterator.get_next()
+        self.eval_batch_size = tf.shape(batch[0])[0]
+
+        return batch
+
+    def evaluate(self):
+        """
+        Compute the cost and the accuracy of the model on the validation examples, see Data.split_validation
+
+        :return: a dict of the mean cost and accuracy
+        """
+        if self.eval_iterator is None:
+            raise ValueError('The graph of the model has no evaluation')
+
+        self.sess.run(self.eval_iterator.initializer,
+                      feed_dict=dict(zip(self.eval_inputs, self.data.parse_validation())))
+
+        total_cost = 0.0
+        total_accuracy = 0.0
+        count = 0
+        while True:
+            try:
+                cost, accuracy, batch_size = self.sess.run([self.eval_cost, self.eval_accuracy, self.eval_batch_size])
+            except tf.errors.OutOfRangeError:
+                break
+            total_cost += cost * batch_size
+            total_accuracy += accuracy * batch_size
+            count += batch_size
+
+        return {'cost': float(total_cost / count), 'accuracy': float(total_accuracy / count)}
+
+    def pipeline_setting(self, key):
+        # None, or missing in models saved before the setting existed, lets tf.data tune it
+        value = self.hyperparameters.get(key)
+        return tf.data.experimental.AUTOTUNE if value is None else value
+
+    @abstractmethod
+    def train_data_count(self):
+        pass
+
+    def init_train_iterator(self):
+        """
+        Initialize the training iterator at the position training stopped at
+        """
+        feed_dict = {self.data_count: self.train_data_count()}
+        if self.train_skip is not None:
+            feed_dict[self.train_skip] = self.config.get('samples_seen', 0)
+        if self.train_shard is not None:
+            feed_dict[self.train_shards], feed_dict[self.train_shard_index] = self.train_shard
+        self.sess.run(self.iterator.initializer, feed_dict=feed_dict)
+
+    def enable_checkpointing(self, directory=None, name='model', max_to_keep=5, every_steps=None, every_seconds=None):
+        """
+        Save checkpoints on a background thread while training, see CheckpointManager
+
+        :param directory: directory of the checkpoints (defaults to the saved directory)
+        :param name: name of the model files
+        :param max_to_keep: number of checkpoints to keep (None to keep all)
+        :param every_steps: save every this many training steps (Optional)
+        :param every_seconds: save every this many seconds of training (Optional)
+        :return: the checkpoint manager
+        """
+        if directory is None:
+            if self.saved_directory is None:
+                raise ValueError("Directory must be provided when saving for the first time")
+            directory = self.saved_directory
+
+        if name == 'model' and self.saved_name is not None:
+            name = self.saved_name
+
+        self.disable_checkpointing()
+        self.checkpoint_manager = am.CheckpointManager(self, directory, name, max_to_keep=max_to_keep,
+                                                       every_steps=every_steps, every_seconds=every_seconds)
+        return self.checkpoint_manager
+
+    def disable_checkpointing(self):
+        if self.checkpoint_manager is not None:
+            self.checkpoint_manager.close()
+            self.checkpoint_manager = None
+
+    def enable_evaluation(self, every_steps, patience=None, min_delta=0.0, restore_best=True):
+        """
+        Evaluate the model on the validation examples while training, and stop training early, see Evaluator
+
+        :param every_steps: evaluate every this many training steps
+        :param patience: stop training after this many evaluations without improvement (None to never stop)
+        :param min_delta: minimum decrease of the validation cost counted as an improvement
+        :param restore_best: restore the weights of the best evaluation when stopping early
+        :return: the evaluator
+        """
+        self.evaluator = am.Evaluator(self, every_steps, patience=patience, min_delta=min_delta,
+                                      restore_best=restore_best)
+        return self.evaluator
+
+    def disable_evaluation(self):
+        self.evaluator = None
+
+    def start_training(self):
+        # weights are about to change, invalidating cached responses
+        self.set_checkpoint(None)
+
+        if self.evaluator is not None:
+            # a previous run may have stopped early
+            self.evaluator.reset()
+
+    def warm_up_batches(self, batch_size):
+        """
+        Synthetic inputs of representative shapes for warm_up
+
+        :param batch_size: number of inputs in the batch
+        :return: a list of (fetches, feed_dict) to run
+        """
+        return []
+
+    def warm_up(self, batch_sizes=None):
+        """
+        Run synthetic batches through the inference graph so that the first prediction does not pay for the lazy
+        initialization, memory allocation and kernel selection of TensorFlow
+
+        :param batch_sizes: list of batch sizes to run (defaults to a single input and a full batch)
+        :return: seconds spent warming up
+        """
+        if batch_sizes is None:
+            batch_sizes = sorted({1, self.hyperparameters['batch_size']})
+
+        start = time.perf_counter()
+        for batch_size in batch_sizes:
+            for fetches, feed_dict in self.warm_up_batches(batch_size):
+                self.sess.run(fetches, feed_dict=feed_dict)
+        self.load_profile['warm_up'] = time.perf_counter() - start
+
+        return self.load_profile['warm_up']
+
+    def get_predict_order(self):
+        """
+        Order in which to predict the inputs of the data, sorted by token length so that every batch
+        only needs padding up to its own longest input (unless sort_predict_inputs is False)
+
+        :return: indexes of the inputs
+        """
+        count = len(self.data['input'])
+
+        if count <= self.hyperparameters['batch_size'] or not self.sort_predict_inputs:
+            # sorting does not change the padding of a single batch
+            return np.arange(count)
+
+        return np.argsort([self.data.input_length(i) for i in range(count)], kind='stable')
+
     def restore_config(self, directory, name='model'):
         with open(join(directory, name + '.json'), 'r') as f:
             stored = json.load(f)
@@ -140,7 +556,27 @@ class Model(ABC):
             self.hyperparameters = stored['hyperparameters']
 
     def restore_model(self, directory):
-        self.saver.restore(self.sess, tf.train.latest_checkpoint(directory))
+        checkpoint = tf.train.latest_checkpoint(directory)
+        self.saver.restore(self.sess, checkpoint)
+        self.set_checkpoint(checkpoint)
+
+    def set_checkpoint(self, checkpoint, weights_changed=True):
+        self.checkpoint = checkpoint
+        if weights_changed:
+            self.weights_version += 1
+        if self.response_cache is not None:
+            if weights_changed:
+                # cached responses are no longer valid
+                self.response_cache.set_identity(self.weights_identity())
+            else:
+                # saving only gives the current weights a name
+                self.response_cache.identity = self.weights_identity()
+
+    def weights_identity(self):
+        # the checkpoint holding the current weights, unsaved weights are told apart by their version
+        if self.checkpoint is not None:
+            return self.checkpoint
+        return 'unsaved-{0}-{1}'.format(self.weights_session, self.weights_version)
 
     def set_data(self, data):
         self.data = data
@@ -167,7 +603,13 @@ class Model(ABC):
             if exc.errno != errno.EEXIST:
                 raise exc
 
-        self.saver.save(self.sess, join(directory, name), global_step=self.config['epoch'], write_meta_graph=meta)
+        if self.checkpoint_manager is not None:
+            # a checkpoint still being written would otherwise replace the checkpoint state after this save
+            self.checkpoint_manager.wait()
+
+        checkpoint = self.saver.save(self.sess, join(directory, name), global_step=self.config['epoch'],
+                                     write_meta_graph=meta)
+        self.set_checkpoint(checkpoint, weights_changed=False)
         if graph:
             tf.train.write_graph(self.sess.graph.as_graph_def(), directory, name + '_graph.pb', as_text=False)
             self.config['graph'] = join(directory, name + '_graph.pb')
@@ -183,6 +625,9 @@ class Model(ABC):
         self.saved_directory = directory
         self.saved_name = name
 
+        if self.response_cache is not None and self.response_cache.path is not None:
+            self.response_cache.save()
+
         return directory
 
     @classmethod
@@ -209,4 +654,5 @@ class Model(ABC):
             model_structure=self.model_structure)
 
     def close(self):
+        self.disable_checkpointing()
         self.sess.close()
@@ -1,6 +1,7 @@
 import errno
 import json
 import math
+import time
 from abc import ABC, abstractmethod
 import os
 
@@ -16,8 +17,73 @@ class Data(ABC):
         self.saved_name = None
         self.model_config = None
 
+        # statistics of parsing training examples, see parse_stats
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.parse_time = 0.0  # seconds spent parsing the examples that were not cached
+
+        # training values and the values of the examples held out from them, see split_validation
+        self.validation_keys = {}
+        self.validation_cache = None
+
     def set_model_config(self, model_config):
         self.model_config = model_config
+        self.validation_cache = None  # parsing depends on the model structure
+
+    def split_validation(self, fraction, seed=0):
+        """
+        Hold out a random fraction of the training examples for evaluation, see Model.evaluate.
+        Examples held out by a previous split are returned to the training examples first.
+
+        :param fraction: fraction of the examples to hold out
+        :param seed: seed of the random choice of the examples
+        :return: the number of examples held out
+        """
+        for train_key, validation_key in self.validation_keys.items():
+            self.values[train_key] = list(self.values[train_key]) + list(self.values.get(validation_key, []))
+
+        count = len(self.values[next(iter(self.validation_keys))])
+        held_out = set(np.random.RandomState(seed).permutation(count)[:int(round(count * fraction))].tolist())
+
+        for train_key, validation_key in self.validation_keys.items():
+            values = self.values[train_key]
+            self.values[validation_key] = [value for i, value in enumerate(values) if i in held_out]
+            self.values[train_key] = [value for i, value in enumerate(values) if i not in held_out]
+
+        # training examples have new indexes
+        self.clear_train_cache()
+        self.validation_cache = None
+
+        return len(held_out)
+
+    def clear_train_cache(self):
+        pass
+
+    def parse_validation(self):
+        """
+        Parse the examples held out by split_validation once, later calls return the same arrays
+
+        :return: tuple of arrays, one per output of the training pipeline
+        """
+        if self.validation_cache is None:
+            if not self.values.get(next(iter(self.validation_keys.values()))):
+                raise ValueError('No validation examples, see split_validation')
+            self.validation_cache = self._parse_validation()
+
+        return self.validation_cache
+
+    @abstractmethod
+    def _parse_validation(self):
+        pass
+
+    def parse_stats(self):
+        total = self.cache_hits + self.cache_misses
+        return {
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_hit_rate': self.cache_hits / total if total > 0 else None,
+            'parse_time': self.parse_time
+        }
 
     def __getitem__(self, item):
         return self.values[item]
@@ -154,8 +220,12 @@ class ChatData(Data):
 
         self.values['train_x'] = []
         self.values['train_y'] = []
+        self.values['validation_x'] = []
+        self.values['validation_y'] = []
         self.values['input'] = []
 
+        self.validation_keys = {'train_x': 'validation_x', 'train_y': 'validation_y'}
+
         self.iter_count = 0
 
         self.enable_cache = True
@@ -292,6 +362,8 @@ class ChatData(Data):
             # try to convert to a list
             self.values['input'] = list(input_x)
 
+        self.predict_cache = dict()  # indexes now refer to different inputs
+
     def add_files(self, path_x, path_y):
 
         for line in open(path_x, 'r', encoding='utf8'):
@@ -329,16 +401,21 @@ class ChatData(Data):
                 go=True,
                 eos=True)
 
-            # if self.enable_cache:
-            #     # turn into int32 first (see issue #3)
-            #     self.cache[item] = np.array(x, np.int32), np.array(x_length, np.int32)
-            # don't store cache when predicting
+            # turn into int32 first (see issue #3)
+            result = np.array(x, np.int32), np.array(x_length, np.int32)
+
+            # the predict cache is reset whenever the input is set
+            if self.enable_cache:
+                self.predict_cache[item] = result
 
-            return np.array(x, np.int32), np.array(x_length, np.int32)
+            return result
 
         if self.enable_cache and item in self.cache:
+            self.cache_hits += 1
             return self.cache[item]
 
+        start = time.perf_counter()
+
         if isinstance(item, int):
             item_x = self.values['train_x'][item]
             item_y = self.values['train_y'][item]
@@ -356,12 +433,28 @@ class ChatData(Data):
         # cast to int32 (as py defaults to int64 on certain platforms)
         result = [np.array(x, np.int32) for x in result]
 
+        self.cache_misses += 1
+        self.parse_time += time.perf_counter() - start
+
         if self.enable_cache:
             self.cache[item] = result
             return self.cache[item]
         else:
             return result
 
+    def clear_train_cache(self):
+        self.cache = dict()
+
+    def _parse_validation(self):
+        # result_x, result_y, lengths_x, lengths_y, result_y_target of every example
+        results = [am.Chatbot.Parse.data_to_index(am.Chatbot.Parse.split_sentence(x.lower()),
+                                                  am.Chatbot.Parse.split_sentence(y.lower()),
+                                                  self.values['embedding'].words_to_index,
+                                                  max_seq=self.model_config.model_structure['max_sequence'])
+                   for x, y in zip(self.values['validation_x'], self.values['validation_y'])]
+
+        return tuple(np.array(values, np.int32) for values in zip(*results))
+
     @property
     def steps_per_epoch(self):
         return math.ceil(len(self.values['train_x']) / self.model_config.hyperparameters['batch_size'])
@@ -370,6 +463,10 @@ class ChatData(Data):
     def predict_steps(self):
         return math.ceil(len(self.values['input']) / self.model_config.hyperparameters['batch_size'])
 
+    def input_length(self, index):
+        # number of tokens of an input, including <GO>
+        return int(self.parse(index, from_input=True)[1])
+
 
 class IntentNERData(Data):
 
@@ -378,8 +475,11 @@ class IntentNERData(Data):
         super().__init__()
 
         self.values['train'] = []
+        self.values['validation'] = []
         self.values['input'] = []
 
+        self.validation_keys = {'train': 'validation'}
+
         self.folder_tmp = None
 
     def add_data(self, x_input):
@@ -470,7 +570,7 @@ class IntentNERData(Data):
                     self.values['input'][item[0]] = np.array(input_sentence, np.int32), np.array(input_length, np.int32)
                     return self.values['input'][item[0]]
 
-            # training data
+            # training data, pre-processed when added (not a cache lookup, so not counted in parse_stats)
             return self.values['train'][item[0]]
         elif isinstance(item, int):
             if from_input:
@@ -480,6 +580,10 @@ class IntentNERData(Data):
             raise NotImplementedError('Animius currently pre-processes intent NER data for better performance,'
                                       'please input an index instead')
 
+    def _parse_validation(self):
+        # x, x_length, y_intent, y_ner, pre-processed when added
+        return tuple(np.array(values, np.int32) for values in zip(*self.values['validation']))
+
     @property
     def steps_per_epoch(self):
         return math.ceil(len(self.values['train']) / self.model_config.hyperparameters['batch_size'])
@@ -488,6 +592,10 @@ class IntentNERData(Data):
     def predict_steps(self):
         return math.ceil(len(self.values['input']) / self.model_config.hyperparameters['batch_size'])
 
+    def input_length(self, index):
+        # number of tokens of an input, including <GO>
+        return int(self.parse(np.array([index]), from_input=True)[1])
+
 
 class SpeakerVerificationData(Data):
 
@@ -497,8 +605,12 @@ class SpeakerVerificationData(Data):
 
         self.values['train_x'] = []
         self.values['train_y'] = []
+        self.values['validation_x'] = []
+        self.values['validation_y'] = []
         self.values['input'] = []
 
+        self.validation_keys = {'train_x': 'validation_x', 'train_y': 'validation_y'}
+
         self.steps_per_epoch_cache = None
         self.predict_steps_cache = None
         self.predict_step_nums = dict()
@@ -638,9 +750,12 @@ class SpeakerVerificationData(Data):
             return data
 
         if self.enable_cache and item in self.cache:
+            self.cache_hits += 1
             return self.cache[item]
 
         # not in cache or cache not enabled, proceed to process
+        start = time.perf_counter()
+
         if isinstance(item, int):
             item_path, item_label = self.values['train_x'][item], self.values['train_y'][item]
             # if item is an index
@@ -653,12 +768,33 @@ class SpeakerVerificationData(Data):
                                                     num_cepstral=self.model_config.model_structure['input_cepstral'],
                                                     flatten=False)
 
+        self.cache_misses += 1
+        self.parse_time += time.perf_counter() - start
+
         if self.enable_cache:
             self.cache[item] = data, np.repeat(np.array([item_label], dtype='float32'), data.shape[0])
             return self.cache[item]
         else:
             return data, np.repeat(np.array([item_label], dtype='float32'), data.shape[0])
 
+    def clear_train_cache(self):
+        self.cache = dict()
+        self.steps_per_epoch_cache = None
+
+    def _parse_validation(self):
+        # windows of every file, labelled with the label of the file
+        x, y = [], []
+        for path, label in zip(self.values['validation_x'], self.values['validation_y']):
+            data = am.SpeakerVerification.MFCC.get_MFCC(path,
+                                                        window=self.model_config.model_structure['input_window'],
+                                                        num_cepstral=self.model_config.model_structure[
+                                                            'input_cepstral'],
+                                                        flatten=False)
+            x.append(data.astype(np.float32))
+            y.append(np.repeat(np.array([label], dtype='float32'), data.shape[0]))
+
+        return np.concatenate(x), np.concatenate(y)
+
     @property
     def steps_per_epoch(self):
         if self.steps_per_epoch_cache is not None:
@@ -0,0 +1,376 @@
+import json
+import time
+from abc import ABC, abstractmethod
+from os.path import join
+
+import numpy as np
+import psutil
+import tensorflow as tf
+
+import animius as am
+
+
+class Predictor(ABC):
+    """
+    Serve a frozen graph without rebuilding the training graph, the dataset pipeline or ModelData.
+    Inputs are fed directly into the named input placeholders of the model.
+    """
+
+    INPUTS = []
+    OUTPUTS = []
+
+    def __init__(self, graph_path, model_structure, hyperparameters=None):
+        """
+        :param graph_path: path to the frozen graph (see Utils.freeze_graph)
+        :param model_structure: model structure of the frozen model
+        :param hyperparameters: hyperparameters of the frozen model, used for the batch size (Optional)
+        """
+        self.model_structure = model_structure
+        self.hyperparameters = hyperparameters if hyperparameters is not None else {}
+        self.batch_size = self.hyperparameters.get('batch_size', 128)
+
+        graph_def = am.Utils.load_graph_def(graph_path)
+        graph_def = am.Utils.strip_input_pipeline(graph_def, self.INPUTS, self.OUTPUTS)
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+
+        self.inputs = [self.graph.get_tensor_by_name(name + ':0') for name in self.INPUTS]
+        self.outputs = [self.graph.get_tensor_by_name(name + ':0') for name in self.OUTPUTS]
+
+        self.sess = tf.Session(graph=self.graph)
+
+    @classmethod
+    def load(cls, directory, name='model', optimized=True, quantized=False, **kwargs):
+        """
+        Load the frozen graph of a saved model
+
+        :param directory: path to the directory in which the model is saved
+        :param name: name of the saved model
+        :param optimized: use the optimized graph (see Utils.optimize) if there is one
+        :param quantized: use the quantized graph (see Utils.quantize) if there is one
+        :param kwargs: additional arguments of the predictor
+        :return: a predictor
+        """
+        with open(join(directory, name + '.json'), 'r') as f:
+            stored = json.load(f)
+
+        config = stored['config']
+
+        if quantized and 'quantized_graph' in config:
+            graph_path = config['quantized_graph']
+        elif optimized and 'optimized_graph' in config:
+            graph_path = config['optimized_graph']
+        elif 'frozen_graph' in config:
+            graph_path = config['frozen_graph']
+        else:
+            raise ValueError('No frozen graph found. Freeze the model with Utils.freeze_graph first')
+
+        return cls(graph_path, stored['model_structure'], stored['hyperparameters'], **kwargs)
+
+    def run(self, *inputs):
+        return self.sess.run(self.outputs, feed_dict=dict(zip(self.inputs, inputs)))
+
+    def run_batches(self, *inputs):
+        """
+        Run the graph in mini batches and concatenate the outputs
+        """
+        results = [[] for _ in self.outputs]
+
+        for start in range(0, len(inputs[0]), self.batch_size):
+            outputs = self.run(*[x[start:start + self.batch_size] for x in inputs])
+            for result, output in zip(results, outputs):
+                result.append(output)
+
+        return results
+
+    def run_all(self, *inputs):
+        """
+        Run the graph in mini batches and concatenate the outputs of every batch
+        """
+        return [np.concatenate(output) for output in self.run_batches(*inputs)]
+
+    @abstractmethod
+    def predict(self, input_data):
+        pass
+
+    @classmethod
+    @abstractmethod
+    def sample_feeds(cls, data, model_structure, sample_size=100):
+        """
+        Build the graph inputs of a sample of training data, used for calibration
+
+        :param data: ModelData of the model
+        :param model_structure: model structure of the model (the model config of data may not be set)
+        :param sample_size: maximum number of examples to use
+        :return: a list of input arrays in the order of INPUTS
+        """
+        pass
+
+    def compare_outputs(self, predictor, feeds):
+        """
+        Compare the raw outputs of two predictors of the same model (e.g. float and quantized)
+
+        :param predictor: predictor to compare against
+        :param feeds: list of input arrays, see sample_feeds
+        :return: a dict of differences for every output
+        """
+        report = {}
+
+        for name, output, expected in zip(self.OUTPUTS, self.run_all(*feeds), predictor.run_all(*feeds)):
+            if np.issubdtype(expected.dtype, np.integer):
+                # token ids
+                report[name] = {'agreement': float(np.mean(output == expected))}
+                continue
+
+            result = {'max_difference': float(np.max(np.abs(output - expected))),
+                      'mean_difference': float(np.mean(np.abs(output - expected)))}
+            if expected.shape[-1] > 1:
+                # class probabilities
+                result['agreement'] = float(np.mean(np.argmax(output, -1) == np.argmax(expected, -1)))
+            else:
+                # binary logits
+                result['agreement'] = float(np.mean((output > 0) == (expected > 0)))
+            report[name] = result
+
+        return report
+
+    def compare(self, model, input_data, repeat=5):
+        """
+        Check that the predictor gives the same results as a model restored from its checkpoint and compare latencies
+
+        :param model: model (or another predictor) to compare against
+        :param input_data: inputs passed to both predict methods
+        :param repeat: number of timed runs, the first (warm-up) run is not timed
+        :return: a dict with the parity and average latencies in seconds
+        """
+        expected = model.predict(input_data)
+        results = self.predict(input_data)
+
+        def latency(predict):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                predict(input_data)
+            return (time.perf_counter() - start) / repeat
+
+        model_latency = latency(model.predict)
+        predictor_latency = latency(self.predict)
+
+        return {
+            'match': results == expected,
+            'mismatches': sum(result != expect for result, expect in zip(results, expected)),
+            'model_latency': model_latency,
+            'predictor_latency': predictor_latency,
+            'speedup': model_latency / predictor_latency if predictor_latency > 0 else None
+        }
+
+    def close(self):
+        self.sess.close()
+
+
+class TokenPredictor(Predictor, ABC):
+
+    GO = True
+    EOS = False
+
+    def __init__(self, graph_path, model_structure, hyperparameters=None, embedding=None):
+        if embedding is None:
+            raise ValueError('A word embedding is required to tokenize the inputs')
+
+        super().__init__(graph_path, model_structure, hyperparameters)
+
+        self.embedding = embedding
+
+    def tokenize(self, sentences):
+        return self.tokenize_sentences(sentences, self.embedding, self.model_structure['max_sequence'])
+
+    @classmethod
+    def tokenize_sentences(cls, sentences, embedding, max_sequence):
+        return am.Chatbot.Parse.sentences_to_index(sentences, embedding.words_to_index, max_seq=max_sequence,
+                                                   go=cls.GO, eos=cls.EOS)
+
+
+class ChatbotPredictor(TokenPredictor):
+
+    INPUTS = ['chatbot/input_x', 'chatbot/input_x_length']
+    OUTPUTS = ['chatbot/decode_1/output_infer']
+
+    GO = True
+    EOS = True
+
+    def run_all(self, *inputs):
+        outputs = []
+        for infer in self.run_batches(*inputs)[0]:
+            # decoding stops early once every beam has finished, pad to a common length
+            padding = self.model_structure['max_sequence'] - infer.shape[-1]
+            outputs.append(np.pad(infer, [(0, 0), (0, 0), (0, padding)],
+                                  'constant', constant_values=self.embedding.EOS))
+        return [np.concatenate(outputs)]
+
+    def predict(self, input_data):
+        outputs = self.run_all(*self.tokenize(input_data))[0]
+
+        # only read the first beam, skip EOS & GO
+        return am.Utils.LazySentences(outputs[:, 0], self.embedding.words_array,
+                                      [self.embedding.EOS, self.embedding.GO]).tolist()
+
+    @classmethod
+    def sample_feeds(cls, data, model_structure, sample_size=100):
+        return list(cls.tokenize_sentences(data['train_x'][:sample_size],
+                                           data['embedding'],
+                                           model_structure['max_sequence']))
+
+
+class IntentNERPredictor(TokenPredictor):
+
+    INPUTS = ['input_x', 'input_x_length']
+    OUTPUTS = ['output_intent', 'output_ner']
+
+    GO = True
+    EOS = False
+
+    def predict(self, input_data):
+        x, x_length = self.tokenize(input_data)
+
+        intents, ner = self.run_all(x, x_length)
+        ner = np.argmax(ner, axis=-1)[:, 1:]  # [0] is <GO>
+
+        # keep the entities of each input up to its length
+        ner_lengths = x_length - 1
+        ner = ner[np.arange(ner.shape[1]) < ner_lengths[:, np.newaxis]]
+        ner = [n.tolist() for n in np.split(ner, np.cumsum(ner_lengths)[:-1])]
+
+        return list(zip(np.argmax(intents, axis=-1).tolist(), ner))
+
+    @classmethod
+    def sample_feeds(cls, data, model_structure, sample_size=100):
+        # training data is stored as (input, length, intent, ner)
+        sample = data['train'][:sample_size]
+        return [np.stack([item[0] for item in sample]), np.stack([item[1] for item in sample])]
+
+
+class SpeakerVerificationPredictor(Predictor):
+
+    INPUTS = ['input_x']
+    OUTPUTS = ['output_predict']
+
+    def predict(self, input_data, raw=False):
+        if isinstance(input_data, str):
+            input_data = [input_data]
+
+        windows = self.get_windows(input_data, self.model_structure)
+
+        logits = self.run_all(np.concatenate(windows))[0]
+        # the frozen graph ends at the logits, apply the sigmoid here
+        outputs = 1 / (1 + np.exp(-logits.reshape(-1)))
+
+        means = am.Utils.window_means(outputs, [w.shape[0] for w in windows])
+
+        if raw:
+            return means.tolist()
+        return (means > 0.5).tolist()
+
+    @staticmethod
+    def get_windows(paths, model_structure):
+        return [am.SpeakerVerification.MFCC.get_MFCC(path,
+                                                     window=model_structure['input_window'],
+                                                     num_cepstral=model_structure['input_cepstral'],
+                                                     flatten=False)
+                for path in paths]
+
+    @classmethod
+    def sample_feeds(cls, data, model_structure, sample_size=100):
+        return [np.concatenate(cls.get_windows(data['train_x'][:sample_size], model_structure))]
+
+
+class TFLitePredictor(Predictor, ABC):
+    """
+    Run a TFLite model (see Utils.export_tflite) through the TFLite interpreter instead of a tf.Session.
+    The input and output tensors are allocated once, inputs are run in batches of the exported batch size.
+    """
+
+    def __init__(self, model_path, model_structure, hyperparameters=None):
+        self.model_structure = model_structure
+        self.hyperparameters = hyperparameters if hyperparameters is not None else {}
+
+        self.interpreter = tf.lite.Interpreter(model_path=model_path)
+        self.interpreter.allocate_tensors()
+
+        # order the tensors as INPUTS and OUTPUTS
+        input_details = {detail['name']: detail for detail in self.interpreter.get_input_details()}
+        output_details = {detail['name']: detail for detail in self.interpreter.get_output_details()}
+        self.inputs = [input_details[name] for name in self.INPUTS]
+        self.outputs = [output_details[name] for name in self.OUTPUTS]
+
+        self.batch_size = int(self.inputs[0]['shape'][0])
+
+    @classmethod
+    def load(cls, directory, name='model', **kwargs):
+        """
+        Load the TFLite model of a saved model
+
+        :param directory: path to the directory in which the model is saved
+        :param name: name of the saved model
+        :param kwargs: additional arguments of the predictor
+        :return: a predictor
+        """
+        with open(join(directory, name + '.json'), 'r') as f:
+            stored = json.load(f)
+
+        if 'tflite_model' not in stored['config']:
+            raise ValueError('No TFLite model found. Export the model with Utils.export_tflite first')
+
+        return cls(stored['config']['tflite_model'], stored['model_structure'], stored['hyperparameters'], **kwargs)
+
+    def run(self, *inputs):
+        count = len(inputs[0])
+
+        for detail, x in zip(self.inputs, inputs):
+            # pad the last batch to the allocated size
+            x = np.asarray(x, dtype=detail['dtype'])
+            if count < self.batch_size:
+                x = np.pad(x, [(0, self.batch_size - count)] + [(0, 0)] * (x.ndim - 1), 'edge')
+            self.interpreter.set_tensor(detail['index'], x)
+
+        self.interpreter.invoke()
+
+        return [self.interpreter.get_tensor(detail['index'])[:count] for detail in self.outputs]
+
+    def close(self):
+        self.interpreter = None
+
+
+class SpeakerVerificationTFLitePredictor(SpeakerVerificationPredictor, TFLitePredictor):
+    pass
+
+
+def benchmark(create, input_data, repeat=10):
+    """
+    Measure the load time, memory and latency of a predictor
+
+    :param create: function creating the predictor
+    :param input_data: inputs passed to predict
+    :param repeat: number of timed runs, after one warm-up run
+    :return: a dict of the load time and latency in seconds and the memory in bytes
+    """
+    process = psutil.Process()
+    memory = process.memory_info().rss
+
+    start = time.perf_counter()
+    predictor = create()
+    load_time = time.perf_counter() - start
+
+    try:
+        predictor.predict(input_data)  # warm-up
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            predictor.predict(input_data)
+        latency = (time.perf_counter() - start) / repeat
+
+        return {'load_time': load_time,
+                'memory': process.memory_info().rss - memory,
+                'latency': latency}
+    finally:
+        predictor.close()
@@ -0,0 +1,163 @@
+import errno
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from os import mkdir, replace
+from os.path import dirname, isfile
+
+
+class ResponseCache:
+    """
+    LRU cache with optional TTL for prediction results, keyed by the token indexes of an input.
+    Entries are bound to a checkpoint identity so that new weights never serve stale responses.
+    """
+
+    def __init__(self, max_size=1024, ttl=None, path=None, identity=None):
+        """
+        :param max_size: maximum number of responses to keep before evicting the least recently used one
+        :param ttl: number of seconds an entry stays valid (None for no expiry)
+        :param path: file used to persist the cache (Optional)
+        :param identity: identity of the checkpoint the cached responses were produced by
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.identity = identity
+
+        self.entries = OrderedDict()  # key: (value, timestamp)
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.predict_time = 0.0  # total time spent predicting misses
+        self.latency_saved = 0.0
+
+        if self.path is not None and isfile(self.path):
+            self.load()
+
+    @staticmethod
+    def make_key(indexes):
+        # numpy arrays and lists are not hashable
+        return tuple(int(i) for i in indexes)
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            value, timestamp = self.entries[key]
+
+            if self.ttl is not None and time.time() - timestamp > self.ttl:
+                # expired
+                del self.entries[key]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.latency_saved += self.average_predict_time()
+
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.time())
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self.lock:
+            if key in self.entries:
+                return self.entries.pop(key)[0]
+            return None
+
+    def record_predict_time(self, seconds):
+        # total time spent predicting the missed inputs, used to estimate the latency saved by every hit
+        with self.lock:
+            self.predict_time += seconds
+
+    def average_predict_time(self):
+        if self.misses == 0:
+            return 0.0
+        return self.predict_time / self.misses
+
+    def set_identity(self, identity):
+        """
+        Bind the cache to a checkpoint. Changing the identity invalidates all stored responses.
+        """
+        if identity != self.identity:
+            self.clear()
+            self.identity = identity
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'identity': self.identity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total > 0 else 0.0,
+            'latency_saved': self.latency_saved
+        }
+
+    def save(self, path=None):
+        """
+        Persist the cache to a file. The file is written to a temporary location first and then renamed.
+
+        :param path: path of the file (defaults to the path given on creation)
+        :return: path of the file
+        """
+        if path is None:
+            path = self.path
+        if path is None:
+            raise ValueError("Path must be provided when saving for the first time")
+
+        directory = dirname(path)
+        if directory:
+            try:
+                # create directory if it does not already exist
+                mkdir(directory)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise exc
+
+        with self.lock:
+            stored = {'identity': self.identity, 'entries': list(self.entries.items())}
+
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(stored, f, pickle.HIGHEST_PROTOCOL)
+        replace(path + '.tmp', path)
+
+        self.path = path
+
+        return path
+
+    def load(self, path=None):
+        if path is None:
+            path = self.path
+
+        with open(path, 'rb') as f:
+            stored = pickle.load(f)
+
+        # responses of another checkpoint are useless
+        if self.identity is not None and stored['identity'] != self.identity:
+            return
+
+        with self.lock:
+            self.identity = stored['identity']
+            self.entries = OrderedDict(stored['entries'])
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
@@ -1,6 +1,7 @@
 import asyncio
 import json
 import struct
+import types
 
 
 class SocketServer:
@@ -65,12 +66,29 @@ class SocketServer:
             submitted = self.console.thread_pool.submit(
                 self.console.handle_network, request_id, command, arguments)
             request_id, status, message, data = submitted.result()
+
+            if isinstance(data, types.GeneratorType):
+                # streamed results are sent as they are generated, followed by an empty success response
+                await self.stream_responses(writer, request_id, data)
+                continue
+
             print(request_id, status, message, data)
             response = SocketServer.create_response(request_id, status, message, data)
             await SocketServer.await_write(writer, response)
 
         writer.close()
 
+    async def stream_responses(self, writer, request_id, generator):
+        try:
+            for item in generator:
+                response = SocketServer.create_response(request_id, 0, 'partial', {'result': item})
+                await SocketServer.await_write(writer, response)
+        except Exception as exc:
+            response = SocketServer.create_response(request_id, 2, str(exc), {})
+        else:
+            response = SocketServer.create_response(request_id, 0, 'success', {})
+        await SocketServer.await_write(writer, response)
+
     async def main(self):
         self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
         await self.server.serve_forever()
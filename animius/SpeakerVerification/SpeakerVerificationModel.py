@@ -1,3 +1,6 @@
+import time
+
+import numpy as np
 import tensorflow as tf
 
 import animius as am
@@ -11,7 +14,11 @@ class SpeakerVerificationModel(am.Model):
         return {
             'learning_rate': 0.0001,
             'batch_size': 256,
-            'optimizer': 'adam'
+            'optimizer': 'adam',
+            'steps_per_run': 8,  # training steps per session call, see Model.build_train_loop
+            'accumulate_steps': 1,  # batches whose gradients are summed per optimizer step, see Model.minimize
+            'num_parallel_calls': None,  # parallel parsing of the training pipeline (None to let tf.data tune it)
+            'prefetch': None  # batches prefetched by the training pipeline (None to let tf.data tune it)
         }
 
     @staticmethod
@@ -23,7 +30,9 @@ class SpeakerVerificationModel(am.Model):
             'num_filter_2': 32,
             'fully_connected_1': 256,
             'input_window': 20,
-            'input_cepstral': 18
+            'input_cepstral': 18,
+            'fully_connected_1_rank': 0,  # rank of the factorized fully connected layer (0 for a full matrix)
+            'gradient_clip': None  # global norm the gradients are clipped to (None to not clip)
         }
 
     def __init__(self):
@@ -35,12 +44,18 @@ class SpeakerVerificationModel(am.Model):
         self.prediction = None
         self.train_op = None
         self.cost = None
+        self.train_cost = None  # mean cost of the batches of train_op, see Model.minimize
         self.tb_merged = None
 
         self.data_count = None
         self.iterator = None
         self.predict_dataset = None
         self.predict_iterator = None
+        self.predict_x = None
+
+        # weights of the fully connected layer, see Utils.factorize
+        self.dense_kernel = None
+        self.dense_factors = None
 
     def init_dataset(self, data=None):
 
@@ -50,19 +65,22 @@ class SpeakerVerificationModel(am.Model):
 
         index_ds = tf.data.Dataset.from_tensor_slices(tf.expand_dims(tf.range(self.data_count), -1))
 
-        ds = index_ds.apply(tf.data.experimental.shuffle_and_repeat(buffer_size=self.data.steps_per_epoch))
+        ds = self.shuffle_train_indexes(index_ds, self.data.steps_per_epoch)
 
         def _py_func(x):
             return tf.py_func(self.data.parse, [x, False], [tf.float32, tf.float32])
 
-        ds = ds.map(_py_func, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        ds = ds.map(_py_func, num_parallel_calls=self.pipeline_setting('num_parallel_calls'))
 
         ds = ds.apply(tf.data.experimental.unbatch())  # testing needed
 
+        # resume position, every file gives several windows so they can only be skipped after parsing
+        ds = ds.skip(self.train_skip)
+
         ds = ds.batch(batch_size=self.hyperparameters['batch_size'])
 
         ds = ds.apply(tf.data.experimental.prefetch_to_device(self.config['device'],
-                                                              buffer_size=tf.data.experimental.AUTOTUNE))
+                                                              buffer_size=self.pipeline_setting('prefetch')))
 
         self.dataset = ds
 
@@ -112,10 +130,20 @@ class SpeakerVerificationModel(am.Model):
                     self.init_predict_dataset()
                 self.predict_iterator = self.predict_dataset.make_initializable_iterator()
 
+                # windows and their labels
+                eval_batch = self.init_eval_dataset(
+                    [tf.float32, tf.float32],
+                    [[None, self.model_structure['input_window'], self.model_structure['input_cepstral']], [None]])
+
             with graph.device(self.config['device']):
 
                 self.x, self.y = self.iterator.get_next()
 
+                fc1_input = self.model_structure['input_window'] * \
+                    self.model_structure['input_cepstral'] * \
+                    self.model_structure['num_filter_2']
+                fc1_rank = self.model_structure.get('fully_connected_1_rank', 0)
+
                 # Network parameters
                 weights = {
                     # 3x3 conv filter, 1 input layers, 10 output layers
@@ -130,15 +158,21 @@ class SpeakerVerificationModel(am.Model):
                                                          self.model_structure['num_filter_1'],
                                                          self.model_structure['num_filter_2']]
                                                         )),
-                    # fully connected 1, 15 input layers, 128 outpute nodes
-                    'wd1': tf.Variable(tf.random_normal([self.model_structure['input_window'] *
-                                                         self.model_structure['input_cepstral'] *
-                                                         self.model_structure['num_filter_2'],
-                                                         self.model_structure['fully_connected_1']]
-                                                        )),
-                    # output, 128 input nodes, 1 output node
-                    'out': tf.Variable(tf.random_normal([self.model_structure['fully_connected_1'], 1]))
                 }
+                if fc1_rank > 0:
+                    # fully connected 1 as the product of two low rank matrices
+                    weights['wd1_u'] = tf.Variable(tf.random_normal([fc1_input, fc1_rank]), name='wd1_u')
+                    weights['wd1_v'] = tf.Variable(tf.random_normal([fc1_rank,
+                                                                     self.model_structure['fully_connected_1']]),
+                                                   name='wd1_v')
+                    self.dense_factors = (weights['wd1_u'], weights['wd1_v'])
+                else:
+                    # fully connected 1, 15 input layers, 128 outpute nodes
+                    weights['wd1'] = tf.Variable(tf.random_normal([fc1_input,
+                                                                   self.model_structure['fully_connected_1']]))
+                    self.dense_kernel = weights['wd1']
+                # output, 128 input nodes, 1 output node
+                weights['out'] = tf.Variable(tf.random_normal([self.model_structure['fully_connected_1'], 1]))
 
                 biases = {
                     'bc1': tf.Variable(tf.random_normal([self.model_structure['num_filter_1']])),
@@ -157,7 +191,10 @@ class SpeakerVerificationModel(am.Model):
                     conv2 = tf.nn.conv2d(conv1, weights["wc2"], strides=[1, 1, 1, 1], padding='SAME')
 
                     conv2 = tf.reshape(conv2, [tf.shape(x)[0], -1])  # maintain batch size
-                    fc1 = tf.add(tf.matmul(conv2, weights["wd1"]), biases["bd1"])
+                    if fc1_rank > 0:
+                        fc1 = tf.add(tf.matmul(tf.matmul(conv2, weights["wd1_u"]), weights["wd1_v"]), biases["bd1"])
+                    else:
+                        fc1 = tf.add(tf.matmul(conv2, weights["wd1"]), biases["bd1"])
                     fc1 = tf.nn.relu(fc1)
 
                     out = tf.add(tf.matmul(fc1, weights['out']), biases['out'], name='output_predict')
@@ -165,12 +202,39 @@ class SpeakerVerificationModel(am.Model):
                     return out
 
                 # Optimization
-                self.prediction = tf.math.sigmoid(network(self.predict_iterator.get_next()))
+                # named input that can be fed directly when serving a frozen graph (see Predictor)
+                self.predict_x = tf.placeholder_with_default(self.predict_iterator.get_next(),
+                                                             [None,
+                                                              self.model_structure['input_window'],
+                                                              self.model_structure['input_cepstral']],
+                                                             name='input_x')
+                self.prediction = tf.math.sigmoid(network(self.predict_x))
                 self.cost = tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(logits=network(self.x),
                                                                                    labels=self.y),
                                            name='train_cost')
-                self.train_op = tf.train.AdamOptimizer(learning_rate=self.hyperparameters['learning_rate']).minimize(
-                    self.cost, name='train_op')
+                optimizer = tf.train.AdamOptimizer(learning_rate=self.hyperparameters['learning_rate'])
+
+                def next_cost():
+                    x, y = self.iterator.get_next()
+                    return tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(logits=network(x), labels=y))
+
+                self.train_cost, self.train_op = self.minimize(optimizer, self.cost, next_cost,
+                                                               clip_norm=self.model_structure.get('gradient_clip'),
+                                                               name='train_op')
+
+                def train_step():
+                    return self.minimize(optimizer, next_cost(), next_cost,
+                                         clip_norm=self.model_structure.get('gradient_clip'))
+
+                self.build_train_loop(train_step)
+
+                # Evaluation on the validation examples
+                eval_x, eval_y = eval_batch
+                # [batch size, 1] logits against [batch size] labels
+                eval_logits = tf.reshape(network(eval_x), [-1])
+                self.eval_cost = tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(logits=eval_logits,
+                                                                                        labels=eval_y))
+                self.eval_accuracy = tf.reduce_mean(tf.cast(tf.equal(eval_logits > 0, eval_y > 0.5), tf.float32))
 
                 # Tensorboard
                 if self.config['tensorboard'] is not None:
@@ -181,15 +245,25 @@ class SpeakerVerificationModel(am.Model):
         self.graph = graph
         return graph
 
+    def warm_up_batches(self, batch_size):
+        x = np.zeros([batch_size, self.model_structure['input_window'], self.model_structure['input_cepstral']],
+                     np.float32)
+        return [(self.prediction, {self.predict_x: x})]
+
+    def train_data_count(self):
+        return len(self.data['train_y'])
+
     def train(self, epochs=800, cancellation_token=None):
 
         print('starting training')
 
         with self.graph.device('/cpu:0'):
-            self.sess.run(self.iterator.initializer, feed_dict={self.data_count: len(self.data['train_y'])})
+            self.init_train_iterator()
 
         print('initialized iterator')
 
+        self.start_training()
+
         epoch = 0
         total_epoch = self.config['epoch'] + epochs
 
@@ -200,17 +274,23 @@ class SpeakerVerificationModel(am.Model):
             if cancellation_token is not None and cancellation_token.is_cancalled:
                 return  # early stopping
 
-            batch_num = 0
+            batch_num = self.config.get('epoch_step', 0)  # resume a cancelled epoch
 
             try:
 
-                while batch_num < self.data.steps_per_epoch:
+                while batch_num < self.train_steps_per_epoch():
+
+                    # the cost is displayed every 100 batches
+                    steps = min(100 - batch_num % 100, self.train_steps_per_epoch() - batch_num)
 
                     if (self.config['display_step'] == 0 or
                         self.config['epoch'] % self.config['display_step'] == 0 or
-                        epoch == epochs) and \
-                            (batch_num % 100 == 0 or batch_num == 0):
-                        _, cost_value = self.sess.run([self.train_op, self.cost])
+                        epoch == epochs):
+
+                        done, cost_value = self.run_train_steps(steps, fetch_cost=True,
+                                                                cancellation_token=cancellation_token)
+                        if done == 0:
+                            return  # cancelled, training resumes from the position kept in config
 
                         print("epoch:", self.config['epoch'], "- (", batch_num, ") -", cost_value)
 
@@ -220,9 +300,12 @@ class SpeakerVerificationModel(am.Model):
                             self.hyperdash.metric("cost", cost_value)
 
                     else:
-                        self.sess.run([self.train_op])
+                        done, _ = self.run_train_steps(steps, cancellation_token=cancellation_token)
+
+                    batch_num += done
 
-                    batch_num += 1
+                    if done < steps:
+                        return  # cancelled, training resumes from the position kept in config
 
             except tf.errors.OutOfRangeError:
                 # this should never happen
@@ -235,6 +318,7 @@ class SpeakerVerificationModel(am.Model):
                 self.tensorboard_writer.add_summary(summary, self.config['epoch'])
 
             self.config['epoch'] += 1
+            self.config['epoch_step'] = 0
 
     @classmethod
     def load(cls, directory, name='model', data=None):
@@ -246,14 +330,19 @@ class SpeakerVerificationModel(am.Model):
         else:
             model.data = am.SpeakerVerificationData()
 
+        start = time.perf_counter()
         model.build_graph(model.model_config(), model.data)
+        model.load_profile['build_graph'] = time.perf_counter() - start
 
         # model.sess = tf.Session(config=config, graph=graph)
+        start = time.perf_counter()
         model.init_tensorflow(init_param=False, init_sess=True)
+        model.load_profile['init_session'] = time.perf_counter() - start
 
         checkpoint = tf.train.get_checkpoint_state(directory)
         input_checkpoint = checkpoint.model_checkpoint_path
 
+        start = time.perf_counter()
         with model.graph.as_default():
             # model.init_dataset()
             # model.iterator = model.dataset.make_initializable_iterator()
@@ -264,6 +353,7 @@ class SpeakerVerificationModel(am.Model):
             # model.saver = tf.train.import_meta_graph(input_checkpoint + '.meta',
             #                                          input_map={'IteratorGetNext': tf.convert_to_tensor(model.iterator.get_next())})
             model.saver.restore(model.sess, input_checkpoint)
+        model.load_profile['restore'] = time.perf_counter() - start
 
         # set up self attributes used by other methods
         # model.data_count = model.sess.graph.get_tensor_by_name('ds_data_count:0')
@@ -273,6 +363,7 @@ class SpeakerVerificationModel(am.Model):
 
         # model.init_tensorflow(graph, init_param=False, init_sess=False)
 
+        model.set_checkpoint(input_checkpoint)
         model.saved_directory = directory
         model.saved_name = name
 
@@ -300,24 +391,18 @@ class SpeakerVerificationModel(am.Model):
         except tf.errors.OutOfRangeError:
             print(batch_num)
 
-        import numpy as np
         outputs = np.concatenate(outputs)
 
-        results = []
-        end_index = 0
-
         print(outputs.shape)
 
+        # average the windows of every file
+        window_counts = [self.data.predict_step_nums[index] for index in range(len(self.data.values['input']))]
+        means = am.Utils.window_means(outputs.reshape(-1), window_counts)
+
         if raw:
-            for index in range(len(self.data.values['input'])):
-                windows = outputs[end_index:end_index + self.data.predict_step_nums[index]]
-                end_index += self.data.predict_step_nums[index]
-                results.append(windows.mean())
+            results = means.tolist()
         else:
-            for index in range(len(self.data.values['input'])):
-                windows = outputs[end_index:end_index + self.data.predict_step_nums[index]]
-                end_index += self.data.predict_step_nums[index]
-                results.append(windows.mean() > 0.5)
+            results = (means > 0.5).tolist()
 
         if save_path is not None:
             with open(save_path, "w") as file:
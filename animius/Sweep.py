@@ -0,0 +1,288 @@
+import copy
+import csv
+import errno
+import itertools
+import json
+import multiprocessing
+import random
+import time
+from multiprocessing.connection import wait
+from os import mkdir, replace
+from os.path import isfile, join
+
+import numpy as np
+import psutil
+
+PARAMETER_GROUPS = ('hyperparameters', 'model_structure')
+
+
+def _trial(model_type, model_config, data, epochs, save_directory, connection):
+    # runs in a separate process, see Sweep
+    import animius as am
+
+    try:
+        data.set_model_config(model_config)
+        if hasattr(data, 'steps_per_epoch_cache'):
+            data.steps_per_epoch_cache = None  # depends on the batch size
+
+        model = am.Autotune.model_class(model_type)()
+        model.build_graph(model_config, data)
+        model.init_tensorflow()
+
+        for _ in range(epochs):
+            model.train(1)
+            connection.send(('epoch', float(model.config['cost'])))
+            if connection.recv() == 'stop':
+                break
+
+        if save_directory is not None:
+            model.save(save_directory)
+        model.close()
+
+        connection.send(('done', None))
+    except Exception as exc:
+        connection.send(('error', repr(exc)))
+    finally:
+        connection.close()
+
+
+class Sweep:
+    """
+    Train variants of a model config, one process per trial, as many at a time as the CPU and memory budgets
+    allow. Every trial reports its cost (config['cost']) after every epoch, and is stopped early if the cost is
+    worse than the median cost of the other trials at the same epoch, or has not improved for patience epochs.
+
+    The results are written to results.csv in the sweep directory after every trial, one row per trial.
+    Running a sweep again in the same directory skips the trials already in the table, except failed ones.
+    """
+
+    def __init__(self, model_type, model_config, data, search_space, directory, epochs, trials=None, seed=None,
+                 threads_per_trial=1, max_parallel=None, memory_limit=None, grace_epochs=1, patience=None,
+                 save_models=True):
+        """
+        :param model_type: type of model, 'Chatbot', 'IntentNER' or 'SpeakerVerification'
+        :param model_config: base model config of the trials
+        :param data: training data
+        :param search_space: dict of the values to try, e.g. {'hyperparameters': {'learning_rate': [0.001, 0.0001]},
+                                                              'model_structure': {'layer': [1, 2]}}
+        :param directory: directory of the results table and of the trained models
+        :param epochs: maximum number of epochs of every trial
+        :param trials: number of configurations sampled from the search space (None to try every combination)
+        :param seed: seed of the sampling (Optional)
+        :param threads_per_trial: number of intra op threads of every trial
+        :param max_parallel: maximum number of trials at a time (Optional, defaults to cores / threads_per_trial)
+        :param memory_limit: resident memory all running trials may use together, in bytes
+                             (Optional, defaults to 80% of the available memory)
+        :param grace_epochs: number of epochs before a trial may be stopped by the median rule
+        :param patience: stop a trial whose cost has not improved for this many epochs (Optional)
+        :param save_models: whether to save the model of every trial in the sweep directory
+        """
+        self.model_type = model_type
+        self.model_config = model_config
+        self.data = data
+        self.search_space = search_space
+        self.directory = directory
+        self.epochs = epochs
+        self.trials = trials
+        self.seed = seed
+        self.threads_per_trial = threads_per_trial
+        self.grace_epochs = grace_epochs
+        self.patience = patience
+        self.save_models = save_models
+
+        if max_parallel is None:
+            cores = psutil.cpu_count(logical=False) or psutil.cpu_count() or 1
+            max_parallel = max(1, cores // threads_per_trial)
+        self.max_parallel = max_parallel
+
+        if memory_limit is None:
+            memory_limit = int(psutil.virtual_memory().available * 0.8)
+        self.memory_limit = memory_limit
+
+        try:
+            # create directory if it does not already exist
+            mkdir(directory)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise exc
+
+        self.results_path = join(directory, 'results.csv')
+        self.results = Sweep.load_results(directory)
+        self.curves = {}  # cost of every epoch of every trial of this run
+
+    @staticmethod
+    def load_results(directory):
+        """
+        :param directory: directory of a sweep
+        :return: list of the rows of the results table, parameters are decoded from json
+        """
+        path = join(directory, 'results.csv')
+        if not isfile(path):
+            return []
+
+        with open(path, 'r', newline='') as f:
+            rows = list(csv.DictReader(f))
+
+        for row in rows:
+            for key, value in row.items():
+                if key == 'status' or key == 'directory':
+                    continue
+                row[key] = json.loads(value) if value else None
+
+        return rows
+
+    def configurations(self):
+        """
+        :return: list of the parameters of every trial, as {'group.key': value}
+        """
+        keys = ['{0}.{1}'.format(group, key)
+                for group in PARAMETER_GROUPS
+                for key in sorted(self.search_space.get(group, {}))]
+        values = [self.search_space[key.split('.', 1)[0]][key.split('.', 1)[1]] for key in keys]
+
+        combinations = [dict(zip(keys, combination)) for combination in itertools.product(*values)]
+
+        if self.trials is not None and self.trials < len(combinations):
+            combinations = random.Random(self.seed).sample(combinations, self.trials)
+
+        return combinations
+
+    def trial_config(self, parameters):
+        model_config = copy.deepcopy(self.model_config)
+        for key, value in parameters.items():
+            group, name = key.split('.', 1)
+            getattr(model_config, group)[name] = value
+
+        # the trials share the cores instead of all using every one of them
+        model_config.config['intra_op_threads'] = self.threads_per_trial
+        model_config.config['inter_op_threads'] = 1
+        model_config.config['display_step'] = 1  # the cost of every epoch is recorded
+
+        return model_config
+
+    def should_stop(self, trial):
+        costs = self.curves[trial]
+        epoch = len(costs)
+
+        if self.patience is not None and epoch > self.patience and \
+                min(costs[-self.patience:]) >= min(costs[:-self.patience]):
+            return True
+
+        if epoch >= self.grace_epochs:
+            others = [curve[epoch - 1] for other, curve in self.curves.items()
+                      if other != trial and len(curve) >= epoch]
+            if len(others) >= 2 and costs[-1] > np.median(others):
+                return True
+
+        return False
+
+    def write_results(self):
+        keys = sorted({key for row in self.results for key in row})
+        columns = ['trial', 'status', 'epochs', 'best_cost', 'final_cost', 'seconds', 'peak_memory', 'directory']
+        columns += [key for key in keys if key not in columns]
+
+        with open(self.results_path + '.tmp', 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            for row in self.results:
+                writer.writerow({key: value if key in ('status', 'directory') else json.dumps(value)
+                                 for key, value in row.items()})
+        replace(self.results_path + '.tmp', self.results_path)
+
+    def run(self, cancellation_token=None):
+        """
+        Run the trials not yet in the results table or that failed. A new trial starts when fewer than
+        max_parallel trials are running and the memory they use, plus the peak memory of the trials seen so far,
+        fits within memory_limit. Until a trial has reported its memory, trials run one at a time.
+
+        :param cancellation_token: checked between trial updates, running trials are terminated (Optional)
+        :return: the results table, sorted by best cost
+        """
+        first_trial = max([row['trial'] for row in self.results], default=-1) + 1
+        # failed trials are tried again, under a new trial number
+        self.results = [row for row in self.results if row['status'] != 'failed']
+        done = [{key: row[key] for key in row if '.' in key} for row in self.results]
+        pending = list(enumerate([parameters for parameters in self.configurations() if parameters not in done],
+                                 first_trial))
+
+        # tensorflow is not fork safe
+        context = multiprocessing.get_context('spawn')
+        running = {}
+        peak_memory = None
+
+        try:
+            while pending or running:
+
+                if cancellation_token is not None and cancellation_token.is_cancalled:
+                    break
+
+                used = sum(state['memory'] for state in running.values())
+                while pending and len(running) < self.max_parallel and \
+                        (not running or (peak_memory is not None and used + peak_memory <= self.memory_limit)):
+                    trial, parameters = pending.pop(0)
+                    save_directory = join(self.directory, 'trial-{0}'.format(trial)) if self.save_models else None
+
+                    parent, child = context.Pipe()
+                    process = context.Process(target=_trial,
+                                              args=(self.model_type, self.trial_config(parameters), self.data,
+                                                    self.epochs, save_directory, child))
+                    process.start()
+                    child.close()
+
+                    running[parent] = {'trial': trial, 'parameters': parameters, 'process': process,
+                                       'directory': save_directory, 'start': time.time(), 'memory': 0, 'peak': 0,
+                                       'stopped': False}
+                    self.curves[trial] = []
+                    used += peak_memory or 0
+
+                for connection in wait(list(running), timeout=0.1):
+                    state = running[connection]
+                    try:
+                        message, value = connection.recv()
+                    except EOFError:
+                        # the process died without reporting, e.g. killed for running out of memory
+                        message, value = 'error', 'trial process exited with code {0}'.format(
+                            state['process'].exitcode)
+
+                    if message == 'epoch':
+                        self.curves[state['trial']].append(value)
+                        peak_memory = max(peak_memory or 0, state['peak'])
+                        state['stopped'] = self.should_stop(state['trial'])
+                        connection.send('stop' if state['stopped'] else 'continue')
+                        continue
+
+                    running.pop(connection)
+                    state['process'].join()
+                    if message == 'error':
+                        print('Trial {0} failed: {1}'.format(state['trial'], value))
+                    self.add_result(state, 'failed' if message == 'error' else
+                                    'stopped' if state['stopped'] else 'completed')
+
+                for state in running.values():
+                    try:
+                        state['memory'] = psutil.Process(state['process'].pid).memory_info().rss
+                    except psutil.NoSuchProcess:
+                        state['memory'] = 0
+                    state['peak'] = max(state['peak'], state['memory'])
+        finally:
+            for connection, state in running.items():
+                state['process'].terminate()
+                state['process'].join()
+                connection.close()
+
+        return sorted(self.results, key=lambda row: float('inf') if row['best_cost'] is None else row['best_cost'])
+
+    def add_result(self, state, status):
+        costs = self.curves[state['trial']]
+        row = {'trial': state['trial'],
+               'status': status,
+               'epochs': len(costs),
+               'best_cost': min(costs) if costs else None,
+               'final_cost': costs[-1] if costs else None,
+               'seconds': time.time() - state['start'],
+               'peak_memory': state['peak'],
+               'directory': state['directory'] if status != 'failed' else None}
+        row.update(state['parameters'])
+
+        self.results.append(row)
+        self.write_results()
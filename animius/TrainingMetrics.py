@@ -0,0 +1,183 @@
+import json
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import psutil
+import tensorflow as tf
+
+
+class JSONLinesSink:
+    """
+    Append every report to a file, one json object per line
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a')
+
+    def write(self, metrics):
+        self.file.write(json.dumps(metrics) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class TensorBoardSink:
+    """
+    Write every numeric metric of a report as a scalar summary
+    """
+
+    def __init__(self, writer):
+        """
+        :param writer: tf.summary.FileWriter, or a log directory
+        """
+        if isinstance(writer, str):
+            writer = tf.summary.FileWriter(writer)
+        self.writer = writer
+
+    def write(self, metrics):
+        values = [tf.Summary.Value(tag='training/' + key, simple_value=value)
+                  for key, value in metrics.items()
+                  if isinstance(value, (int, float)) and key != 'global_step']
+        self.writer.add_summary(tf.Summary(value=values), metrics['global_step'])
+        self.writer.flush()
+
+    def close(self):
+        pass
+
+
+class TrainingMetrics:
+    """
+    Throughput and input stall statistics of training, recorded by Model.run_train_steps after every session call.
+    Every report_every steps a report is sent to the sinks (see JSONLinesSink and TensorBoardSink), the latest
+    report is kept in latest.
+
+    Time spent waiting for the input pipeline is read from a traced session call every trace_every calls,
+    as the time of the IteratorGetNext ops.
+    """
+
+    def __init__(self, sinks=None, report_every=100, trace_every=100, window=1000):
+        """
+        :param sinks: list of sinks (Optional)
+        :param report_every: number of steps between reports
+        :param trace_every: number of session calls between traced calls (None to never trace)
+        :param window: number of recent session calls the statistics are computed over
+        """
+        self.sinks = list(sinks) if sinks is not None else []
+        self.report_every = report_every
+        self.trace_every = trace_every
+
+        self.calls = deque(maxlen=window)  # (steps, examples, seconds)
+        self.input_waits = deque(maxlen=max(1, window // trace_every) if trace_every else 1)  # fraction of time
+
+        self.call_count = 0
+        self.steps_since_report = 0
+        self.latest = None
+        self.data = None
+        self.lock = threading.Lock()
+
+        self.process = psutil.Process()
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def replace_sink(self, sink):
+        # closes the sinks of the same type, e.g. the file of a previous training run
+        for old_sink in [old_sink for old_sink in self.sinks if type(old_sink) is type(sink)]:
+            old_sink.close()
+            self.sinks.remove(old_sink)
+        self.sinks.append(sink)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+        self.sinks = []
+
+    def run_kwargs(self):
+        """
+        Keyword arguments of the next training session call, tracing it when due
+        """
+        if self.trace_every and self.call_count % self.trace_every == 0:
+            return {'options': tf.RunOptions(trace_level=tf.RunOptions.SOFTWARE_TRACE),
+                    'run_metadata': tf.RunMetadata()}
+        return {}
+
+    @staticmethod
+    def _input_wait(run_metadata):
+        wait = 0
+        for device in run_metadata.step_stats.dev_stats:
+            for node in device.node_stats:
+                if 'IteratorGetNext' in node.node_name:
+                    wait += node.all_end_rel_micros
+        return wait / 1e6
+
+    def record(self, model, steps, seconds, run_kwargs):
+        """
+        Record a training session call
+
+        :param model: model being trained
+        :param steps: number of steps of the call
+        :param seconds: duration of the call
+        :param run_kwargs: keyword arguments the call was made with, see run_kwargs
+        """
+        with self.lock:
+            self.data = model.data
+            self.calls.append((steps, steps * model.examples_per_step(), seconds))
+            if 'run_metadata' in run_kwargs:
+                self.input_waits.append(min(1.0, self._input_wait(run_kwargs['run_metadata']) / seconds))
+            self.call_count += 1
+            self.steps_since_report += steps
+
+            report = self.steps_since_report >= self.report_every
+
+        if report:
+            self.report(model.config.get('global_step', 0), model.config['epoch'])
+
+    def summary(self):
+        """
+        :return: statistics of the recent session calls
+        """
+        with self.lock:
+            calls = list(self.calls)
+            input_waits = list(self.input_waits)
+
+        if not calls:
+            return {}
+
+        steps, examples, seconds = (np.array(values, np.float64) for values in zip(*calls))
+        step_times = seconds / steps
+
+        metrics = {
+            'examples_per_second': float(examples.sum() / seconds.sum()),
+            'steps_per_second': float(steps.sum() / seconds.sum()),
+            'step_time_p50': float(np.percentile(step_times, 50)),
+            'step_time_p90': float(np.percentile(step_times, 90)),
+            'step_time_p99': float(np.percentile(step_times, 99)),
+            'input_wait_fraction': float(np.mean(input_waits)) if input_waits else None,
+            'rss': self.process.memory_info().rss
+        }
+
+        if self.data is not None:
+            metrics.update(self.data.parse_stats())
+
+        return metrics
+
+    def report(self, global_step, epoch):
+        metrics = self.summary()
+        metrics.update({'time': time.time(), 'global_step': global_step, 'epoch': epoch})
+
+        with self.lock:
+            self.steps_since_report = 0
+            self.latest = metrics
+
+        self.write(metrics)
+
+        return metrics
+
+    def write(self, metrics):
+        # also used for the validation metrics, see Evaluator
+        for sink in self.sinks:
+            sink.write(metrics)
@@ -1,4 +1,10 @@
 import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections.abc import Sequence
 from os.path import join
 
 import numpy as np
@@ -6,7 +12,6 @@ import psutil
 import pynvml
 import tensorflow as tf
 from tensorflow.python.tools import freeze_graph as tf_freeze_graph
-from tensorflow.python.tools import optimize_for_inference_lib
 
 
 def get_system_info():
@@ -139,6 +144,57 @@ def set_sequence_length(sequence, pad, max_seq=20, force_eos=False):
     return sequence
 
 
+class LazySentences(Sequence):
+    """
+    Sentences decoded from word indexes with numpy. Words are looked up for the whole batch at once,
+    while strings are only joined when a sentence is accessed (or all at once with tolist).
+    """
+
+    def __init__(self, indexes, words_array, skip_indexes):
+        """
+        :param indexes: array of word indexes [batch, sequence]
+        :param words_array: numpy (object) array of words (see WordEmbedding.words_array)
+        :param skip_indexes: indexes to leave out of the sentences, such as <GO> and <EOS>
+        """
+        self.indexes = indexes
+        self.words = np.take(words_array, indexes)
+        self.mask = ~np.isin(indexes, skip_indexes)
+        self.sentences = {}
+
+    def __len__(self):
+        return self.words.shape[0]
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+
+        if item < 0:
+            item += len(self)
+
+        if item not in self.sentences:
+            self.sentences[item] = ' '.join(self.words[item][self.mask[item]])
+
+        return self.sentences[item]
+
+    def tolist(self):
+        # concatenating object arrays along the sequence joins the strings of every sentence at once
+        spaced = np.where(self.mask, self.words + ' ', '')
+        return [sentence[:-1] for sentence in np.add.reduce(spaced, axis=1, initial='')]
+
+
+def window_means(outputs, window_counts):
+    """
+    Average consecutive windows of predictions
+
+    :param outputs: array of predictions of all windows [windows, ...]
+    :param window_counts: number of windows belonging to each item
+    :return: array of means [items, ...]
+    """
+    window_counts = np.asarray(window_counts)
+    offsets = np.concatenate([[0], np.cumsum(window_counts)[:-1]])
+    return np.add.reduceat(outputs, offsets, axis=0) / window_counts.reshape((-1,) + (1,) * (outputs.ndim - 1))
+
+
 # pass model_dir and model_name if model is not loaded
 def freeze_graph(model, output_node_names, model_dir=None, model_name=None):
     stored = None
@@ -186,13 +242,103 @@ def freeze_graph(model, output_node_names, model_dir=None, model_name=None):
     return output_graph  # output graph path
 
 
-# WARNING: optimizing models seem to produce an invalid graph. Don't use it.
-# See: https://github.com/tensorflow/tensorflow/issues/19838
-def optimize(model, input_node_names, output_node_names, model_dir=None, model_name=None):
-    import warnings
+def load_graph_def(graph_path):
+    graph_def = tf.GraphDef()
+    with tf.gfile.Open(graph_path, "rb") as f:
+        graph_def.ParseFromString(f.read())
+    return graph_def
+
+
+def strip_input_pipeline(graph_def, input_node_names, output_node_names):
+    """
+    Turn the named inputs of a frozen graph into plain placeholders and drop every node that the outputs no longer
+    depend on, which removes the dataset and iterator ops used when the model was trained.
+
+    :param graph_def: frozen GraphDef
+    :param input_node_names: list of PlaceholderWithDefault nodes to replace
+    :param output_node_names: list of output nodes
+    :return: a new GraphDef
+    """
+    stripped = tf.GraphDef()
+    stripped.versions.CopyFrom(graph_def.versions)
+
+    for node in graph_def.node:
+        if node.name in input_node_names and node.op == 'PlaceholderWithDefault':
+            placeholder = stripped.node.add()
+            placeholder.op = 'Placeholder'
+            placeholder.name = node.name
+            placeholder.attr['dtype'].CopyFrom(node.attr['dtype'])
+            placeholder.attr['shape'].CopyFrom(node.attr['shape'])
+        else:
+            stripped.node.extend([node])
+
+    return tf.graph_util.extract_sub_graph(stripped, output_node_names)
+
+
+def remove_identity_nodes(graph_def, protected_node_names):
+    """
+    Bypass Identity nodes outside of control flow. Identity nodes inside while loops (e.g. seq2seq decoding) carry
+    control dependencies and frame information, removing them is what made optimize_for_inference produce
+    invalid graphs.
+
+    :param graph_def: GraphDef to process
+    :param protected_node_names: nodes that must be kept (inputs and outputs)
+    :return: a new GraphDef
+    """
+    control_flow_ops = {'Enter', 'Exit', 'Merge', 'Switch', 'NextIteration', 'LoopCond'}
+    # control flow frames, every node inside them is left untouched
+    frames = tuple({node.name.rsplit('/', 1)[0] + '/' for node in graph_def.node if node.op in control_flow_ops})
+
+    def removable(node):
+        return node.op == 'Identity' \
+               and node.name not in protected_node_names \
+               and len(node.input) == 1 \
+               and not node.input[0].startswith('^') \
+               and not node.name.startswith(frames)
+
+    # map every removed node to the tensor it forwards
+    forwarded = {node.name: node.input[0] for node in graph_def.node if removable(node)}
+
+    def resolve(name):
+        if name.startswith('^'):
+            node_name = name[1:]
+            while node_name in forwarded:
+                node_name = forwarded[node_name].split(':')[0]
+            return '^' + node_name
+
+        node_name, _, port = name.partition(':')
+        if node_name in forwarded and port in ('', '0'):
+            return resolve(forwarded[node_name])
+        return name
+
+    output = tf.GraphDef()
+    output.versions.CopyFrom(graph_def.versions)
+    for node in graph_def.node:
+        if node.name in forwarded:
+            continue
+        new_node = output.node.add()
+        new_node.CopyFrom(node)
+        del new_node.input[:]
+        new_node.input.extend([resolve(name) for name in node.input])
+
+    return output
+
 
-    warnings.warn('WARNING: Optimizing models seem to produce an invalid graph and should not be used. '
-                  'If you wish to undo this, simply remove the \'optimized_graph\' line in the config file')
+def optimize(model, input_node_names, output_node_names, model_dir=None, model_name=None):
+    """
+    Create an inference graph from the frozen graph of a model (which is frozen first if needed).
+    The dataset and iterator nodes are replaced by placeholders, nodes not needed by the outputs (including training
+    nodes) are dropped, identity nodes are bypassed, then constants are folded and the graph is fused and sorted
+    with TensorFlow's graph transforms.
+
+    :param model: model to optimize, or None to use model_dir and model_name
+    :param input_node_names: list of input nodes, see Predictor.INPUTS
+    :param output_node_names: list of output nodes, see Predictor.OUTPUTS
+    :param model_dir: directory of the saved model (only used if model is None)
+    :param model_name: name of the saved model (only used if model is None)
+    :return: path to the optimized graph
+    """
+    from tensorflow.tools.graph_transforms import TransformGraph
 
     stored = None
 
@@ -214,16 +360,19 @@ def optimize(model, input_node_names, output_node_names, model_dir=None, model_n
             frozen_graph = freeze_graph(None, ', '.join(output_node_names), model_dir=model_dir, model_name=model_name)
             config['frozen_graph'] = frozen_graph
 
-    inputGraph = tf.GraphDef()
-    with tf.gfile.Open(frozen_graph, "rb") as f:
-        data2read = f.read()
-        inputGraph.ParseFromString(data2read)
+    graph_def = load_graph_def(frozen_graph)
+    graph_def = strip_input_pipeline(graph_def, input_node_names, output_node_names)
+    graph_def = remove_identity_nodes(graph_def, input_node_names + output_node_names)
 
-    output_graph = optimize_for_inference_lib.optimize_for_inference(
-        inputGraph,
-        input_node_names,  # an array of the input node(s)
-        output_node_names,  # an array of output nodes
-        tf.int32.as_datatype_enum)
+    output_graph = TransformGraph(graph_def,
+                                  input_node_names,
+                                  output_node_names,
+                                  ['fold_constants(ignore_errors=true)',
+                                   'fold_batch_norms',
+                                   'fold_old_batch_norms',
+                                   'merge_duplicate_nodes',
+                                   'strip_unused_nodes',
+                                   'sort_by_execution_order'])
 
     # Save the optimized graph
     tf.train.write_graph(output_graph, model_dir, 'optimized_graph.pb', as_text=False)
@@ -242,3 +391,448 @@ def optimize(model, input_node_names, output_node_names, model_dir=None, model_n
             json.dump(stored, f, indent=4)
 
     return join(model_dir, 'optimized_graph.pb')  # output graph path
+
+
+def _log_requantization_ranges(graph_def, input_node_names, output_node_names, calibration_feeds, batch_size=128):
+    """
+    Run a quantized graph on calibration data and record the ranges of its requantization ops.
+    TensorFlow prints the ranges to stderr, so it is redirected to a log file while running.
+
+    :return: path to the log file
+    """
+    from tensorflow.tools.graph_transforms import TransformGraph
+
+    logged = TransformGraph(graph_def, input_node_names, output_node_names,
+                            ['insert_logging(op=RequantizationRange, show_name=true, message="__requant_min_max:")'])
+
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(logged, name='')
+    inputs = [graph.get_tensor_by_name(name + ':0') for name in input_node_names]
+    outputs = [graph.get_tensor_by_name(name + ':0') for name in output_node_names]
+
+    log_file, log_path = tempfile.mkstemp(suffix='.log')
+    stderr = os.dup(2)
+    sys.stderr.flush()
+    os.dup2(log_file, 2)
+
+    try:
+        with tf.Session(graph=graph) as sess:
+            for start in range(0, len(calibration_feeds[0]), batch_size):
+                sess.run(outputs, feed_dict={tensor: feed[start:start + batch_size]
+                                             for tensor, feed in zip(inputs, calibration_feeds)})
+    finally:
+        sys.stderr.flush()
+        os.dup2(stderr, 2)
+        os.close(stderr)
+        os.close(log_file)
+
+    return log_path
+
+
+def quantize(model, input_node_names, output_node_names, calibration_feeds=None, mode='weights',
+             model_dir=None, model_name=None):
+    """
+    Quantize the inference graph of a model to 8 bits. The optimized graph is used if there is one, otherwise the
+    frozen graph (which is created first if needed).
+
+    'weights' stores the float weights (GRU kernels, projection and dense layers) as 8 bit values that are
+    converted back when the graph is loaded, shrinking the file about four times without changing the computation.
+    'eightbit' additionally replaces matmuls and convolutions by their quantized versions. Their activation ranges
+    are calibrated on calibration_feeds when given, otherwise they are computed at every run.
+
+    :param model: model to quantize, or None to use model_dir and model_name
+    :param input_node_names: list of input nodes, see Predictor.INPUTS
+    :param output_node_names: list of output nodes, see Predictor.OUTPUTS
+    :param calibration_feeds: list of input arrays used for calibration, see Predictor.sample_feeds (Optional)
+    :param mode: 'weights' or 'eightbit'
+    :param model_dir: directory of the saved model (only used if model is None)
+    :param model_name: name of the saved model (only used if model is None)
+    :return: path to the quantized graph
+    """
+    from tensorflow.tools.graph_transforms import TransformGraph
+
+    if mode not in ('weights', 'eightbit'):
+        raise ValueError('Quantization mode must be either \'weights\' or \'eightbit\'')
+
+    stored = None
+
+    if model is not None:
+        config = model.config
+        model_dir = model.saved_directory
+        model_name = model.saved_name
+    else:
+        with open(join(model_dir, model_name + '.json'), 'r') as f:
+            stored = json.load(f)
+            config = stored['config']
+
+    if 'optimized_graph' in config:
+        input_graph = config['optimized_graph']
+    elif 'frozen_graph' in config:
+        input_graph = config['frozen_graph']
+    else:
+        if 'graph' not in config:
+            raise ValueError('No graph found. Save the model with graph=True')
+        else:  # the model is not frozen
+            input_graph = freeze_graph(None, ', '.join(output_node_names), model_dir=model_dir, model_name=model_name)
+            config['frozen_graph'] = input_graph
+
+    graph_def = strip_input_pipeline(load_graph_def(input_graph), input_node_names, output_node_names)
+
+    transforms = ['quantize_weights']
+    if mode == 'eightbit':
+        transforms.append('quantize_nodes')
+
+    output_graph = TransformGraph(graph_def, input_node_names, output_node_names, transforms)
+
+    if mode == 'eightbit' and calibration_feeds is not None:
+        log_path = _log_requantization_ranges(output_graph, input_node_names, output_node_names, calibration_feeds)
+        try:
+            output_graph = TransformGraph(output_graph, input_node_names, output_node_names,
+                                          ['freeze_requantization_ranges(min_max_log_file="{0}")'.format(log_path)])
+        finally:
+            os.remove(log_path)
+
+    output_graph = TransformGraph(output_graph, input_node_names, output_node_names,
+                                  ['strip_unused_nodes', 'sort_by_execution_order'])
+
+    # Save the quantized graph
+    tf.train.write_graph(output_graph, model_dir, 'quantized_graph.pb', as_text=False)
+
+    # save quantized graph location
+    config['quantized_graph'] = join(model_dir, 'quantized_graph.pb')
+
+    with open(join(model_dir, model_name + '.json'), 'w') as f:
+        if model is not None:
+            json.dump({
+                'config': model.config,
+                'model_structure': model.model_structure,
+                'hyperparameters': model.hyperparameters
+            }, f, indent=4)
+        else:
+            json.dump(stored, f, indent=4)
+
+    return join(model_dir, 'quantized_graph.pb')  # output graph path
+
+
+def export_tflite(model, input_node_names, output_node_names, input_shapes, allow_select_ops=True,
+                  model_dir=None, model_name=None):
+    """
+    Convert the inference graph of a model to a TFLite flatbuffer. TFLite preallocates its tensors, so every input
+    gets a fixed shape (including the batch size).
+
+    :param model: model to export, or None to use model_dir and model_name
+    :param input_node_names: list of input nodes, see Predictor.INPUTS
+    :param output_node_names: list of output nodes, see Predictor.OUTPUTS
+    :param input_shapes: list of the shapes of the inputs
+    :param allow_select_ops: fall back to TensorFlow kernels for ops without a TFLite builtin
+    :param model_dir: directory of the saved model (only used if model is None)
+    :param model_name: name of the saved model (only used if model is None)
+    :return: path to the TFLite model
+    """
+    stored = None
+
+    if model is not None:
+        config = model.config
+        model_dir = model.saved_directory
+        model_name = model.saved_name
+    else:
+        with open(join(model_dir, model_name + '.json'), 'r') as f:
+            stored = json.load(f)
+            config = stored['config']
+
+    if 'optimized_graph' in config:
+        input_graph = config['optimized_graph']
+    elif 'frozen_graph' in config:
+        input_graph = config['frozen_graph']
+    else:
+        if 'graph' not in config:
+            raise ValueError('No graph found. Save the model with graph=True')
+        else:  # the model is not frozen
+            input_graph = freeze_graph(None, ', '.join(output_node_names), model_dir=model_dir, model_name=model_name)
+            config['frozen_graph'] = input_graph
+
+    graph_def = strip_input_pipeline(load_graph_def(input_graph), input_node_names, output_node_names)
+
+    # fix the shapes of the inputs
+    for node in graph_def.node:
+        if node.name in input_node_names:
+            shape = input_shapes[input_node_names.index(node.name)]
+            node.attr['shape'].shape.CopyFrom(tf.TensorShape(shape).as_proto())
+
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+
+    with tf.Session(graph=graph) as sess:
+        converter = tf.lite.TFLiteConverter.from_session(
+            sess,
+            [graph.get_tensor_by_name(name + ':0') for name in input_node_names],
+            [graph.get_tensor_by_name(name + ':0') for name in output_node_names])
+
+        if allow_select_ops:
+            converter.target_ops = {tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS}
+
+        tflite_model = converter.convert()
+
+    output_path = join(model_dir, 'model.tflite')
+    with open(output_path, 'wb') as f:
+        f.write(tflite_model)
+
+    # save TFLite model location
+    config['tflite_model'] = output_path
+
+    with open(join(model_dir, model_name + '.json'), 'w') as f:
+        if model is not None:
+            json.dump({
+                'config': model.config,
+                'model_structure': model.model_structure,
+                'hyperparameters': model.hyperparameters
+            }, f, indent=4)
+        else:
+            json.dump(stored, f, indent=4)
+
+    return output_path  # TFLite model path
+
+
+def count_parameters(model):
+    with model.graph.as_default():
+        return int(sum(np.prod(variable.shape.as_list()) for variable in tf.trainable_variables()))
+
+
+def _factorized_layer(model):
+    # model structure key of the rank, the full kernel and the factors of the layer that can be factorized
+    class_name = model.config['class']
+    if class_name == 'Chatbot':
+        return 'projection_rank', model.projection_kernel, model.projection_factors
+    elif class_name == 'SpeakerVerification':
+        return 'fully_connected_1_rank', model.dense_kernel, model.dense_factors
+    else:
+        raise ValueError('Only chatbot and speaker verification models can be factorized')
+
+
+def truncated_svd(matrix, rank):
+    """
+    Best rank-r approximation of a matrix, as the product of two matrices
+
+    :param matrix: numpy array [m, n]
+    :param rank: rank of the approximation
+    :return: u [m, rank] and v [rank, n], with the singular values split evenly between them
+    """
+    u, s, vt = np.linalg.svd(matrix, full_matrices=False)
+    s = np.sqrt(s[:rank])
+    return u[:, :rank] * s, s[:, None] * vt[:rank]
+
+
+def factorize(model, rank, directory, name='model', data=None, fine_tune_epochs=0):
+    """
+    Replace the largest dense layer of a trained model (the projection layer of a chatbot or the fully connected
+    layer of a speaker verification model) by two matrices of the given rank, initialized by a truncated SVD of
+    its kernel. All other weights are copied, the optimizer starts anew.
+    The factorized model is optionally fine-tuned and saved as a new model that can be loaded with Model.load.
+
+    :param model: trained model
+    :param rank: rank of the factorized layer
+    :param directory: directory to save the factorized model to
+    :param name: name of the factorized model
+    :param data: data to build and fine-tune the factorized model with (Optional, defaults to the data of the model)
+    :param fine_tune_epochs: number of epochs to train after factorizing
+    :return: the factorized model
+    """
+    rank_key, kernel, _ = _factorized_layer(model)
+    if kernel is None:
+        raise ValueError('The model is already factorized')
+
+    shape = kernel.shape.as_list()
+    if not 0 < rank < min(shape):
+        raise ValueError('Rank must be between 1 and {0}'.format(min(shape) - 1))
+
+    if data is None:
+        data = model.data
+
+    with model.graph.as_default():
+        variables = [variable for variable in tf.trainable_variables() if variable is not kernel]
+    if isinstance(getattr(model, 'word_embedding', None), tf.Variable):
+        variables.append(model.word_embedding)  # not trainable
+    values = model.sess.run(variables)
+    u, v = truncated_svd(model.sess.run(kernel), rank)
+
+    model_config = model.model_config()
+    config = dict(model_config.config)
+    for key in ('graph', 'frozen_graph', 'optimized_graph', 'quantized_graph', 'tflite_model'):
+        config.pop(key, None)  # graphs of the original model
+    model_config = type(model_config)(config=config,
+                                      hyperparameters=dict(model_config.hyperparameters),
+                                      model_structure=dict(model_config.model_structure, **{rank_key: rank}))
+
+    factorized = type(model)()
+    factorized.build_graph(model_config, data)
+    factorized.init_word_embedding = False  # copied from the original model
+    factorized.init_tensorflow(init_param=True, init_sess=True)
+
+    _, _, factors = _factorized_layer(factorized)
+    with factorized.graph.as_default():
+        new_variables = [variable for variable in tf.trainable_variables() if all(variable is not factor for factor in factors)]
+    if isinstance(getattr(factorized, 'word_embedding', None), tf.Variable):
+        new_variables.append(factorized.word_embedding)
+
+    # both graphs create the other variables in the same order
+    if [variable.shape.as_list() for variable in new_variables] != [list(value.shape) for value in values]:
+        raise ValueError('The variables of the factorized model do not match the original model')
+
+    for variable, value in zip(new_variables, values):
+        variable.load(value, factorized.sess)
+    factors[0].load(u, factorized.sess)
+    factors[1].load(v, factorized.sess)
+
+    if fine_tune_epochs > 0:
+        factorized.train(fine_tune_epochs)
+
+    factorized.save(directory, name)
+
+    return factorized
+
+
+def compare_predictions(original, compressed, input_data, repeat=3):
+    """
+    Latency and agreement of the predictions of a model and its compressed version
+
+    :param original: original model
+    :param compressed: compressed model (e.g. see factorize)
+    :param input_data: input of the predict method of both models
+    :param repeat: number of timed runs, after one warm-up run
+    :return: a dict of the report
+    """
+    report = {}
+    outputs = {}
+
+    for role, model in (('original', original), ('compressed', compressed)):
+        if model.config['class'] == 'SpeakerVerification':
+            def predict():
+                return model.predict(input_data, raw=True)
+        else:
+            def predict():
+                return model.predict(input_data)
+
+        outputs[role] = predict()  # warm-up
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            predict()
+        report[role] = {'parameters': count_parameters(model),
+                        'latency': (time.perf_counter() - start) / repeat}
+
+    if original.config['class'] == 'SpeakerVerification':
+        original_outputs, compressed_outputs = np.array(outputs['original']), np.array(outputs['compressed'])
+        report['agreement'] = float(np.mean((original_outputs > 0.5) == (compressed_outputs > 0.5)))
+        report['mean_difference'] = float(np.mean(np.abs(original_outputs - compressed_outputs)))
+    else:
+        pairs = list(zip(outputs['original'], outputs['compressed']))
+        report['agreement'] = sum(a == b for a, b in pairs) / len(pairs)
+
+    report['speedup'] = report['original']['latency'] / report['compressed']['latency']
+
+    return report
+
+
+def autotune_threads(model, batch_size=1, repeat=10, candidates=None):
+    """
+    Benchmark thread pool sizes on this machine and keep the fastest. Every candidate runs the warm-up batches of
+    the model (see Model.warm_up_batches) in a new session. The best thread counts are stored in the config of the
+    model, and its session is replaced by one using them (save the model to keep them).
+
+    :param model: model to tune
+    :param batch_size: batch size to tune for, 1 for serving latency
+    :param repeat: number of timed runs of every candidate, after one warm-up run
+    :param candidates: list of (intra_op_threads, inter_op_threads) (Optional, defaults to powers of two up to the
+                       number of cores with 1 or 2 inter op threads)
+    :return: a dict of the seconds per run of every candidate and the best candidate
+    """
+    if candidates is None:
+        cores = psutil.cpu_count(logical=False) or psutil.cpu_count() or 1
+        intra = sorted({2 ** i for i in range(cores.bit_length()) if 2 ** i <= cores} | {cores})
+        candidates = [(i, j) for i in intra for j in (1, 2)]
+
+    batches = model.warm_up_batches(batch_size)
+    if not batches:
+        raise ValueError('The model has no warm-up batches to benchmark')
+
+    directory = tempfile.mkdtemp()
+    checkpoint = model.saver.save(model.sess, join(directory, 'model'), write_meta_graph=False, write_state=False)
+
+    previous = (model.config.get('intra_op_threads'), model.config.get('inter_op_threads'))
+    results = {}
+    best = None
+    best_sess = None
+
+    try:
+        for intra_op_threads, inter_op_threads in candidates:
+            model.config['intra_op_threads'] = intra_op_threads
+            model.config['inter_op_threads'] = inter_op_threads
+
+            sess = tf.Session(config=model.session_config(), graph=model.graph)
+            model.saver.restore(sess, checkpoint)
+
+            for fetches, feed_dict in batches:
+                sess.run(fetches, feed_dict=feed_dict)  # warm-up
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for fetches, feed_dict in batches:
+                    sess.run(fetches, feed_dict=feed_dict)
+            results[(intra_op_threads, inter_op_threads)] = (time.perf_counter() - start) / repeat
+
+            if best is None or results[(intra_op_threads, inter_op_threads)] < results[best]:
+                best = (intra_op_threads, inter_op_threads)
+                if best_sess is not None:
+                    best_sess.close()
+                best_sess = sess
+            else:
+                sess.close()
+    except Exception:
+        model.config['intra_op_threads'], model.config['inter_op_threads'] = previous
+        if best_sess is not None:
+            best_sess.close()
+        raise
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    model.config['intra_op_threads'], model.config['inter_op_threads'] = best
+    model.sess.close()
+    model.sess = best_sess
+    if hasattr(model, 'intent_ner_model'):
+        model.intent_ner_model.sess = model.sess  # combined chatbots share their session
+
+    return {'seconds_per_run': {'{0}x{1}'.format(*candidate): seconds for candidate, seconds in results.items()},
+            'intra_op_threads': best[0],
+            'inter_op_threads': best[1]}
+
+
+def benchmark_predict_order(model, input_data, repeat=10):
+    """
+    Compare the prediction time of a chatbot or intent NER model with its inputs sorted by length
+    (see Model.get_predict_order) and in their original order
+
+    :param model: model to benchmark
+    :param input_data: list of input sentences
+    :param repeat: number of timed runs of every order, after one warm-up run
+    :return: a dict of the seconds per run of both orders and the speedup of sorting
+    """
+    previous = model.sort_predict_inputs
+    results = {}
+
+    try:
+        for name, sort in (('unsorted', False), ('sorted', True)):
+            model.sort_predict_inputs = sort
+            model.predict(input_data, raw=True)  # warm-up, raw bypasses the response cache
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                model.predict(input_data, raw=True)
+            results[name] = (time.perf_counter() - start) / repeat
+    finally:
+        model.sort_predict_inputs = previous
+
+    results['speedup'] = results['unsorted'] / results['sorted']
+
+    return results
@@ -2,6 +2,7 @@ import errno
 import json
 import re
 import shutil
+import time
 from os import mkdir
 from os.path import join, isfile, splitext
 
@@ -25,6 +26,9 @@ class Waifu:
 
         self.embedding = None
 
+        # cached predict results, see enable_response_cache
+        self.response_cache = None
+
     def add_combined_chatbot_model(self, directory, name='model'):
 
         if self.combined_chatbot is not None:
@@ -39,7 +43,7 @@ class Waifu:
         self.config['models']['CombinedChatbotDirectory'] = directory
         self.config['models']['CombinedChatbotName'] = name
 
-    def load_combined_chatbot_model(self):
+    def load_combined_chatbot_model(self, warm_up=False):
 
         if self.combined_chatbot is not None:
             self.combined_chatbot.close()
@@ -52,15 +56,33 @@ class Waifu:
             self.config['models']['CombinedChatbotDirectory'], self.config['models']['CombinedChatbotName']
         )
 
+        if warm_up:
+            self.combined_chatbot.warm_up()
+
     def add_embedding(self, embedding):
         self.embedding = embedding
         if self.combined_chatbot is not None:
             self.combined_chatbot.add_embedding(embedding)
 
+    def enable_response_cache(self, max_size=1024, ttl=None, path=None):
+        """
+        Cache predict results of the combined chatbot model, keyed by the token indexes of the sentence
+
+        :param max_size: maximum number of cached responses
+        :param ttl: number of seconds a response stays valid (None for no expiry)
+        :param path: file to persist the cache in (Optional)
+        :return: the response cache
+        """
+        self.response_cache = am.ResponseCache(max_size=max_size, ttl=ttl, path=path)
+        return self.response_cache
+
+    def disable_response_cache(self):
+        self.response_cache = None
+
     def add_regex(self, regex_rule, isIntentNER, result):
         self.config['regex_rule'][regex_rule] = [isIntentNER, result]
 
-    def predict(self, sentence):
+    def predict(self, sentence, session_id=None):
 
         regex_rule = self.config['regex_rule']
 
@@ -91,7 +113,31 @@ class Waifu:
                 else:  # return chat
                     return {'message': regex_rule[rule][1]}
 
-        result = self.combined_chatbot.predict(sentence)
+        if session_id is not None:
+            # responses depend on the conversation history and are never cached
+            return self.combined_chatbot.predict_conversation(sentence, session_id)
+
+        if self.response_cache is None:
+            return self.combined_chatbot.predict(sentence)
+
+        # invalidates the cache whenever the weights of either model change (training, reloading)
+        self.response_cache.set_identity((self.combined_chatbot.weights_identity(),
+                                          self.combined_chatbot.intent_ner_model.weights_identity()))
+
+        x, _, _ = am.Utils.sentence_to_index(am.Chatbot.Parse.split_sentence(sentence.lower()),
+                                             self.combined_chatbot.data['embedding'].words_to_index,
+                                             max_seq=self.combined_chatbot.model_structure['max_sequence'],
+                                             go=True,
+                                             eos=True)
+        key = self.response_cache.make_key(x)
+
+        result = self.response_cache.get(key)
+
+        if result is None:
+            start_time = time.time()
+            result = self.combined_chatbot.predict(sentence)
+            self.response_cache.record_predict_time(time.time() - start_time)
+            self.response_cache.put(key, result)
 
         return result
 
@@ -142,13 +188,16 @@ class Waifu:
         with open(join(directory, name + '.json'), 'w') as f:
             json.dump(self.config, f, indent=4)
 
+        if self.response_cache is not None and self.response_cache.path is not None:
+            self.response_cache.save()
+
         self.saved_directory = directory
         self.saved_name = name
 
         return directory
 
     @classmethod
-    def load(cls, directory, name='waifu'):
+    def load(cls, directory, name='waifu', warm_up=False):
         with open(join(directory, name + '.json'), 'r') as f:
             config = json.load(f)
 
@@ -156,12 +205,15 @@ class Waifu:
 
         # load models
         if 'CombinedChatbotDirectory' in config['models']:
-            waifu.load_combined_chatbot_model()
+            waifu.load_combined_chatbot_model(warm_up=warm_up)
 
         # load embedding
         if 'embedding_directory' in config:
+            start = time.perf_counter()
             waifu.embedding = am.WordEmbedding.load(config['embedding_directory'], config['embedding_name'])
             waifu.add_embedding(waifu.embedding)
+            if waifu.combined_chatbot is not None:
+                waifu.combined_chatbot.load_profile['embedding'] = time.perf_counter() - start
 
         waifu.saved_directory = directory
         waifu.saved_name = name
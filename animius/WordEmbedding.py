@@ -4,6 +4,8 @@ from os.path import join
 import pickle
 import errno
 
+import animius as am
+
 
 class WordEmbedding:
     UNK = 0
@@ -27,6 +29,15 @@ class WordEmbedding:
         self.saved_directory = None
         self.saved_name = None
 
+        # numpy copy of words for vectorized decoding, see words_array
+        self._words_array = None
+
+    @property
+    def words_array(self):
+        if self._words_array is None or len(self._words_array) != len(self.words):
+            self._words_array = np.array(self.words, dtype=object)
+        return self._words_array
+
     def create_embedding(self, glove_path, vocab_size=100000):
 
         self.embedding = []
@@ -61,6 +72,29 @@ class WordEmbedding:
 
         assert self.embedding.shape[0] == len(self.words_to_index)
 
+    def sort_by_frequency(self, sentences):
+        """
+        Reorder the vocabulary by the number of occurrences of every word in a corpus, most frequent first.
+        The special tokens keep their indexes. Embeddings created from GloVe are already roughly ordered by
+        frequency, sorting on the training data fits the adaptive softmax and sampled softmax of the chatbot better.
+        Indexes change, so only sort before creating a model.
+
+        :param sentences: iterable of sentences (str)
+        """
+        counts = np.zeros(len(self.words), dtype=np.int64)
+        for sentence in sentences:
+            for word in am.Chatbot.Parse.split_sentence(sentence.lower()):
+                if word in self.words_to_index:
+                    counts[self.words_to_index[word]] += 1
+
+        # keep <UNK>, <GO> and <EOS> in front, ties keep their current order
+        order = np.concatenate([np.arange(3), 3 + np.argsort(-counts[3:], kind='stable')])
+
+        self.embedding = self.embedding[order]
+        self.words = [self.words[i] for i in order]
+        self.words_to_index = {word: index for index, word in enumerate(self.words)}
+        self._words_array = None
+
     def save(self, directory=None, name='embedding'):
         """
         Save an embedding object to a directory
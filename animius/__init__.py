@@ -5,6 +5,12 @@
 from animius.Model import Model
 from animius.ModelConfig import *
 from animius.WordEmbedding import WordEmbedding
+from animius.ResponseCache import ResponseCache
+from animius.CheckpointManager import CheckpointManager
+from animius.DataParallelTrainer import DataParallelTrainer
+from animius.TrainingMetrics import TrainingMetrics, JSONLinesSink, TensorBoardSink
+from animius.Evaluator import Evaluator
+from animius.Sweep import Sweep
 from animius.ModelData import *
 from animius.Console import Console
 from animius.Commands import Commands
@@ -13,6 +19,8 @@ import animius.Chatbot as Chatbot
 import animius.IntentNER as IntentNER
 import animius.SpeakerVerification as SpeakerVerification
 import animius.Utils as Utils
+import animius.Predictor as Predictor
+import animius.Autotune as Autotune
 
 from animius.Waifu import Waifu
 